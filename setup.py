@@ -35,7 +35,6 @@ setup(
     version='0.1',
     description='Plugin to migrate your data from testrail',
     install_requires=[
-        'tqdm==4.64.1',
         'aiohttp==3.8.3',
         'aiofiles==22.1.0',
         'factory-boy==3.2.1'
@@ -0,0 +1,69 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import json
+from typing import Any, Dict, List
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path: str, report: Dict[str, Any]):
+    with open(path, 'w') as baseline_file:
+        json.dump(report, baseline_file, indent=2, sort_keys=True)
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any], metrics: List[str],
+                     max_regression: float) -> List[str]:
+    """
+    Compare benchmark report with baseline report.
+
+    Args:
+        report: report of current run
+        baseline: report saved by previous run
+        metrics: keys of throughput metrics of reports, bigger value is better
+        max_regression: allowed relative drop of metric, e.g. 0.2 allows metric to be 20% lower than baseline
+
+    Returns:
+        list of regression messages, empty if report is not worse than baseline
+    """
+    if report['settings'] != baseline['settings']:
+        return ['Baseline was recorded with other settings, run benchmark with settings from baseline']
+    regressions = []
+    for metric in metrics:
+        expected = baseline[metric] * (1 - max_regression)
+        if report[metric] < expected:
+            regressions.append(
+                f'{metric} is {report[metric]:.2f}, baseline is {baseline[metric]:.2f}, '
+                f'allowed minimum is {expected:.2f}'
+            )
+    return regressions
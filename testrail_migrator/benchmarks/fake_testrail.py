@@ -0,0 +1,256 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import asyncio
+import random
+import socket
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict
+
+from aiohttp import web
+
+from testrail_migrator.benchmarks.synthetic import SyntheticProject
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class FakeTestRail:
+    """
+    In-process testrail api serving synthetic project, meant for benchmarks without network.
+
+    Server runs its own event loop in background thread and listens on random local port. Every request waits for
+    configured latency and may fail with 500 or 429 status to simulate unstable or rate limited server.
+    """
+
+    def __init__(self, project: SyntheticProject, latency: float = 0.0, latency_jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 1):
+        """
+        Init method for FakeTestRail.
+
+        Args:
+            project: synthetic project to serve
+            latency: seconds every response is delayed for
+            latency_jitter: max random seconds added to latency
+            error_rate: share of requests answered with 500 status
+            rate_limit_rate: share of requests answered with 429 status
+            seed: seed of random failures and jitter
+        """
+        self.project = project
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.responses = Counter()
+        self.requests_by_method = Counter()
+        self._random = random.Random(seed)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._started = threading.Event()
+        self._port = None
+        self._build_indexes()
+
+    @property
+    def api_url(self) -> str:
+        return f'http://127.0.0.1:{self._port}/index.php?/api/v2'
+
+    @property
+    def requests_count(self) -> int:
+        return sum(self.responses.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests_count,
+            'responses_by_status': {str(status): count for status, count in sorted(self.responses.items())},
+            'requests_by_method': dict(self.requests_by_method.most_common()),
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self._port = sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, args=(sock,), name='fake-testrail', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _serve(self, sock):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get('/index.php', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    def _build_indexes(self):
+        project = self.project
+        self._cases_by_suite = defaultdict(list)
+        for case in project.cases:
+            self._cases_by_suite[case['suite_id']].append(case)
+        self._sections_by_suite = defaultdict(list)
+        for section in project.sections:
+            self._sections_by_suite[section['suite_id']].append(section)
+        self._tests_by_run = defaultdict(list)
+        for test in project.tests:
+            self._tests_by_run[test['run_id']].append(test)
+        self._results_by_test = defaultdict(list)
+        for result in project.results:
+            self._results_by_test[result['test_id']].append(result)
+        self._plans = {plan['id']: plan for plan in project.plans}
+        self._runs = {run['id']: run for run in project.runs}
+        self._milestones = {milestone['id']: milestone for milestone in project.milestones}
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        path, *params = request.query_string.split('&')
+        query_params = dict(param.split('=', 1) for param in params if '=' in param)
+        method, *args = path.replace('/api/v2/', '', 1).strip('/').split('/')
+        self.requests_by_method[method] += 1
+        delay = self.latency + self._random.uniform(0, self.latency_jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return self._respond(web.json_response({'error': 'API Rate Limit Exceeded'}, status=429,
+                                                   headers={'Retry-After': '1'}))
+        if roll < self.rate_limit_rate + self.error_rate:
+            return self._respond(web.json_response({'error': 'Internal server error'}, status=500))
+        handler = getattr(self, f'_api_{method}', None)
+        if handler is None:
+            return self._respond(web.json_response({'error': f'Unknown method {method}'}, status=400))
+        args = [int(arg) if arg.isdigit() else arg for arg in args if arg != '']
+        return self._respond(handler(*args, **query_params))
+
+    def _respond(self, response: web.StreamResponse) -> web.StreamResponse:
+        self.responses[response.status] += 1
+        return response
+
+    def _api_get_users(self, *args):
+        return web.json_response(self.project.users)
+
+    def _api_get_result_fields(self):
+        return web.json_response(self.project.result_fields)
+
+    def _api_get_project(self, project_id):
+        return web.json_response(self.project.project)
+
+    def _api_get_suites(self, project_id):
+        return web.json_response(self.project.suites)
+
+    def _api_get_suite(self, suite_id):
+        return web.json_response(next(suite for suite in self.project.suites if suite['id'] == suite_id))
+
+    def _api_get_cases(self, project_id, suite_id):
+        return web.json_response(self._cases_by_suite[int(suite_id)])
+
+    def _api_get_sections(self, project_id, suite_id):
+        return web.json_response(self._sections_by_suite[int(suite_id)])
+
+    def _api_get_configs(self, project_id):
+        return web.json_response(self.project.configs)
+
+    def _api_get_milestones(self, project_id, is_completed=None):
+        return web.json_response(self._filter_completed(self.project.milestones, is_completed))
+
+    def _api_get_milestone(self, milestone_id):
+        return web.json_response(self._milestones[milestone_id])
+
+    def _api_get_plans(self, project_id, is_completed=None):
+        plans = [
+            {key: value for key, value in plan.items() if key != 'entries'}
+            for plan in self._filter_completed(self.project.plans, is_completed)
+        ]
+        return web.json_response(plans)
+
+    def _api_get_plan(self, plan_id):
+        return web.json_response(self._plans[plan_id])
+
+    def _api_get_runs(self, project_id, is_completed=None):
+        runs = [run for run in self.project.runs if run['plan_id'] is None]
+        return web.json_response(self._filter_completed(runs, is_completed))
+
+    def _api_get_run(self, run_id):
+        return web.json_response(self._runs[run_id])
+
+    def _api_get_tests(self, run_id):
+        return web.json_response(self._tests_by_run[run_id])
+
+    def _api_get_results(self, test_id):
+        return web.json_response(self._results_by_test[test_id])
+
+    def _api_get_attachments_for_case(self, case_id):
+        return web.json_response(self.project.attachments_by_parent.get(('case', case_id), []))
+
+    def _api_get_attachments_for_plan(self, plan_id):
+        return web.json_response(self.project.attachments_by_parent.get(('plan', plan_id), []))
+
+    def _api_get_attachments_for_plan_entry(self, plan_id, entry_id):
+        return web.json_response([])
+
+    def _api_get_attachments_for_run(self, run_id):
+        return web.json_response(self.project.attachments_by_parent.get(('run', run_id), []))
+
+    def _api_get_attachments_for_test(self, test_id):
+        attachments = []
+        for result in self._results_by_test[test_id]:
+            attachments.extend(self.project.attachments_by_parent.get(('result', result['id']), []))
+        return web.json_response(attachments)
+
+    def _api_get_attachment(self, attachment_id):
+        attachment = self.project.attachments.get(attachment_id)
+        if attachment is None:
+            return web.json_response({'error': 'Field :attachment_id is not a valid attachment.'}, status=400)
+        # Bodies are not kept, so memory of benchmark process does not grow with served attachments
+        return web.Response(
+            body=PNG_SIGNATURE + bytes(max(attachment['size'] - len(PNG_SIGNATURE), 0)),
+            content_type='image/png',
+            headers={'Content-Disposition': f'attachment; filename="{attachment["name"]}"'},
+        )
+
+    @staticmethod
+    def _filter_completed(instances, is_completed):
+        if is_completed is None:
+            return instances
+        return [instance for instance in instances if int(instance['is_completed']) == int(is_completed)]
@@ -0,0 +1,423 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import itertools
+import math
+import random
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict
+
+BASE_TIMESTAMP = 1672531200
+TESTRAIL_STATUSES = [1, 2, 3, 4, 5]
+
+
+@dataclass
+class SyntheticProjectConfig:
+    """
+    Sizes of synthetic testrail project.
+
+    Run sizes follow pareto distribution with shape run_size_skew and mean tests_per_run, shape closer to 1 gives few
+    huge runs and many small ones, 0 makes all runs equal. Every section gets subsections_per_section children until
+    section_depth levels are made. Cases get steps_per_case separated steps and results of such cases get step
+    results.
+    """
+
+    suites: int = 5
+    sections_per_suite: int = 20
+    section_depth: int = 1
+    subsections_per_section: int = 2
+    cases_per_section: int = 10
+    steps_per_case: int = 0
+    milestones: int = 3
+    plans_per_milestone: int = 3
+    runs_per_plan: int = 4
+    runs_per_milestone: int = 4
+    tests_per_run: int = 50
+    run_size_skew: float = 0.0
+    results_per_test: int = 2
+    attachment_ratio: float = 0.1
+    attachment_size: int = 10240
+    users: int = 20
+    seed: int = 1
+
+    def __post_init__(self):
+        if self.run_size_skew and self.run_size_skew <= 1:
+            raise ValueError('Run size skew must be above 1, pareto distribution has no mean otherwise')
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @property
+    def cases_per_suite(self) -> int:
+        sections = sum(self.subsections_per_section ** level for level in range(self.section_depth))
+        return self.sections_per_suite * sections * self.cases_per_section
+
+    def scaled_to_results(self, results: int) -> 'SyntheticProjectConfig':
+        """
+        Make config of project with about given number of results by adding runs to milestones.
+
+        Args:
+            results: wanted number of results
+
+        Returns:
+            new config, other sizes are kept
+        """
+        results_per_run = min(self.tests_per_run, self.cases_per_suite) * self.results_per_test
+        runs = math.ceil(results / max(results_per_run, 1))
+        milestones = max(self.milestones, 1)
+        runs_in_plans = milestones * self.plans_per_milestone * self.runs_per_plan
+        return replace(
+            self,
+            milestones=milestones,
+            runs_per_milestone=max(math.ceil((runs - runs_in_plans) / milestones), 0),
+        )
+
+
+class SyntheticProject:
+    """
+    Testrail project generated from config, data is kept in the same shape testrail api returns it.
+
+    Same config and seed always give the same project.
+    """
+
+    def __init__(self, config: SyntheticProjectConfig, project_id: int = 1):
+        self.config = config
+        self.project_id = project_id
+        self._random = random.Random(config.seed)
+        self._ids = {}
+        self.users = []
+        self.result_fields = []
+        self.suites = []
+        self.sections = []
+        self.cases = []
+        self.configs = []
+        self.milestones = []
+        self.plans = []
+        self.runs = []
+        self.tests = []
+        self.results = []
+        self.attachments = {}
+        self.attachments_by_parent = {}
+        self.project = {
+            'id': project_id,
+            'name': f'Synthetic project {project_id}',
+            'announcement': 'Project generated for benchmarks',
+            'show_announcement': False,
+            'is_completed': False,
+            'suite_mode': 3,
+        }
+        self._generate()
+
+    def next_id(self, kind: str) -> int:
+        if kind not in self._ids:
+            self._ids[kind] = itertools.count(1)
+        return next(self._ids[kind])
+
+    def _generate(self):
+        self._generate_users()
+        self._generate_result_fields()
+        self._generate_suites()
+        self._generate_configs()
+        self._generate_milestones()
+        cases_by_suite = {}
+        for case in self.cases:
+            cases_by_suite.setdefault(case['suite_id'], []).append(case)
+        for run in self.runs:
+            self._generate_tests(run, cases_by_suite.get(run['suite_id'], []))
+
+    def _generate_users(self):
+        for _ in range(self.config.users):
+            user_id = self.next_id('user')
+            self.users.append({
+                'id': user_id,
+                'name': f'User{user_id} Synthetic',
+                'email': f'user{user_id}@example.com',
+                'is_active': True,
+            })
+
+    def _generate_result_fields(self):
+        self.result_fields.append({
+            'id': self.next_id('result_field'),
+            'system_name': 'custom_environment',
+            'label': 'Environment',
+            'type_id': 1,
+            'configs': [{'context': {'is_global': True}, 'options': {'is_required': False}}],
+        })
+        self.result_fields.append({
+            'id': self.next_id('result_field'),
+            'system_name': 'custom_platforms',
+            'label': 'Platforms',
+            'type_id': 12,
+            'configs': [
+                {
+                    'context': {'is_global': True},
+                    'options': {'is_required': False, 'items': '1, Linux\n2, Windows\n3, macOS'},
+                },
+            ],
+        })
+
+    def _generate_suites(self):
+        for _ in range(self.config.suites):
+            suite_id = self.next_id('suite')
+            self.suites.append({
+                'id': suite_id,
+                'name': f'Suite {suite_id}',
+                'description': f'Description of suite {suite_id}',
+                'project_id': self.project_id,
+            })
+            for _ in range(self.config.sections_per_suite):
+                self._generate_section(suite_id, parent_id=None, depth=0)
+
+    def _generate_section(self, suite_id: int, parent_id, depth: int):
+        section_id = self.next_id('section')
+        self.sections.append({
+            'id': section_id,
+            'suite_id': suite_id,
+            'name': f'Section {section_id}',
+            'description': None,
+            'parent_id': parent_id,
+            'depth': depth,
+            'display_order': section_id,
+        })
+        for _ in range(self.config.cases_per_section):
+            self._generate_case(suite_id, section_id)
+        if depth + 1 < self.config.section_depth:
+            for _ in range(self.config.subsections_per_section):
+                self._generate_section(suite_id, section_id, depth + 1)
+
+    def _generate_case(self, suite_id: int, section_id: int):
+        case_id = self.next_id('case')
+        created_on = BASE_TIMESTAMP + case_id
+        case = {
+            'id': case_id,
+            'title': f'Case {case_id}',
+            'section_id': section_id,
+            'suite_id': suite_id,
+            'created_on': created_on,
+            'updated_on': created_on,
+            'created_by': self._random_user_id(),
+            'custom_preconds': f'Preconditions of case {case_id}',
+            'custom_steps': f'Steps of case {case_id}',
+            'custom_expected': f'Expected result of case {case_id}',
+        }
+        if inline_attachment := self._maybe_attachment('case', case_id):
+            case['custom_steps'] += f'\n![](index.php?/attachments/get/{inline_attachment["id"]})'
+        if self.config.steps_per_case:
+            case['custom_steps_separated'] = [
+                {
+                    'content': f'Step {idx} of case {case_id}\nDetails of step {idx}',
+                    'expected': f'Expected result of step {idx}',
+                    'additional_info': f'Additional info of step {idx}' if idx % 2 else None,
+                    'refs': f'REQ-{case_id}-{idx}' if idx % 3 == 0 else None,
+                }
+                for idx in range(1, self.config.steps_per_case + 1)
+            ]
+        self.cases.append(case)
+
+    def _generate_configs(self):
+        group_id = self.next_id('config_group')
+        self.configs.append({
+            'id': group_id,
+            'name': 'Browsers',
+            'project_id': self.project_id,
+            'configs': [
+                {'id': self.next_id('config'), 'group_id': group_id, 'name': name}
+                for name in ['Chrome', 'Firefox', 'Safari']
+            ],
+        })
+
+    def _generate_milestones(self):
+        for _ in range(self.config.milestones):
+            milestone_id = self.next_id('milestone')
+            self.milestones.append({
+                'id': milestone_id,
+                'name': f'Milestone {milestone_id}',
+                'description': f'Description of milestone {milestone_id}',
+                'is_completed': False,
+                'completed_on': None,
+                'started_on': BASE_TIMESTAMP,
+                'due_on': BASE_TIMESTAMP + 86400 * 30,
+                'parent_id': None,
+                'project_id': self.project_id,
+                'milestones': [],
+            })
+            for _ in range(self.config.plans_per_milestone):
+                self._generate_plan(milestone_id)
+            for _ in range(self.config.runs_per_milestone):
+                self.runs.append(self._make_run(milestone_id, plan_id=None))
+
+    def _generate_plan(self, milestone_id: int):
+        plan_id = self.next_id('plan')
+        entries = []
+        for _ in range(self.config.runs_per_plan):
+            run = self._make_run(milestone_id, plan_id)
+            entries.append({
+                'id': f'entry-{run["id"]}',
+                'suite_id': run['suite_id'],
+                'name': run['name'],
+                'runs': [run],
+            })
+            self.runs.append(run)
+        self._maybe_attachment('plan', plan_id)
+        self.plans.append({
+            'id': plan_id,
+            'name': f'Plan {plan_id}',
+            'description': f'Description of plan {plan_id}',
+            'milestone_id': milestone_id,
+            'is_completed': False,
+            'completed_on': None,
+            'created_on': BASE_TIMESTAMP + plan_id,
+            'created_by': self._random_user_id(),
+            'project_id': self.project_id,
+            'entries': entries,
+        })
+
+    def _make_run(self, milestone_id: int, plan_id) -> Dict[str, Any]:
+        run_id = self.next_id('run')
+        self._maybe_attachment('run', run_id)
+        return {
+            'id': run_id,
+            'suite_id': self._random.choice(self.suites)['id'],
+            'name': f'Run {run_id}',
+            'description': f'Description of run {run_id}',
+            'milestone_id': milestone_id,
+            'plan_id': plan_id,
+            'config_ids': [self._random.choice(self.configs[0]['configs'])['id']],
+            'is_completed': False,
+            'completed_on': None,
+            'created_on': BASE_TIMESTAMP + run_id,
+            'updated_on': BASE_TIMESTAMP + run_id,
+            'project_id': self.project_id,
+        }
+
+    def _run_size(self) -> int:
+        shape = self.config.run_size_skew
+        if not shape:
+            return self.config.tests_per_run
+        # Pareto distribution has mean shape / (shape - 1), it is scaled to tests_per_run
+        scale = (shape - 1) / shape
+        return max(round(self.config.tests_per_run * scale * self._random.paretovariate(shape)), 1)
+
+    def _generate_tests(self, run, suite_cases):
+        for case in self._random.sample(suite_cases, min(self._run_size(), len(suite_cases))):
+            test_id = self.next_id('test')
+            test = {
+                'id': test_id,
+                'case_id': case['id'],
+                'run_id': run['id'],
+                'status_id': self._random.choice(TESTRAIL_STATUSES),
+                'assignedto_id': self._random_user_id(),
+                'title': case['title'],
+            }
+            self.tests.append(test)
+            for _ in range(self.config.results_per_test):
+                self.results.append(self._make_result(test, case))
+
+    def _make_result(self, test, case) -> Dict[str, Any]:
+        result_id = self.next_id('result')
+        attachment = self._maybe_attachment('result', result_id)
+        result = {
+            'id': result_id,
+            'test_id': test['id'],
+            'status_id': self._random.choice(TESTRAIL_STATUSES),
+            'created_on': BASE_TIMESTAMP + result_id,
+            'created_by': self._random_user_id(),
+            'assignedto_id': test['assignedto_id'],
+            'comment': f'Result {result_id} of case {case["id"]}',
+            'defects': None,
+            'elapsed': '1m',
+            'version': None,
+            'attachment_ids': [attachment['id']] if attachment else [],
+            'custom_environment': self._random.choice(['staging', 'production']),
+            'custom_platforms': sorted(self._random.sample([1, 2, 3], self._random.randint(1, 3))),
+        }
+        if steps := case.get('custom_steps_separated'):
+            result['custom_step_results'] = [
+                {
+                    'content': step['content'],
+                    'expected': step['expected'],
+                    'actual': f'Actual result of step {idx}',
+                    'status_id': self._random.choice(TESTRAIL_STATUSES),
+                }
+                for idx, step in enumerate(steps, start=1)
+            ]
+        return result
+
+    def _maybe_attachment(self, parent_type: str, parent_id: int):
+        if self._random.random() >= self.config.attachment_ratio:
+            return None
+        attachment_id = self.next_id('attachment')
+        attachment = {
+            'id': attachment_id,
+            'name': f'attachment-{attachment_id}.png',
+            'size': self.config.attachment_size,
+            'created_on': BASE_TIMESTAMP + attachment_id,
+            'user_id': self._random_user_id(),
+            'project_id': self.project_id,
+            'entity_type': parent_type,
+            'entity_id': parent_id,
+        }
+        self.attachments[attachment_id] = attachment
+        self.attachments_by_parent.setdefault((parent_type, parent_id), []).append(attachment)
+        return attachment
+
+    def _random_user_id(self) -> int:
+        return self._random.randint(1, self.config.users)
+
+    def as_backup(self) -> Dict[str, Any]:
+        """
+        Make backup of project in format saved by download task, attachments are not included.
+
+        Returns:
+            backup data
+        """
+        run_ids = {
+            'parent_plan': {run['id'] for run in self.runs if run['plan_id'] is not None},
+            'parent_mile': {run['id'] for run in self.runs if run['plan_id'] is None},
+        }
+        test_ids = {
+            key: {test['id'] for test in self.tests if test['run_id'] in ids} for key, ids in run_ids.items()
+        }
+        backup = {
+            'users': self.users,
+            'custom_result_fields': self.result_fields,
+            'project': self.project,
+            'suites': self.suites,
+            'sections': self.sections,
+            'cases': self.cases,
+            'configs': self.configs,
+            'milestones': self.milestones,
+            'plans': self.plans,
+        }
+        for key in ['parent_plan', 'parent_mile']:
+            backup[f'runs_{key}'] = [run for run in self.runs if run['id'] in run_ids[key]]
+            backup[f'tests_{key}'] = [test for test in self.tests if test['id'] in test_ids[key]]
+            backup[f'results_{key}'] = [result for result in self.results if result['test_id'] in test_ids[key]]
+        return backup
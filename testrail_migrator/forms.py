@@ -30,10 +30,16 @@
 # <http://www.gnu.org/licenses/>.
 from django import forms
 from django.contrib.postgres.forms import SimpleArrayField
+from django.core.exceptions import ValidationError
 
 from .models import TestrailBackup, TestrailSettings
 
 
+def validate_query_budgets(value):
+    if not isinstance(value, dict) or not all(isinstance(budget, int) for budget in value.values()):
+        raise ValidationError('Query budgets must be object mapping phase name prefixes to numbers of queries')
+
+
 class MigratorDownloadBaseForm(forms.Form):
     project_id = forms.IntegerField(
         required=True,
@@ -52,6 +58,21 @@ class MigratorDownloadBaseForm(forms.Form):
         required=False,
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Tatlin'})
     )
+    profile_memory = forms.BooleanField(
+        required=False,
+        help_text='Trace allocations of every phase, task becomes slower',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    profile_cpu = forms.BooleanField(
+        required=False,
+        help_text='Run task under profiler, profiles are linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    trace = forms.BooleanField(
+        required=False,
+        help_text='Record trace of phases, testrail requests and bulk inserts, trace is linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
     testrail_login = forms.CharField(
         widget=forms.TextInput(
             attrs={'class': 'form-control', 'placeholder': 'i.ivanov'})
@@ -73,6 +94,103 @@ class MigratorUploadBaseForm(forms.Form):
         required=True,
         widget=forms.Select(attrs={'class': 'form-control'})
     )
+    resumable = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    count_queries = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    query_budgets = forms.JSONField(
+        required=False,
+        help_text='Max queries per phase by phase name prefix, "*" for other phases, e.g. {"Creating cases": 5000}',
+        validators=[validate_query_budgets],
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    profile_memory = forms.BooleanField(
+        required=False,
+        help_text='Trace allocations of every phase, task becomes slower',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    profile_cpu = forms.BooleanField(
+        required=False,
+        help_text='Run task under profiler, profiles are linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    trace = forms.BooleanField(
+        required=False,
+        help_text='Record trace of phases, testrail requests and bulk inserts, trace is linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    testrail_login = forms.CharField(
+        widget=forms.TextInput(
+            attrs={'class': 'form-control', 'placeholder': 'i.ivanov'})
+    )
+    testrail_password = forms.CharField(
+        widget=forms.PasswordInput(
+            attrs={'class': 'form-control', 'placeholder': 'Start typing'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Parallel phases commit their work one by one, so upload is left partially done if it fails
+        if (cleaned_data.get('parallel_workers') or 1) > 1 and not cleaned_data.get('resumable'):
+            self.add_error('parallel_workers', 'Upload with several parallel workers has to be resumable')
+        return cleaned_data
+
+
+class MigratorProjectMigrateForm(forms.Form):
+    project_id = forms.IntegerField(
+        required=True,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    testy_project_id = forms.IntegerField(
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    testrail_config = forms.ModelChoiceField(
+        TestrailSettings.objects.all(),
+        required=True,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    migrate_attachments = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    ignore_completed = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    upload_root_runs = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    count_queries = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    query_budgets = forms.JSONField(
+        required=False,
+        help_text='Max queries per phase by phase name prefix, "*" for other phases, e.g. {"Creating cases": 5000}',
+        validators=[validate_query_budgets],
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    profile_memory = forms.BooleanField(
+        required=False,
+        help_text='Trace allocations of every phase, task becomes slower',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    profile_cpu = forms.BooleanField(
+        required=False,
+        help_text='Run task under profiler, profiles are linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    trace = forms.BooleanField(
+        required=False,
+        help_text='Record trace of phases, testrail requests and bulk inserts, trace is linked from task status page',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
     testrail_login = forms.CharField(
         widget=forms.TextInput(
             attrs={'class': 'form-control', 'placeholder': 'i.ivanov'})
@@ -102,6 +220,15 @@ class MigratorProjectDownloadForm(MigratorDownloadBaseForm):
         required=False,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    fan_out = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+    estimate_only = forms.BooleanField(
+        required=False,
+        help_text='Predict number of requests and duration of download instead of downloading',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
 
 
 class MigratorProjectUploadForm(MigratorUploadBaseForm):
@@ -109,6 +236,13 @@ class MigratorProjectUploadForm(MigratorUploadBaseForm):
         required=False,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    parallel_workers = forms.IntegerField(
+        required=False,
+        initial=1,
+        min_value=1,
+        max_value=32,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
 
 
 class MigratorMilestoneDownloadForm(MigratorDownloadBaseForm):
@@ -131,6 +265,13 @@ class MigratorMilestoneUploadForm(MigratorUploadBaseForm):
         required=False,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    parallel_workers = forms.IntegerField(
+        required=False,
+        initial=1,
+        min_value=1,
+        max_value=32,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
 
 
 class MigratorPlanRunDownloadForm(MigratorDownloadBaseForm):
@@ -0,0 +1,129 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import json
+import time
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+from testrail_migrator.benchmarks.baseline import find_regressions, load_baseline, save_baseline
+from testrail_migrator.benchmarks.fake_testrail import FakeTestRail
+from testrail_migrator.benchmarks.synthetic import SyntheticProject, SyntheticProjectConfig
+from testrail_migrator.migrator_lib.memory_profile import peak_rss_mb
+from testrail_migrator.models import MigrationRun
+from testrail_migrator.tasks import attachment_body_key, download_task, get_redis_client, http_metrics_key
+
+
+class Command(BaseCommand):
+    help = 'Download synthetic project from local fake testrail and report throughput of download task'
+
+    def add_arguments(self, parser):
+        defaults = SyntheticProjectConfig()
+        for field in fields(SyntheticProjectConfig):
+            parser.add_argument(
+                f'--{field.name.replace("_", "-")}',
+                type=field.type,
+                default=getattr(defaults, field.name),
+                help=f'Synthetic project {field.name.replace("_", " ")}, default {getattr(defaults, field.name)}',
+            )
+        parser.add_argument('--latency', type=float, default=0.02, help='Seconds every response is delayed for')
+        parser.add_argument('--latency-jitter', type=float, default=0.01, help='Max random seconds added to latency')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests failed with 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests failed with 429')
+        parser.add_argument('--download-attachments', action='store_true', help='Download attachments too')
+        parser.add_argument('--baseline', help='Report of previous run, command fails if throughput dropped')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed relative drop of throughput compared to baseline')
+        parser.add_argument('--save-baseline', help='Save report of this run to file')
+        parser.add_argument('--keep-backup', action='store_true', help='Keep downloaded backup in redis')
+
+    def handle(self, *args, **options):
+        project_config = SyntheticProjectConfig(
+            **{field.name: options[field.name] for field in fields(SyntheticProjectConfig)}
+        )
+        server_settings = {
+            'latency': options['latency'],
+            'latency_jitter': options['latency_jitter'],
+            'error_rate': options['error_rate'],
+            'rate_limit_rate': options['rate_limit_rate'],
+        }
+        project = SyntheticProject(project_config)
+        with FakeTestRail(project, seed=project_config.seed, **server_settings) as server:
+            config_dict = {
+                'login': 'benchmark',
+                'password': 'benchmark',
+                'api_url': server.api_url,
+                'custom_fields_matcher': {},
+            }
+            started = time.perf_counter()
+            result = download_task.apply(kwargs={
+                'project_id': project.project_id,
+                'config_dict': config_dict,
+                'download_attachments': options['download_attachments'],
+                'ignore_completed': False,
+                'backup_filename': 'benchmark',
+            })
+            result.get()
+            wall_time = time.perf_counter() - started
+        migration_run = MigrationRun.objects.get(task_id=result.id)
+        report = {
+            'settings': {
+                'project': project_config.as_dict(),
+                'server': server_settings,
+                'download_attachments': options['download_attachments'],
+            },
+            'wall_time': wall_time,
+            'requests_per_second': server.requests_count / wall_time,
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': list(migration_run.phases.values('name', 'wall_time', 'items', 'throughput')),
+            **server.stats(),
+        }
+        if not options['keep_backup']:
+            self._delete_backup(migration_run, server.api_url, project)
+        self.stdout.write(json.dumps(report, indent=2, default=str))
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], report)
+        if options['baseline']:
+            regressions = find_regressions(
+                report, load_baseline(options['baseline']), ['requests_per_second'], options['max_regression']
+            )
+            if regressions:
+                raise CommandError('\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Throughput is within baseline'))
+
+    @staticmethod
+    def _delete_backup(migration_run: MigrationRun, api_url: str, project: SyntheticProject):
+        redis_client = get_redis_client()
+        keys = [http_metrics_key(migration_run.task_id)]
+        keys.extend(attachment_body_key(api_url, attachment_id) for attachment_id in project.attachments)
+        if migration_run.backup:
+            keys.append(migration_run.backup.name)
+            migration_run.backup.delete()
+        redis_client.delete(*keys)
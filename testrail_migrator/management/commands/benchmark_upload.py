@@ -0,0 +1,165 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import json
+import time
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from testrail_migrator.benchmarks.baseline import find_regressions, load_baseline, save_baseline
+from testrail_migrator.benchmarks.synthetic import SyntheticProject, SyntheticProjectConfig
+from testrail_migrator.migrator_lib.memory_profile import peak_rss_mb
+from testrail_migrator.models import MigrationRun
+from testrail_migrator.tasks import get_redis_client, save_results_to_redis, upload_task
+
+CREATOR_METHODS = {
+    'Creating projects': 'MigratorService.create_project',
+    'Creating users': 'TestyCreator.create_users',
+    'Creating configs': 'TestyCreator.create_configs',
+    'Creating suites': 'TestyCreator.create_suites',
+    'Creating sections': 'TestyCreator.create_sections',
+    'Creating cases': 'TestyCreator.create_cases',
+    'Creating milestones, plans and runs': 'TestyCreator.create_plan_tree',
+    'Creating tests': 'TestyCreator.create_tests_for_runs',
+    'Creating results': 'TestyCreator.create_results',
+}
+
+CUSTOM_FIELDS_MATCHER = {
+    'custom_preconds': 'setup',
+    'custom_steps': 'scenario',
+    'custom_expected': 'expected',
+}
+
+
+class Command(BaseCommand):
+    help = 'Upload synthetic backup with upload task and report time, queries and rows per second of every phase'
+
+    def add_arguments(self, parser):
+        defaults = SyntheticProjectConfig()
+        for field in fields(SyntheticProjectConfig):
+            parser.add_argument(
+                f'--{field.name.replace("_", "-")}',
+                type=field.type,
+                default=getattr(defaults, field.name),
+                help=f'Synthetic project {field.name.replace("_", " ")}, default {getattr(defaults, field.name)}',
+            )
+        parser.add_argument('--results', type=int,
+                            help='Add runs to milestones until project has about this number of results')
+        parser.add_argument('--service-user', default='admin', help='Login of existing testy user')
+        parser.add_argument('--generate-only', action='store_true',
+                            help='Only save generated backup, it can be uploaded from migrator pages then')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Commit uploaded project and keep backup, everything is rolled back by default')
+        parser.add_argument('--baseline', help='Report of previous run, command fails if rows per second dropped')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed relative drop of rows per second compared to baseline')
+        parser.add_argument('--save-baseline', help='Save report of this run to file')
+
+    def handle(self, *args, **options):
+        project_config = SyntheticProjectConfig(
+            **{field.name: options[field.name] for field in fields(SyntheticProjectConfig)}
+        )
+        if options['results']:
+            project_config = project_config.scaled_to_results(options['results'])
+        started = time.perf_counter()
+        project = SyntheticProject(project_config)
+        backup_data = project.as_backup()
+        generation_time = time.perf_counter() - started
+        backup = save_results_to_redis(backup_data, 'synthetic-')
+        if options['generate_only']:
+            self.stdout.write(f'Backup {backup.name} with {len(project.results)} results is saved')
+            return
+        try:
+            report = self._upload(backup.name, options)
+        finally:
+            if not options['keep_data']:
+                get_redis_client().delete(backup.name)
+                backup.delete()
+        report.update({
+            'settings': {'project': project_config.as_dict()},
+            'generation_time': generation_time,
+            'peak_rss_mb': peak_rss_mb(),
+            'results': len(project.results),
+        })
+        self.stdout.write(json.dumps(report, indent=2, default=str))
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], report)
+        if options['baseline']:
+            regressions = find_regressions(
+                report, load_baseline(options['baseline']), ['rows_per_second'], options['max_regression']
+            )
+            if regressions:
+                raise CommandError('\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Throughput is within baseline'))
+
+    def _upload(self, backup_name, options):
+        config_dict = {
+            'login': 'benchmark',
+            'password': 'benchmark',
+            'api_url': 'http://synthetic.testrail/index.php?/api/v2',
+            'custom_fields_matcher': CUSTOM_FIELDS_MATCHER,
+        }
+        with transaction.atomic():
+            started = time.perf_counter()
+            result = upload_task.apply(kwargs={
+                'backup_name': backup_name,
+                'config_dict': config_dict,
+                'upload_root_runs': True,
+                'service_user_login': options['service_user'],
+                'testy_attachment_url': 'http://synthetic.testy/attachments',
+                'count_queries': True,
+            })
+            result.get()
+            wall_time = time.perf_counter() - started
+            phases = [
+                {**phase, 'creator_method': self._creator_method(phase['name'])}
+                for phase in MigrationRun.objects.get(task_id=result.id).phases.values(
+                    'name', 'wall_time', 'cpu_time', 'items', 'throughput', 'query_count', 'db_time',
+                    'duplicate_queries', 'top_queries'
+                )
+            ]
+            if not options['keep_data']:
+                transaction.set_rollback(True)
+        rows = sum(phase['items'] or 0 for phase in phases)
+        return {
+            'wall_time': wall_time,
+            'rows': rows,
+            'rows_per_second': rows / wall_time,
+            'queries': sum(phase['query_count'] or 0 for phase in phases),
+            'phases': phases,
+        }
+
+    @staticmethod
+    def _creator_method(phase_name: str):
+        for prefix, method in CREATOR_METHODS.items():
+            if phase_name.startswith(prefix):
+                return method
+        return None
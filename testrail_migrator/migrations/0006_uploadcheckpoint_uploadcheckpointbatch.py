@@ -0,0 +1,42 @@
+# Generated by Django 3.2.4 on 2026-10-19 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0005_testrailsettings_custom_fields_matcher'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=255)),
+                ('backup_name', models.CharField(max_length=255)),
+                ('testy_project_id', models.IntegerField(blank=True, null=True)),
+                ('testy_plan_id', models.IntegerField(blank=True, null=True)),
+                ('is_finished', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadCheckpointBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(max_length=255)),
+                ('offset', models.IntegerField(default=0)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('is_phase_finished', models.BooleanField(default=False)),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='testrail_migrator.uploadcheckpoint')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='uploadcheckpointbatch',
+            index=models.Index(fields=['checkpoint', 'phase'], name='upload_checkpoint_phase_idx'),
+        ),
+    ]
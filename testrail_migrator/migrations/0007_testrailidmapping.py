@@ -0,0 +1,31 @@
+# Generated by Django 3.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0006_uploadcheckpoint_uploadcheckpointbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestrailIdMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('entity_type', models.CharField(choices=[('user', 'User'), ('config', 'Config'), ('suite', 'Suite'), ('section', 'Section'), ('case', 'Case'), ('milestone', 'Milestone'), ('plan', 'Plan'), ('run', 'Run'), ('test', 'Test'), ('result', 'Result'), ('attachment', 'Attachment')], max_length=31)),
+                ('testrail_id', models.BigIntegerField()),
+                ('testy_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='testrailidmapping',
+            index=models.Index(fields=['entity_type', 'testy_id'], name='testrail_id_mapping_testy_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='testrailidmapping',
+            constraint=models.UniqueConstraint(fields=('source', 'entity_type', 'testrail_id'), name='unique_testrail_id_mapping'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0007_testrailidmapping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(db_index=True, max_length=255)),
+                ('task_name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('backup', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='migration_runs', to='testrail_migrator.testrailbackup')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MigrationRunPhase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField()),
+                ('wall_time', models.FloatField()),
+                ('cpu_time', models.FloatField()),
+                ('items', models.IntegerField(blank=True, null=True)),
+                ('throughput', models.FloatField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phases', to='testrail_migrator.migrationrun')),
+            ],
+            options={
+                'ordering': ['started_at', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0008_migrationrun_migrationrunphase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='query_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='db_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='duplicate_queries',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='top_queries',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
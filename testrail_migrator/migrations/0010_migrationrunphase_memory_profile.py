@@ -0,0 +1,33 @@
+# Generated by Django 3.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0009_migrationrunphase_query_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='peak_rss_mb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='traced_peak_mb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='retained_mb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='top_allocations',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testrail_migrator', '0010_migrationrunphase_memory_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='rss_start_mb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationrunphase',
+            name='rss_end_mb',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
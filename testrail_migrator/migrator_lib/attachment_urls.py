@@ -0,0 +1,97 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import asyncio
+import re
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+class AttachmentUrlRewriter:
+    """
+    Replace testrail attachment urls in texts with testy attachment urls.
+
+    Testy ids of attachments that are not in the uploaded attachments mapping are resolved once per rewriter and kept
+    for the whole task, concurrent references to the same unknown attachment wait for a single resolution.
+    """
+
+    def __init__(self, replace_pattern: str, testy_attachment_url: str):
+        """
+        Init method for AttachmentUrlRewriter.
+
+        Args:
+            replace_pattern: regex of testrail attachment url, first group must match testrail attachment id
+            testy_attachment_url: prefix of testy attachment url, testy attachment id is appended to it
+        """
+        self.pattern = re.compile(replace_pattern)
+        self.testy_attachment_url = testy_attachment_url
+        self.resolved: Dict[int, int] = {}
+        self._in_flight: Dict[int, asyncio.Future] = {}
+
+    async def rewrite(self, text: Optional[str], attachments_mapping: Dict[int, int],
+                      resolve_missing: Callable[[int], Awaitable[int]]) -> Tuple[bool, Optional[str]]:
+        """
+        Replace all testrail attachment urls in text in a single pass.
+
+        Args:
+            text: text to rewrite
+            attachments_mapping: mapping of uploaded testrail attachment ids to testy attachment ids
+            resolve_missing: coroutine function that creates testy attachment for testrail attachment id and returns
+                its id
+
+        Returns:
+            tuple of flag if anything was replaced and resulting text
+        """
+        if not text:
+            return False, text
+        found_ids = {int(match.group(1)) for match in self.pattern.finditer(text) if match.group(1)}
+        if not found_ids:
+            return False, text
+        missing_ids = [src_id for src_id in found_ids if not attachments_mapping.get(src_id)]
+        await asyncio.gather(*[self._resolve(src_id, resolve_missing) for src_id in missing_ids])
+
+        def substitute(match):
+            if not match.group(1):
+                return match.group(0)
+            src_id = int(match.group(1))
+            return f'{self.testy_attachment_url}{attachments_mapping.get(src_id) or self.resolved[src_id]}'
+
+        return True, self.pattern.sub(substitute, text)
+
+    async def _resolve(self, src_id: int, resolve_missing: Callable[[int], Awaitable[int]]) -> int:
+        if src_id in self.resolved:
+            return self.resolved[src_id]
+        if src_id not in self._in_flight:
+            self._in_flight[src_id] = asyncio.ensure_future(resolve_missing(src_id))
+        try:
+            self.resolved[src_id] = await self._in_flight[src_id]
+        finally:
+            # Futures belong to the running event loop, so only resolved ids outlive it
+            self._in_flight.pop(src_id, None)
+        return self.resolved[src_id]
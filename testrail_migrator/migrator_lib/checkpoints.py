@@ -0,0 +1,195 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import logging
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List
+
+from django.db import transaction
+from testrail_migrator.migrator_lib.progress import ProgressReporter
+from testrail_migrator.migrator_lib.utils import split_list_by_chunks
+from testrail_migrator.models import UploadCheckpoint, UploadCheckpointBatch
+
+
+def restore_int_keys(value):
+    """Restore integer keys of mappings that were turned into strings by JSON serialization."""
+    if isinstance(value, dict):
+        return {
+            int(key) if isinstance(key, str) and key.lstrip('-').isdigit() else key: restore_int_keys(nested_value)
+            for key, nested_value in value.items()
+        }
+    return value
+
+
+class UploadCheckpointer:
+    """
+    Run upload phases with optional per phase and per batch commits.
+
+    Without checkpoint all phases are executed inside one transaction opened by task_transaction, same as plain
+    upload. With checkpoint every phase or batch of phase is committed separately together with record of its result,
+    so restarted upload skips finished phases and batches and continues from the last checkpoint.
+    """
+
+    def __init__(self, checkpoint: UploadCheckpoint = None, batch_size: int = 1000, progress: ProgressReporter = None):
+        """
+        Init method for UploadCheckpointer.
+
+        Args:
+            checkpoint: checkpoint to record progress to, if not provided upload is not resumable
+            batch_size: number of items processed and committed at once in batched phases
+            progress: receiver of items progress, total of batched phase is set to its remaining items
+        """
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.progress = progress or ProgressReporter()
+        self._phases: Dict[str, Dict[str, Any]] = {}
+        if checkpoint:
+            self._load_phases()
+
+    @classmethod
+    def for_task(cls, resumable: bool, task_name: str, backup_name: str, testy_project_id: int = None,
+                 testy_plan_id: int = None, batch_size: int = 1000,
+                 progress: ProgressReporter = None) -> 'UploadCheckpointer':
+        """
+        Get checkpointer for upload task, unfinished checkpoint with same task parameters is resumed.
+
+        Args:
+            resumable: if False checkpointer without checkpoint is returned
+            task_name: name of upload task
+            backup_name: name of backup to upload
+            testy_project_id: id of testy project provided to task
+            testy_plan_id: id of testy test plan provided to task
+            batch_size: number of items processed and committed at once in batched phases
+            progress: receiver of items progress, total of batched phase is set to its remaining items
+
+        Returns:
+            UploadCheckpointer instance
+        """
+        if not resumable:
+            return cls(batch_size=batch_size, progress=progress)
+        checkpoint_key = {
+            'task_name': task_name,
+            'backup_name': backup_name,
+            'testy_project_id': testy_project_id,
+            'testy_plan_id': testy_plan_id,
+        }
+        checkpoint = UploadCheckpoint.objects.filter(is_finished=False, **checkpoint_key).order_by('-id').first()
+        if checkpoint:
+            logging.info(f'Resuming upload from checkpoint {checkpoint.id}')
+        else:
+            checkpoint = UploadCheckpoint.objects.create(**checkpoint_key)
+        return cls(checkpoint, batch_size, progress)
+
+    def task_transaction(self):
+        """Transaction for whole task, upload is atomic only if it is not resumable."""
+        return nullcontext() if self.checkpoint else transaction.atomic()
+
+    def run_phase(self, phase: str, func: Callable, *args, **kwargs):
+        """
+        Run phase as a whole, result of finished phase is taken from checkpoint.
+
+        Args:
+            phase: unique name of phase within upload
+            func: function to run
+            *args: func args
+            **kwargs: func kwargs
+
+        Returns:
+            result of func
+        """
+        if not self.checkpoint:
+            return func(*args, **kwargs)
+        state = self._phases.get(phase)
+        if state and state['is_finished']:
+            return state['result']
+        with transaction.atomic():
+            result = func(*args, **kwargs)
+            self._record(phase, offset=0, result=result, is_phase_finished=True)
+        return result
+
+    def run_batched_phase(self, phase: str, items: List, func: Callable, *args, **kwargs):
+        """
+        Run phase by batches of items, already processed batches are taken from checkpoint.
+
+        Args:
+            phase: unique name of phase within upload
+            items: list of items to be split by batches, order must be same on every run
+            func: function that takes batch of items as first arg and returns mapping or None
+            *args: func args
+            **kwargs: func kwargs
+
+        Returns:
+            merged mappings returned for each batch
+        """
+        if not self.checkpoint:
+            return func(items, *args, **kwargs)
+        state = self._phases.get(phase, {'offset': 0, 'result': {}, 'is_finished': False})
+        if state['is_finished']:
+            return state['result']
+        merged_result = state['result']
+        offset = state['offset']
+        self.progress.set_total(len(items) - offset)
+        for batch in split_list_by_chunks(items[offset:], self.batch_size):
+            offset += len(batch)
+            with transaction.atomic():
+                result = func(batch, *args, **kwargs)
+                self._record(phase, offset=offset, result=result)
+            if result:
+                merged_result.update(result)
+        with transaction.atomic():
+            self._record(phase, offset=offset, result=None, is_phase_finished=True)
+        return merged_result
+
+    def finish(self):
+        if not self.checkpoint:
+            return
+        self.checkpoint.is_finished = True
+        self.checkpoint.save(update_fields=['is_finished', 'updated_at'])
+
+    def _record(self, phase: str, offset: int, result, is_phase_finished: bool = False):
+        UploadCheckpointBatch.objects.create(
+            checkpoint=self.checkpoint,
+            phase=phase,
+            offset=offset,
+            result=result,
+            is_phase_finished=is_phase_finished,
+        )
+        self.checkpoint.save(update_fields=['updated_at'])
+
+    def _load_phases(self):
+        for batch in self.checkpoint.batches.order_by('id'):
+            state = self._phases.setdefault(batch.phase, {'offset': 0, 'result': {}, 'is_finished': False})
+            state['offset'] = max(state['offset'], batch.offset)
+            result = restore_int_keys(batch.result)
+            if isinstance(result, dict):
+                state['result'].update(result)
+            elif result is not None:
+                state['result'] = result
+            state['is_finished'] = state['is_finished'] or batch.is_phase_finished
@@ -0,0 +1,131 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import cProfile
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+from testrail_migrator.migrator_lib.utils import add_task_option
+
+CPU_PROFILE_TTL = 60 * 60 * 24 * 7
+CPU_PROFILE_KINDS = {
+    'pstats': 'pstats',
+    'collapsed': 'collapsed.txt',
+}
+
+
+def cpu_profile_key(task_id, kind: str) -> str:
+    return f'cpu_profile:{task_id}:{kind}'
+
+
+class StackSampler(threading.Thread):
+    """Thread sampling stacks of all other threads and counting them in collapsed stack format for flame graphs."""
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name='cpu-profile-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                self.stacks[self._collapse(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'.replace(';', ':'))
+            frame = frame.f_back
+        frames.append(thread_name.replace(';', ':'))
+        return ';'.join(reversed(frames))
+
+
+@contextmanager
+def cpu_profiling(task_id):
+    """
+    Profile block with cProfile and stack sampler and save both profiles to redis.
+
+    cProfile sees calls made by current thread only, sampler sees all threads of worker, including threads of parallel
+    upload phases and event loops of testrail client.
+
+    Args:
+        task_id: id of profiled task, profiles are saved under its keys
+
+    Yields:
+        dict filled with profile summary when block is left
+    """
+    summary = {}
+    sampler = StackSampler()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield summary
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.create_stats()
+        redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
+        pipeline = redis_client.pipeline()
+        # Same bytes pstats.Stats.dump_stats writes, file can be opened with pstats or snakeviz
+        pipeline.set(cpu_profile_key(task_id, 'pstats'), marshal.dumps(profiler.stats), ex=CPU_PROFILE_TTL)
+        pipeline.set(cpu_profile_key(task_id, 'collapsed'), sampler.collapsed(), ex=CPU_PROFILE_TTL)
+        pipeline.execute()
+        summary.update({
+            'wall_time': time.perf_counter() - started,
+            'samples': sampler.samples,
+            'sampling_interval': sampler.interval,
+        })
+
+
+# Adds profile_cpu option to bound task, summary of profile is added to task result under cpu_profile key
+with_cpu_profiling = add_task_option('profile_cpu', lambda task: cpu_profiling(task.request.id), 'cpu_profile')
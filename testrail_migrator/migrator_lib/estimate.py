@@ -0,0 +1,206 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import asyncio
+import math
+import random
+import re
+from statistics import mean
+from typing import Any, Dict, List
+
+from asgiref.sync import async_to_sync
+
+from .testrail import TestRailClient
+from .utils import CHUNK_SIZE
+
+STATUS_COUNTER_PATTERN = re.compile(r'^(passed|blocked|untested|retest|failed|custom_status\d+)_count$')
+UNTESTED_STATUS_ID = 3
+
+
+def count_tests(instance: Dict[str, Any]) -> int:
+    """
+    Count tests of run or plan by its status counters.
+
+    Args:
+        instance: testrail run or plan as returned by get_runs or get_plans
+
+    Returns:
+        number of tests
+    """
+    return sum(value or 0 for key, value in instance.items() if STATUS_COUNTER_PATTERN.match(key))
+
+
+class DownloadEstimator:
+    """
+    Predict cost of project download without downloading it.
+
+    Only top-level collections of project are requested: suites, milestones, plans and runs. Tests are counted by
+    status counters of plans and runs, everything else is extrapolated from small random samples: runs per plan from
+    a few plans, cases per suite from a few suites, results per tested test and attachments per result from results
+    of one run. Wall time is projected from latency of these requests and concurrency of client.
+    """
+
+    def __init__(self, testrail_client: TestRailClient, concurrency: int = CHUNK_SIZE, sample_size: int = 20,
+                 suite_sample_size: int = 3, plan_sample_size: int = 5):
+        self.client = testrail_client
+        self.concurrency = concurrency
+        self.sample_size = sample_size
+        self.suite_sample_size = suite_sample_size
+        self.plan_sample_size = plan_sample_size
+
+    def estimate(self, project_id: int, download_attachments: bool, ignore_completed: bool) -> Dict[str, Any]:
+        """
+        Estimate download of project made by download_task.
+
+        Args:
+            project_id: id of testrail project
+            download_attachments: whether attachments are going to be downloaded
+            ignore_completed: whether completed milestones, plans and runs are going to be skipped
+
+        Returns:
+            dict with predicted counts of entities, api calls by phase, request latency and projected wall time
+        """
+        query_params = {'is_completed': 0} if ignore_completed else None
+        suites = self.client.get_suites(project_id)
+        milestones = self.client.get_milestones(project_id, ignore_completed, query_params)
+        runs = self.client.get_runs(project_id, query_params=query_params)
+        samples = self._get_samples(project_id, suites, runs, query_params)
+        plans = samples['plans']
+
+        runs_per_plan = mean(samples['runs_per_plan']) if samples['runs_per_plan'] else 0
+        cases_per_suite = mean(samples['cases_per_suite']) if samples['cases_per_suite'] else 0
+        tests = sum(count_tests(instance) for instance in plans + runs)
+        untested = sum(instance.get('untested_count') or 0 for instance in plans + runs)
+        results_per_test = len(samples['results']) / samples['tested'] if samples['tested'] else 1
+        attachment_ids_known = bool(samples['results']) and all(
+            'attachment_ids' in result for result in samples['results']
+        )
+        attachments_per_result = mean(
+            len(result.get('attachment_ids') or []) for result in samples['results']
+        ) if attachment_ids_known else 0
+
+        counts = {
+            'suites': len(suites),
+            'cases': round(cases_per_suite * len(suites)),
+            'milestones': len(milestones) + sum(len(milestone['milestones']) for milestone in milestones),
+            'plans': len(plans),
+            'runs_parent_plan': round(runs_per_plan * len(plans)),
+            'runs_parent_mile': len(runs),
+            'tests': tests,
+            'untested_tests': untested,
+            'results': max(round((tests - untested) * results_per_test), tests - untested),
+        }
+        counts['result_attachments'] = round(counts['results'] * attachments_per_result)
+
+        phases = [
+            ('Getting users', 1, False),
+            ('Getting custom fields for results', 1, False),
+            ('Getting project', 1, False),
+            ('Getting suites', 1, False),
+            ('Getting cases', counts['suites'], True),
+            ('Getting sections', counts['suites'], True),
+            ('Getting configs', 1, False),
+            ('Getting milestones', 1, False),
+            ('Getting plans', 1, False),
+            ('Getting runs for plans', counts['plans'], True),
+            ('Getting runs for milestones', 1, False),
+            ('Getting tests for runs', counts['runs_parent_plan'] + counts['runs_parent_mile'], True),
+            ('Getting results for tests', counts['tests'], True),
+        ]
+        attachment_phases = [
+            ('Getting attachments for cases', counts['cases'], True),
+            ('Getting attachments for plans', counts['plans'], True),
+            ('Getting attachments for runs', counts['runs_parent_plan'] + counts['runs_parent_mile'], True),
+            ('Getting attachments for tests', 0 if attachment_ids_known else counts['tests'], True),
+            ('Getting attachment files', counts['result_attachments'], True),
+        ]
+        if download_attachments:
+            phases.extend(attachment_phases)
+
+        latency = self._mean_latency()
+        api_calls = {name: calls for name, calls, _ in phases}
+        phase_times = {
+            name: (math.ceil(calls / self.concurrency) if concurrent else calls) * latency
+            for name, calls, concurrent in phases
+        }
+        return {
+            'counts': counts,
+            'api_calls': api_calls,
+            'total_api_calls': sum(api_calls.values()),
+            'attachment_requests': sum(calls for _, calls, _ in attachment_phases),
+            'attachment_ids_in_results': attachment_ids_known,
+            'request_latency': latency,
+            'concurrency': self.concurrency,
+            'phase_times': phase_times,
+            'wall_time': sum(phase_times.values()),
+            'sampled': {
+                'plans': len(samples['runs_per_plan']),
+                'suites': len(samples['cases_per_suite']),
+                'results': len(samples['results']),
+            },
+        }
+
+    @async_to_sync
+    async def _get_samples(self, project_id: int, suites: List[Dict], runs: List[Dict], query_params):
+        plans = await self.client.get_plans(project_id, query_params=query_params) or []
+        sampled_plans, sampled_cases = await asyncio.gather(
+            asyncio.gather(*[
+                self.client.get_plan(plan['id'])
+                for plan in random.sample(plans, min(self.plan_sample_size, len(plans)))
+            ]),
+            asyncio.gather(*[
+                self.client.get_cases_for_suite(project_id, suite['id'])
+                for suite in random.sample(suites, min(self.suite_sample_size, len(suites)))
+            ]),
+        )
+        sampled_plans = [plan for plan in sampled_plans if plan]
+        runs_parent_plan = self.client.get_runs_from_plans(sampled_plans)
+        tested_runs = [run for run in runs + runs_parent_plan if count_tests(run) > (run.get('untested_count') or 0)]
+
+        tested, results = 0, []
+        if tested_runs:
+            tests = await self.client.get_tests(random.choice(tested_runs)['id']) or []
+            tests = [test for test in tests if test['status_id'] != UNTESTED_STATUS_ID]
+            tests = random.sample(tests, min(self.sample_size, len(tests)))
+            tested = len(tests)
+            for test_results in await asyncio.gather(*[self.client.get_results(test['id']) for test in tests]):
+                results.extend(test_results or [])
+        return {
+            'plans': plans,
+            'runs_per_plan': [len(self.client.get_runs_from_plans([plan])) for plan in sampled_plans],
+            'cases_per_suite': [len(cases or []) for cases in sampled_cases],
+            'tested': tested,
+            'results': results,
+        }
+
+    def _mean_latency(self) -> float:
+        metrics = self.client.metrics.as_dict().values()
+        requests = sum(endpoint['requests'] for endpoint in metrics)
+        return sum(endpoint['latency_sum'] for endpoint in metrics) / requests if requests else 0.0
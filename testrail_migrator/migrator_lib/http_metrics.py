@@ -0,0 +1,186 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import asyncio
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Any, Dict
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def endpoint_template(endpoint: str) -> str:
+    """
+    Replace ids in testrail endpoint with placeholder, e.g. /get_results/12 becomes /get_results/{id}.
+
+    Args:
+        endpoint: testrail api endpoint without query params
+
+    Returns:
+        endpoint template
+    """
+    return re.sub(r'/\d+(?=/|$)', '/{id}', endpoint.split('&', 1)[0])
+
+
+def retry_cause(err: Exception) -> str:
+    if status := getattr(err, 'status', None):
+        return f'status_{status}'
+    if isinstance(err, asyncio.TimeoutError):
+        return 'timeout'
+    return 'connection'
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses = Counter()
+        self.retries = Counter()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'latency_sum': self.latency_sum,
+            'latency_buckets': list(self.latency_buckets),
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'retries': dict(self.retries),
+        }
+
+    def merge(self, data: Dict[str, Any]):
+        self.requests += data['requests']
+        self.bytes += data['bytes']
+        self.latency_sum += data['latency_sum']
+        self.latency_buckets = [count + other for count, other in zip(self.latency_buckets, data['latency_buckets'])]
+        self.statuses.update(data['statuses'])
+        self.retries.update(data['retries'])
+
+
+class HttpMetrics:
+    """
+    Metrics of requests to testrail grouped by endpoint template.
+
+    Request counts, status codes, retries by cause, received bytes and latency histogram are collected, metrics can be
+    saved as dict and exported in prometheus text format.
+    """
+
+    prefix = 'testrail_migrator_http'
+
+    def __init__(self):
+        self._endpoints = defaultdict(EndpointMetrics)
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, status: int, seconds: float, size: int):
+        """
+        Record finished request.
+
+        Args:
+            endpoint: requested endpoint
+            status: response status code
+            seconds: time from sending request to reading whole response
+            size: number of received bytes
+        """
+        with self._lock:
+            metrics = self._endpoints[endpoint_template(endpoint)]
+            metrics.requests += 1
+            metrics.bytes += size
+            metrics.latency_sum += seconds
+            metrics.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics.statuses[str(status)] += 1
+
+    def retry(self, endpoint: str, err: Exception):
+        """
+        Record retry of request.
+
+        Args:
+            endpoint: requested endpoint
+            err: error that caused retry
+        """
+        with self._lock:
+            self._endpoints[endpoint_template(endpoint)].retries[retry_cause(err)] += 1
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {endpoint: metrics.as_dict() for endpoint, metrics in sorted(self._endpoints.items())}
+
+    def merge(self, data: Dict[str, Dict[str, Any]]):
+        """
+        Add metrics saved with as_dict, e.g. by other tasks.
+
+        Args:
+            data: metrics as returned by as_dict
+        """
+        with self._lock:
+            for endpoint, endpoint_data in data.items():
+                self._endpoints[endpoint].merge(endpoint_data)
+
+    def to_prometheus(self) -> str:
+        """
+        Export metrics in prometheus text exposition format.
+
+        Returns:
+            metrics text
+        """
+        data = self.as_dict()
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {self.prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {self.prefix}_{name} {metric_type}')
+            for suffix, labels, value in samples:
+                labels_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f'{self.prefix}_{name}{suffix}{{{labels_text}}} {value}')
+
+        add_metric('requests_total', 'counter', 'Number of responses by status code.', [
+            ('', {'endpoint': endpoint, 'status': status}, count)
+            for endpoint, metrics in data.items() for status, count in sorted(metrics['statuses'].items())
+        ])
+        add_metric('retries_total', 'counter', 'Number of retried requests by cause.', [
+            ('', {'endpoint': endpoint, 'cause': cause}, count)
+            for endpoint, metrics in data.items() for cause, count in sorted(metrics['retries'].items())
+        ])
+        add_metric('response_bytes_total', 'counter', 'Number of received bytes.', [
+            ('', {'endpoint': endpoint}, metrics['bytes']) for endpoint, metrics in data.items()
+        ])
+        latency_samples = []
+        for endpoint, metrics in data.items():
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], metrics['latency_buckets']):
+                cumulative += count
+                latency_samples.append(('_bucket', {'endpoint': endpoint, 'le': bound}, cumulative))
+            latency_samples.append(('_sum', {'endpoint': endpoint}, metrics['latency_sum']))
+            latency_samples.append(('_count', {'endpoint': endpoint}, metrics['requests']))
+        add_metric('request_duration_seconds', 'histogram', 'Time of request including reading response.',
+                   latency_samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,196 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+from collections import defaultdict
+from typing import Callable, Dict, List, Set, Type
+
+from django.db.models import Model
+from testrail_migrator.migrator_lib.tracing import span
+from testrail_migrator.migrator_lib.utils import split_list_by_chunks
+from testrail_migrator.models import TestrailIdMapping
+
+EntityType = TestrailIdMapping.EntityType
+
+
+class IdMappingStore:
+    """Persistent mapping of testrail ids to testy ids for one testrail instance."""
+
+    mapping_key_entity_types = {
+        'users': EntityType.USER,
+        'configs': EntityType.CONFIG,
+        'suites': EntityType.SUITE,
+        'sections': EntityType.SECTION,
+        'cases': EntityType.CASE,
+        'milestones': EntityType.MILESTONE,
+        'plans': EntityType.PLAN,
+        'runs_parent_plan': EntityType.RUN,
+        'runs_parent_mile': EntityType.RUN,
+        'tests_parent_plan': EntityType.TEST,
+        'tests_parent_mile': EntityType.TEST,
+        'results_parent_plan': EntityType.RESULT,
+        'results_parent_mile': EntityType.RESULT,
+        'attachments': EntityType.ATTACHMENT,
+    }
+
+    def __init__(self, source: str):
+        """
+        Init method for IdMappingStore.
+
+        Args:
+            source: identifier of testrail instance, testrail api url
+        """
+        self.source = source
+        self.reused_ids: Dict[EntityType, Set[int]] = defaultdict(set)
+
+    def get_mapping(self, entity_type: EntityType, testrail_ids: List[int], model: Type[Model] = None,
+                    **testy_filters) -> Dict[int, int]:
+        """
+        Get stored mapping for testrail ids.
+
+        Args:
+            entity_type: type of mapped entity
+            testrail_ids: ids to look mapping for
+            model: testy model, if provided only ids of existing testy instances are returned
+            **testy_filters: filters for testy model, e.g. project_id
+
+        Returns:
+            dict of testrail id to testy id
+        """
+        mapping = dict(
+            TestrailIdMapping.objects.filter(
+                source=self.source,
+                entity_type=entity_type,
+                testrail_id__in=testrail_ids,
+            ).values_list('testrail_id', 'testy_id')
+        )
+        if model is None or not mapping:
+            return mapping
+        existing_ids = set(
+            model.objects.filter(pk__in=mapping.values(), **testy_filters).values_list('pk', flat=True)
+        )
+        return {testrail_id: testy_id for testrail_id, testy_id in mapping.items() if testy_id in existing_ids}
+
+    def save_mapping(self, entity_type: EntityType, mapping: Dict[int, int]) -> None:
+        """
+        Save mapping, previously stored testy ids of same testrail ids are replaced.
+
+        Stored rows of the same testrail ids are updated, the rest are created. Rows created by an upload from the
+        same testrail saving mappings at the same time are kept.
+
+        Args:
+            entity_type: type of mapped entity
+            mapping: dict of testrail id to testy id
+        """
+        if not mapping:
+            return
+        existing = []
+        for testrail_ids in split_list_by_chunks(list(mapping), 1000):
+            existing.extend(
+                TestrailIdMapping.objects.filter(
+                    source=self.source,
+                    entity_type=entity_type,
+                    testrail_id__in=testrail_ids,
+                )
+            )
+        for id_mapping in existing:
+            id_mapping.testy_id = mapping[id_mapping.testrail_id]
+        with span('db.bulk_update', **{'db.model': 'TestrailIdMapping', 'db.items': len(existing),
+                                       'id_mapping.entity_type': entity_type}):
+            TestrailIdMapping.objects.bulk_update(existing, ['testy_id'], batch_size=1000)
+        existing_ids = {id_mapping.testrail_id for id_mapping in existing}
+        new_mappings = [
+            TestrailIdMapping(
+                source=self.source,
+                entity_type=entity_type,
+                testrail_id=testrail_id,
+                testy_id=testy_id,
+            )
+            for testrail_id, testy_id in mapping.items()
+            if testrail_id not in existing_ids
+        ]
+        with span('db.bulk_create', **{'db.model': 'TestrailIdMapping', 'db.items': len(new_mappings),
+                                       'id_mapping.entity_type': entity_type}):
+            TestrailIdMapping.objects.bulk_create(new_mappings, batch_size=1000, ignore_conflicts=True)
+
+    def save_mappings(self, mappings: Dict[str, Dict[int, int]]) -> None:
+        """
+        Save all upload mappings that have entity type.
+
+        Args:
+            mappings: dict of mapping key as in upload tasks to mapping
+        """
+        for mapping_key, entity_type in self.mapping_key_entity_types.items():
+            self.save_mapping(entity_type, mappings.get(mapping_key))
+
+    def create_missing(self, entity_type: EntityType, model: Type[Model], items: List[dict], create_method: Callable,
+                       *args, testy_filters: dict = None, pass_known_mappings: bool = False,
+                       **kwargs) -> Dict[int, int]:
+        """
+        Reuse testy instances that were created for items before and create the rest.
+
+        Ids of reused items are kept in reused_ids.
+
+        Args:
+            entity_type: type of mapped entity
+            model: testy model of entity
+            items: testrail items with id
+            create_method: method that takes list of items as first arg and returns mapping
+            *args: create_method args
+            testy_filters: filters for testy model instances that can be reused
+            pass_known_mappings: pass reused mapping to create_method as known_mappings
+            **kwargs: create_method kwargs
+
+        Returns:
+            dict of testrail id to testy id for all items
+        """
+        known_mappings = self.get_mapping(entity_type, [item['id'] for item in items], model, **(testy_filters or {}))
+        self.reused_ids[entity_type].update(known_mappings)
+        new_items = [item for item in items if item['id'] not in known_mappings]
+        if pass_known_mappings:
+            kwargs['known_mappings'] = known_mappings
+        created_mappings = create_method(new_items, *args, **kwargs) if new_items else {}
+        return {**known_mappings, **created_mappings}
+
+    def without_reused_parents(self, entity_type: EntityType, items: List[dict], parent_key: str = 'id') -> List[dict]:
+        """
+        Filter out items of parents reused by create_missing, e.g. attachments that were uploaded with the parent.
+
+        Args:
+            entity_type: type of mapped parent entity
+            items: testrail items
+            parent_key: key of parent testrail id in item
+
+        Returns:
+            items of parents created by this upload
+        """
+        reused_ids = self.reused_ids.get(entity_type)
+        if not reused_ids:
+            return items
+        return [item for item in items if item[parent_key] not in reused_ids]
@@ -0,0 +1,112 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Type
+
+from django.db.models import Model
+
+
+class ModelInstanceCache:
+    """
+    Bounded LRU identity map of model instances looked up by primary key.
+
+    Meant to live for one upload only, instances are not invalidated when rows change in database. Cache can be shared
+    by threads of one upload.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        """
+        Init method for ModelInstanceCache.
+
+        Args:
+            maxsize: max number of instances kept, least recently used instances are evicted first
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._instances = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model: Type[Model], pk: Any) -> Model:
+        """
+        Get instance from cache or from database if it is not cached yet.
+
+        Args:
+            model: model class
+            pk: primary key of instance
+
+        Returns:
+            model instance
+        """
+        key = (model, pk)
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is not None:
+                self._instances.move_to_end(key)
+                self.hits += 1
+                return instance
+            self.misses += 1
+        instance = model.objects.get(pk=pk)
+        self.add(instance, model)
+        return instance
+
+    def add(self, instance: Model, model: Type[Model] = None) -> None:
+        """
+        Put already fetched or created instance to cache.
+
+        Args:
+            instance: model instance with primary key
+            model: model class to cache instance under, type of instance is used if not provided
+        """
+        key = (model or type(instance), instance.pk)
+        with self._lock:
+            self._instances[key] = instance
+            self._instances.move_to_end(key)
+            while len(self._instances) > self.maxsize:
+                self._instances.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._instances),
+            'maxsize': self.maxsize,
+        }
+
+    @contextmanager
+    def log_stats_on_exit(self, name: str):
+        try:
+            yield self
+        finally:
+            logging.info(f'{name} instance cache stats: {self.stats()}')
@@ -0,0 +1,111 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+TRACEMALLOC_FRAMES = 5
+
+_tracing_lock = threading.Lock()
+_tracing_phases = 0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size current process reached since it was started, in megabytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak_rss / 1024 / 1024 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of current process in megabytes, None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+@contextmanager
+def trace_allocations(top_limit: int = 10):
+    """
+    Trace python allocations made inside block with tracemalloc.
+
+    Tracing is started when block is entered and stopped when it is left, so report shows memory allocated by block
+    only. Blocks running in parallel threads share one tracing session, their allocations are mixed.
+
+    Args:
+        top_limit: number of allocation sites in report
+
+    Yields:
+        dict filled with report when block is left: peak of traced memory, memory retained by block, rss of process
+        when block is entered and left, peak rss process reached since it was started and top allocation sites of
+        retained memory
+    """
+    global _tracing_phases
+    report: Dict[str, Any] = {}
+    rss_start_mb = rss_mb()
+    with _tracing_lock:
+        if not _tracing_phases:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracing_phases += 1
+    try:
+        yield report
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        retained, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        with _tracing_lock:
+            _tracing_phases -= 1
+            if not _tracing_phases:
+                tracemalloc.stop()
+    report.update({
+        'rss_start_mb': rss_start_mb,
+        'rss_end_mb': rss_mb(),
+        'peak_rss_mb': peak_rss_mb(),
+        'traced_peak_mb': traced_peak / 1024 / 1024,
+        'retained_mb': retained / 1024 / 1024,
+        'top_allocations': [
+            {
+                'site': str(statistic.traceback[0]),
+                'size_mb': statistic.size / 1024 / 1024,
+                'count': statistic.count,
+            }
+            for statistic in snapshot.statistics('lineno')[:top_limit]
+        ],
+    })
@@ -29,23 +29,25 @@
 # For more information on this, and how to apply and follow the GNU AGPL, see
 # <http://www.gnu.org/licenses/>.
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from core.api.v1.serializers import ProjectSerializer
-from core.models import Project
+from core.models import Attachment, Project
 from core.services.attachments import AttachmentService
 from core.services.projects import ProjectService
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.db.models.functions import Lower
 from django.utils import timezone
+from testrail_migrator.migrator_lib.instance_cache import ModelInstanceCache
+from testrail_migrator.migrator_lib.tracing import traced_bulk
 from tests_description.models import TestCase, TestCaseStep, TestSuite
 from tests_description.selectors.cases import TestCaseSelector
 from tests_description.services.cases import TestCaseService
 from tests_description.services.suites import TestSuiteService
-from tests_representation.models import Parameter, Test, TestPlan, TestResult, TestStepResult
-from tests_representation.services.parameters import ParameterService
+from tests_representation.models import Parameter, Test, TestResult, TestStepResult
 from tests_representation.services.results import TestResultService
-from tests_representation.services.testplans import TestPlanService
 from tests_representation.services.tests import TestService
 
 UserModel = get_user_model()
@@ -71,6 +73,7 @@ class MigratorService:
         return step
 
     @staticmethod
+    @traced_bulk
     def suites_bulk_create(data_list):
         suites = []
         non_side_effect_fields = TestSuiteService.non_side_effect_fields
@@ -130,41 +133,22 @@ class MigratorService:
         )
         return case
 
-    @staticmethod
-    def parameter_bulk_create(data_list):
-        non_side_effect_fields = ParameterService.non_side_effect_fields
-        parameters = [Parameter.model_create(fields=non_side_effect_fields, data=data, commit=False) for data in
-                      data_list]
-        return Parameter.objects.bulk_create(parameters)
-
-    def testplan_bulk_create_with_tests(self, data_list):
-        test_plans = []
-        for data in data_list:
-            parameters = data.get('parameters', [])
-            test_plans.append(
-                self.make_testplan_model(
-                    data,
-                    parameters=[Parameter.objects.get(pk=parameter) for parameter in parameters]
-                )
-            )
-        TestPlan.objects.rebuild()
-        created_tests = []
-        for test_plan, data in zip(test_plans, data_list):
-            if data.get('test_cases'):
-                created_tests.extend(TestService().bulk_test_create([test_plan], data['test_cases']))
-        return created_tests, test_plans
-
     @staticmethod
     @transaction.atomic
-    def result_create(data: Dict[str, Any], user) -> TestResult:
+    def result_create(data: Dict[str, Any], user, instance_cache: ModelInstanceCache = None) -> TestResult:
         test_result: TestResult = TestResult.model_create(
             fields=TestResultService.non_side_effect_fields,
             data=data,
             commit=False,
         )
         test_result.user = user
-        test_result.project = test_result.test.case.project
-        test_result.test_case_version = TestCaseSelector().case_version(test_result.test.case)
+        if instance_cache:
+            case = instance_cache.get(TestCase, test_result.test.case_id)
+            test_result.project = instance_cache.get(Project, case.project_id)
+        else:
+            case = test_result.test.case
+            test_result.project = case.project
+        test_result.test_case_version = TestCaseSelector().case_version(case)
         test_result.full_clean()
         test_result.updated_at = data['updated_at']
         test_result.created_at = data['created_at']
@@ -183,14 +167,6 @@ class MigratorService:
 
         return test_result
 
-    def testplan_bulk_create(self, validated_data):
-        test_plans = []
-        for data in validated_data:
-            test_plans.append(self.make_testplan_model(data))
-        TestPlan.objects.rebuild()
-
-        return test_plans
-
     @staticmethod
     def create_project(project) -> Project:
         data = {
@@ -202,6 +178,12 @@ class MigratorService:
         return ProjectService().project_create(serializer.validated_data)
 
     @staticmethod
+    @traced_bulk
+    def attachments_bulk_create(attachments: List[Attachment], batch_size: int = 100) -> List[Attachment]:
+        return Attachment.objects.bulk_create(attachments, batch_size=batch_size)
+
+    @staticmethod
+    @traced_bulk
     def tests_bulk_create_by_data_list(data_list):
         non_side_effect_fields = TestService.non_side_effect_fields
         test_objects = [Test.model_create(fields=non_side_effect_fields, data=data, commit=False) for data in
@@ -209,28 +191,69 @@ class MigratorService:
         return Test.objects.bulk_create(test_objects)
 
     @staticmethod
-    def user_create(data) -> UserModel:
-        user, _ = UserModel.objects.get_or_create(
-            username__iexact=data['username'],
-            defaults=data
-        )
+    @traced_bulk
+    def users_bulk_get_or_create(data_list) -> List[UserModel]:
+        """
+        Get or create users matched by case-insensitive username.
 
-        return user
+        Existing users are fetched with a single query and missing ones are created with a single bulk insert.
+        Bulk insert skips save signals, so pre_save and post_save are sent for created users the way save sends them,
+        receivers of testy set up profile data of new users.
 
-    @staticmethod
-    def make_testplan_model(data, parameters=None):
-        testplan = TestPlan.model_create(
-            fields=TestPlanService.non_side_effect_fields,
-            data=data,
-            commit=False
+        Args:
+            data_list: list of user data, each one must contain username
+
+        Returns:
+            list of users in the same order as data_list
+        """
+        users = {}
+        usernames = {data['username'].lower() for data in data_list}
+        existing_users = UserModel.objects.annotate(username_lower=Lower('username')).filter(
+            username_lower__in=usernames
         )
-        testplan.lft = 0
-        testplan.rght = 0
-        testplan.tree_id = 0
-        testplan.level = 0
+        for user in existing_users:
+            users.setdefault(user.username_lower, user)
+        new_users = {}
+        for data in data_list:
+            username = data['username'].lower()
+            if username not in users and username not in new_users:
+                new_users[username] = UserModel(**data)
+        for user in new_users.values():
+            pre_save.send(sender=UserModel, instance=user, raw=False, using=UserModel.objects.db, update_fields=None)
+        UserModel.objects.bulk_create(list(new_users.values()))
+        for user in new_users.values():
+            post_save.send(sender=UserModel, instance=user, created=True, raw=False, using=UserModel.objects.db,
+                           update_fields=None)
+        users.update(new_users)
+        return [users[data['username'].lower()] for data in data_list]
 
-        testplan.save()
-        if parameters:
-            testplan.parameters.set(parameters)
+    @staticmethod
+    @traced_bulk
+    def parameters_bulk_get_or_create(data_list) -> List[Parameter]:
+        """
+        Get or create parameters matched by project, group name and data.
+
+        Existing parameters are fetched with a single query and missing ones are created with a single bulk insert.
 
-        return testplan
+        Args:
+            data_list: list of parameter data with project_id, group_name and data
+
+        Returns:
+            list of parameters in the same order as data_list
+        """
+        keys = [(data['project_id'], data['group_name'], data['data']) for data in data_list]
+        parameters = {}
+        existing_parameters = Parameter.objects.filter(
+            project_id__in={data['project_id'] for data in data_list},
+            group_name__in={data['group_name'] for data in data_list},
+            data__in={data['data'] for data in data_list},
+        )
+        for parameter in existing_parameters:
+            parameters.setdefault((parameter.project_id, parameter.group_name, parameter.data), parameter)
+        new_parameters = {}
+        for key, data in zip(keys, data_list):
+            if key not in parameters and key not in new_parameters:
+                new_parameters[key] = Parameter(**data)
+        Parameter.objects.bulk_create(list(new_parameters.values()))
+        parameters.update(new_parameters)
+        return [parameters[key] for key in keys]
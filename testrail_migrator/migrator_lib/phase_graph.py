@@ -0,0 +1,115 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import contextvars
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from django.db import connection
+
+
+@dataclass
+class Phase:
+    name: str
+    func: Callable[[], Any]
+    depends_on: List[str] = field(default_factory=list)
+
+
+class PhaseGraphError(Exception):
+    """Raise if phase graph is not valid."""
+
+
+class PhaseGraph:
+    """
+    Dependency graph of upload phases.
+
+    With one worker phases are run one by one in current thread in order they were added, with several workers
+    every phase runs in a thread pool as soon as all its dependencies are finished. Each thread uses its own database
+    connection, so phases that run in parallel must not rely on transaction of the caller.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self.results: Dict[str, Any] = {}
+        self._phases: Dict[str, Phase] = {}
+
+    def add(self, name: str, func: Callable[[], Any], depends_on: List[str] = None) -> None:
+        """
+        Add phase to graph.
+
+        Args:
+            name: unique name of phase
+            func: callable without arguments, its return value is stored in results by phase name
+            depends_on: names of phases added earlier that must be finished before this one starts
+        """
+        depends_on = depends_on or []
+        if name in self._phases:
+            raise PhaseGraphError(f'Phase {name} was already added')
+        for dependency in depends_on:
+            if dependency not in self._phases:
+                raise PhaseGraphError(f'Phase {name} depends on unknown phase {dependency}')
+        self._phases[name] = Phase(name, func, depends_on)
+
+    def run(self) -> Dict[str, Any]:
+        if self.max_workers <= 1:
+            for phase in self._phases.values():
+                self.results[phase.name] = phase.func()
+            return self.results
+
+        pending = dict(self._phases)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='upload-phase') as executor:
+            while pending or running:
+                for name, phase in list(pending.items()):
+                    if all(dependency in self.results for dependency in phase.depends_on):
+                        # Context is copied, so phases are traced as children of the task span
+                        future = executor.submit(contextvars.copy_context().run, self._run_in_thread, phase)
+                        running[future] = name
+                        del pending[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception:
+                        for not_started in running:
+                            not_started.cancel()
+                        raise
+        return self.results
+
+    @staticmethod
+    def _run_in_thread(phase: Phase):
+        logging.info(f'Phase {phase.name} started')
+        try:
+            return phase.func()
+        finally:
+            connection.close()
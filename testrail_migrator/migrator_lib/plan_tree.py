@@ -0,0 +1,182 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional
+
+from django.db.models import Max
+from django.utils import timezone
+from testrail_migrator.migrator_lib.tracing import span
+from testrail_migrator.migrator_lib.utils import suppress_auto_now
+from tests_representation.models import TestPlan
+from tests_representation.services.testplans import TestPlanService
+
+
+@dataclass
+class PlanNode:
+    key: Hashable
+    instance: TestPlan
+    parameters: List[int] = field(default_factory=list)
+    parent_key: Optional[Hashable] = None
+    parent_id: Optional[int] = None
+    children: List['PlanNode'] = field(default_factory=list)
+
+
+class TestPlanTreeBuilder:
+    """
+    Build a forest of test plans in memory and insert it with precomputed MPTT fields.
+
+    Nodes are attached either to another node of the builder, to an already existing test plan or become new roots.
+    New roots get fresh tree ids and their nested set fields are calculated in memory, so no rebuild is required.
+    Subtrees attached to existing plans are inserted with the tree id of their parent and only the trees they were
+    attached to are rebuilt.
+    """
+
+    timestamp_fields = ['created_at', 'updated_at']
+
+    def __init__(self):
+        self._nodes: Dict[Hashable, PlanNode] = {}
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def add(self, key: Hashable, data: Dict[str, Any], parent_key: Hashable = None, parent_id: int = None,
+            parameters: List[int] = None) -> None:
+        """
+        Add test plan node to the forest.
+
+        Args:
+            key: unique key of node, used to attach children and to look up created plan
+            data: test plan data, same as for TestPlan.model_create
+            parent_key: key of node added earlier that will be parent of this node
+            parent_id: id of existing test plan that will be parent of this node
+            parameters: list of parameter ids for test plan
+        """
+        instance = TestPlan.model_create(fields=TestPlanService.non_side_effect_fields, data=data, commit=False)
+        for field_name in self.timestamp_fields:
+            if data.get(field_name):
+                setattr(instance, field_name, data[field_name])
+        node = PlanNode(key=key, instance=instance, parameters=parameters or [], parent_key=parent_key,
+                        parent_id=parent_id)
+        if parent_key is not None:
+            self._nodes[parent_key].children.append(node)
+        self._nodes[key] = node
+
+    def save(self) -> Dict[Hashable, TestPlan]:
+        """
+        Insert all nodes of the forest.
+
+        Returns:
+            dict of node key to created test plan
+        """
+        if not self._nodes:
+            return {}
+        roots = [node for node in self._nodes.values() if node.parent_key is None and node.parent_id is None]
+        grafts = [node for node in self._nodes.values() if node.parent_key is None and node.parent_id is not None]
+
+        next_tree_id = (TestPlan.objects.aggregate(max_tree_id=Max('tree_id'))['max_tree_id'] or 0) + 1
+        for tree_id, root in enumerate(self._sort_siblings(roots), start=next_tree_id):
+            self._number_subtree(root, tree_id, level=0, counter=1)
+
+        grafted_tree_ids = set()
+        if grafts:
+            parents = TestPlan.objects.only('tree_id', 'level').in_bulk({node.parent_id for node in grafts})
+            for node in grafts:
+                parent = parents[node.parent_id]
+                node.instance.parent_id = parent.id
+                self._number_subtree(node, parent.tree_id, level=parent.level + 1, counter=0)
+                grafted_tree_ids.add(parent.tree_id)
+
+        now = timezone.now()
+        for node in self._nodes.values():
+            for field_name in self.timestamp_fields:
+                if getattr(node.instance, field_name) is None:
+                    setattr(node.instance, field_name, now)
+
+        levels = defaultdict(list)
+        for node in roots + grafts:
+            self._collect_levels(node, levels, depth=0)
+        with suppress_auto_now(TestPlan, self.timestamp_fields):
+            for depth in sorted(levels):
+                for node in levels[depth]:
+                    if node.parent_key is not None:
+                        node.instance.parent_id = self._nodes[node.parent_key].instance.id
+                with span('db.bulk_create', **{'db.model': 'TestPlan', 'db.items': len(levels[depth]),
+                                               'plan_tree.depth': depth}):
+                    TestPlan.objects.bulk_create([node.instance for node in levels[depth]])
+
+        for tree_id in grafted_tree_ids:
+            with span('db.partial_rebuild', **{'db.model': 'TestPlan', 'plan_tree.tree_id': tree_id}):
+                TestPlan.objects.partial_rebuild(tree_id)
+
+        self._bulk_set_parameters()
+        return {key: node.instance for key, node in self._nodes.items()}
+
+    def _number_subtree(self, node: PlanNode, tree_id: int, level: int, counter: int) -> int:
+        node.instance.tree_id = tree_id
+        node.instance.level = level
+        node.instance.lft = counter
+        counter += 1
+        for child in self._sort_siblings(node.children):
+            counter = self._number_subtree(child, tree_id, level + 1, counter)
+        node.instance.rght = counter
+        return counter + 1
+
+    @staticmethod
+    def _collect_levels(node: PlanNode, levels, depth: int):
+        levels[depth].append(node)
+        for child in node.children:
+            TestPlanTreeBuilder._collect_levels(child, levels, depth + 1)
+
+    @staticmethod
+    def _sort_siblings(nodes: List[PlanNode]) -> List[PlanNode]:
+        order_insertion_by = TestPlan._mptt_meta.order_insertion_by
+        if not order_insertion_by:
+            return nodes
+
+        def sort_key(node):
+            values = [getattr(node.instance, field_name) for field_name in order_insertion_by]
+            return [(value is None, value) for value in values]
+
+        return sorted(nodes, key=sort_key)
+
+    def _bulk_set_parameters(self):
+        through_model = TestPlan.parameters.through
+        plan_field = TestPlan.parameters.field.m2m_field_name()
+        parameter_field = TestPlan.parameters.field.m2m_reverse_field_name()
+        through_objects = []
+        for node in self._nodes.values():
+            for parameter_id in node.parameters:
+                through_objects.append(
+                    through_model(**{f'{plan_field}_id': node.instance.id, f'{parameter_field}_id': parameter_id})
+                )
+        with span('db.bulk_create', **{'db.model': through_model.__name__, 'db.items': len(through_objects)}):
+            through_model.objects.bulk_create(through_objects)
@@ -0,0 +1,130 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class ProgressReporter:
+    """
+    Receiver of items progress of current phase.
+
+    Testrail client and testy creator report fetched and created items to it, this one ignores them, so reporting
+    progress is optional for code that uses them outside of tasks.
+    """
+
+    def set_total(self, total: int):
+        """
+        Set number of items of whole phase, e.g. when phase is processed by batches.
+
+        Totals announced by start later in the same phase are ignored then.
+
+        Args:
+            total: number of items of phase
+        """
+
+    def start(self, total: int, unit: str = 'items'):
+        """
+        Announce items that are going to be processed.
+
+        Args:
+            total: number of items, added to items announced before in the same phase unless total of phase is set
+            unit: name of items
+        """
+
+    def advance(self, count: int = 1):
+        """
+        Report processed items.
+
+        Args:
+            count: number of items processed since last call
+        """
+
+
+class ThrottledProgress(ProgressReporter):
+    """
+    Items progress that is published with rate and ETA at most once per interval.
+
+    Every published snapshot is written to result backend by task, so it is published only when interval has passed
+    since previous one or when all announced items are processed.
+    """
+
+    def __init__(self, publish: Callable[[Dict[str, Any]], None], interval: float = 1.0):
+        self.publish = publish
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start counting items of new phase."""
+        with self._lock:
+            self.done = 0
+            self.total = 0
+            self.unit = 'items'
+            self._total_is_set = False
+            self._started = time.perf_counter()
+            self._published: Optional[float] = None
+
+    def set_total(self, total: int):
+        with self._lock:
+            self.total = total
+            self._total_is_set = True
+
+    def start(self, total: int, unit: str = 'items'):
+        with self._lock:
+            if not self._total_is_set:
+                self.total += total
+            self.unit = unit
+            self._publish(force=True)
+
+    def advance(self, count: int = 1):
+        with self._lock:
+            self.done += count
+            self._publish(force=self.done == self.total)
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self._started
+        rate = self.done / elapsed if elapsed and self.done else None
+        return {
+            'done': self.done,
+            'total': self.total,
+            'unit': self.unit,
+            'elapsed': elapsed,
+            'rate': rate,
+            'eta': max(self.total - self.done, 0) / rate if rate else None,
+        }
+
+    def _publish(self, force: bool):
+        now = time.perf_counter()
+        if not force and self._published is not None and now - self._published < self.interval:
+            return
+        self._published = now
+        self.publish(self.snapshot())
@@ -0,0 +1,141 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.db import connection
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_VALUES_LIST = re.compile(r'(VALUES\s*)\(.*\)', re.IGNORECASE | re.DOTALL)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    Normalize sql statement so statements differing only by parameters have equal fingerprint.
+
+    Args:
+        sql: sql statement as passed to cursor, with placeholders or inlined literals
+
+    Returns:
+        statement with literals, IN lists and VALUES rows collapsed
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    sql = _VALUES_LIST.sub(r'\1(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryAccountant:
+    """
+    Database execute wrapper counting queries, time spent in database and repeated statements.
+
+    Wrapper is installed per connection, so it sees queries of the thread it was installed in only.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.fingerprint_time = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            fingerprint = sql_fingerprint(sql)
+            self.count += 1
+            self.db_time += elapsed
+            self.fingerprints[fingerprint] += 1
+            self.fingerprint_time[fingerprint] += elapsed
+
+    @property
+    def duplicates(self) -> int:
+        """Number of queries repeating statement that was already executed in phase."""
+        return sum(count - 1 for count in self.fingerprints.values())
+
+    def top_repeated(self, limit: int = 5) -> List[Dict]:
+        return [
+            {'sql': fingerprint, 'count': count, 'db_time': self.fingerprint_time[fingerprint]}
+            for fingerprint, count in self.fingerprints.most_common(limit)
+            if count > 1
+        ]
+
+
+def query_budget_for(phase_name: str, query_budgets: Optional[Dict[str, int]]) -> Optional[int]:
+    """
+    Find query budget of phase.
+
+    Args:
+        phase_name: name of phase
+        query_budgets: max number of queries by phase name prefix, '*' sets budget of phases not matched by prefix
+
+    Returns:
+        budget of longest matching prefix or default budget, None if phase is not limited
+    """
+    if not query_budgets:
+        return None
+    prefixes = [prefix for prefix in query_budgets if prefix != '*' and phase_name.startswith(prefix)]
+    if prefixes:
+        return query_budgets[max(prefixes, key=len)]
+    return query_budgets.get('*')
+
+
+@contextmanager
+def account_queries(phase_name: str, query_budget: int = None):
+    """
+    Count queries of phase executed by connection of current thread.
+
+    Args:
+        phase_name: name of phase used in log messages
+        query_budget: max number of queries, warning is logged with top repeated statements when it is exceeded
+
+    Yields:
+        query accountant of phase
+    """
+    accountant = QueryAccountant()
+    with connection.execute_wrapper(accountant):
+        yield accountant
+    if query_budget is not None and accountant.count > query_budget:
+        logging.warning(
+            f'Phase "{phase_name}" executed {accountant.count} queries, budget is {query_budget}, '
+            f'top repeated statements: {accountant.top_repeated()}'
+        )
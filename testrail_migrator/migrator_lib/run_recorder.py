@@ -0,0 +1,182 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+from celery_progress.backend import PROGRESS_STATE
+from django.utils import timezone
+from testrail_migrator.migrator_lib.instance_cache import ModelInstanceCache
+from testrail_migrator.migrator_lib.memory_profile import trace_allocations
+from testrail_migrator.migrator_lib.progress import ThrottledProgress
+from testrail_migrator.migrator_lib.query_accounting import account_queries, query_budget_for
+from testrail_migrator.migrator_lib.tracing import span
+from testrail_migrator.models import MigrationRun, MigrationRunPhase, TestrailBackup
+
+from utils import ProgressRecorderContext
+
+
+class PhaseTiming:
+    def __init__(self, name: str):
+        self.name = name
+        self.items: Optional[int] = None
+        self.memory: Optional[Dict[str, Any]] = None
+        self.started_at = timezone.now()
+        self._wall_started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    def stop(self):
+        self.wall_time = time.perf_counter() - self._wall_started
+        self.cpu_time = time.process_time() - self._cpu_started
+
+
+@contextmanager
+def record_phase(run: MigrationRun, name: str, item_counter: Callable[[], int] = None, count_queries: bool = False,
+                 query_budget: int = None, profile_memory: bool = False):
+    """
+    Measure phase of migration task and save it to migration run.
+
+    Cpu time is time of whole worker process, so it includes other phases running in parallel threads.
+
+    Args:
+        run: migration run of task
+        name: name of phase
+        item_counter: function returning number of items processed by task so far, items of phase are counted as
+            difference of its values, phase can set items itself instead
+        count_queries: count database queries of phase made in current thread
+        query_budget: max number of queries of phase, warning is logged when it is exceeded
+        profile_memory: trace allocations of phase with tracemalloc, it slows phase down
+
+    Yields:
+        phase timing, its items can be set inside phase
+    """
+    items_before = item_counter() if item_counter else None
+    phase = PhaseTiming(name)
+    with span(name, **{'migration.run_id': run.pk}) as phase_span:
+        with trace_allocations() if profile_memory else nullcontext() as memory:
+            with account_queries(name, query_budget) if count_queries else nullcontext() as queries:
+                yield phase
+        phase.stop()
+        if phase.items is None and item_counter:
+            phase.items = item_counter() - items_before
+        if phase_span:
+            phase_span.set_attribute('migration.items', phase.items)
+    phase.memory = memory
+    MigrationRunPhase.objects.create(
+        run=run,
+        name=name[:255],
+        started_at=phase.started_at,
+        wall_time=phase.wall_time,
+        cpu_time=phase.cpu_time,
+        items=phase.items,
+        throughput=phase.items / phase.wall_time if phase.items is not None and phase.wall_time else None,
+        query_count=queries.count if queries else None,
+        db_time=queries.db_time if queries else None,
+        duplicate_queries=queries.duplicates if queries else None,
+        top_queries=queries.top_repeated() if queries else None,
+        **(memory or {}),
+    )
+    MigrationRun.objects.filter(pk=run.pk).update(updated_at=timezone.now())
+
+
+class MigrationRunRecorder(ProgressRecorderContext):
+    """
+    Progress recorder that also saves wall time, cpu time and items of every progress context to migration run.
+
+    Items progress of current phase reported to items attribute is added to task progress with rate and ETA, pass it
+    to testrail client and testy creator used by task.
+    """
+
+    def __init__(self, task, *args, backup_name: str = None, item_counter: Callable[[], int] = None,
+                 count_queries: bool = False, query_budgets: Dict[str, int] = None, profile_memory: bool = False,
+                 progress_interval: float = 1.0, **kwargs):
+        self.items = ThrottledProgress(self._publish_items, progress_interval)
+        self._description = kwargs.get('description', '')
+        super().__init__(task, *args, **kwargs)
+        self.item_counter = item_counter
+        self.count_queries = count_queries or bool(query_budgets)
+        self.query_budgets = query_budgets
+        self.profile_memory = profile_memory
+        self.memory_profile: List[Dict[str, Any]] = []
+        self.instance_cache: Optional[ModelInstanceCache] = None
+        self.run = MigrationRun.objects.create(
+            task_id=task.request.id,
+            task_name=task.name,
+            backup=TestrailBackup.objects.filter(name=backup_name).first() if backup_name else None,
+        )
+
+    @contextmanager
+    def progress_context(self, description, *args, **kwargs):
+        self._description = description
+        self.items.reset()
+        with super().progress_context(description, *args, **kwargs):
+            with self.measure(description) as phase:
+                yield phase
+
+    @contextmanager
+    def measure(self, name: str):
+        """Record phase of migration run without moving progress bar."""
+        with record_phase(self.run, name, self.item_counter, self.count_queries,
+                          query_budget_for(name, self.query_budgets), self.profile_memory) as phase:
+            yield phase
+        if phase.memory:
+            self.memory_profile.append({'name': name, **phase.memory})
+
+    def _publish_items(self, items: Dict[str, Any]):
+        self.task.update_state(state=PROGRESS_STATE, meta={
+            'pending': False,
+            'current': self.current,
+            'total': self.total,
+            'percent': round(self.current / self.total * 100, 2) if self.total else 0,
+            'description': self._description,
+            'items': items,
+        })
+
+    def task_result(self, result: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Add stats of instance cache used by task and memory profile of run to task result when they are collected.
+
+        Args:
+            result: result of task
+
+        Returns:
+            task result
+        """
+        collected = {}
+        if self.instance_cache:
+            collected['instance_cache'] = self.instance_cache.stats()
+        if self.profile_memory:
+            collected['memory_profile'] = self.memory_profile
+        if not collected:
+            return result
+        return {**(result or {}), **collected}
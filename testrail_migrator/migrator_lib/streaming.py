@@ -0,0 +1,228 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import asyncio
+import itertools
+from functools import partial
+from typing import Callable, Dict, Iterable, List
+
+from asgiref.sync import async_to_sync, sync_to_async
+from testrail_migrator.migrator_lib.id_mappings import EntityType, IdMappingStore
+from testrail_migrator.migrator_lib.testrail import InstanceType, TestRailClient
+from testrail_migrator.migrator_lib.testy import TestyCreator
+from testrail_migrator.migrator_lib.utils import split_list_by_chunks
+from tests_description.models import TestCase, TestSuite
+
+_END = object()
+
+
+class StreamingMigrator:
+    """
+    Migrate testrail content to testy without intermediate backup.
+
+    Every stream is a chain of stages connected by bounded queues: async stages fetch data from testrail, sync stages
+    create testy objects. Sync stages run in thread of the caller, so they share its database transaction, while
+    fetching of the next chunks goes on.
+    """
+
+    def __init__(self, creator: TestyCreator, id_store: IdMappingStore, testrail_client: TestRailClient, project,
+                 user_mappings: Dict[int, int], migrate_attachments: bool = False, queue_size: int = 4):
+        """
+        Init method for StreamingMigrator.
+
+        Args:
+            creator: instance of TestyCreator
+            id_store: store of testrail to testy id mappings
+            testrail_client: instance of TestRailClient
+            project: testy project to migrate to
+            user_mappings: mapping of testrail users to testy users
+            migrate_attachments: migrate attachments of cases and tests or not
+            queue_size: max number of chunks waiting between two stages
+        """
+        self.creator = creator
+        self.id_store = id_store
+        self.testrail_client = testrail_client
+        self.project = project
+        self.user_mappings = user_mappings
+        self.migrate_attachments = migrate_attachments
+        self.queue_size = queue_size
+        self.mappings = {'sections': {}, 'cases': {}, 'attachments': {}}
+
+    @async_to_sync
+    async def migrate_suites(self, testrail_project_id: int, suites: List[dict], suite_mappings: Dict[int, int],
+                             custom_fields_matcher: dict):
+        """
+        Stream sections and cases of suites, cases of a chunk of suites are created while next chunk is downloading.
+
+        Args:
+            testrail_project_id: testrail project id
+            suites: testrail suites
+            suite_mappings: mapping of testrail suites to testy suites
+            custom_fields_matcher: matcher of testrail case custom fields to testy fields
+        """
+        async def fetch_suites(suites_chunk):
+            cases, sections = await asyncio.gather(
+                self._gather(partial(self.testrail_client.get_cases_for_suite, testrail_project_id), suites_chunk),
+                self._gather(partial(self.testrail_client.get_sections_for_suite, testrail_project_id), suites_chunk)
+            )
+            return cases, sections
+
+        def store_suites(fetched):
+            cases, sections = fetched
+            testy_filters = {'project_id': self.project.id}
+            self.mappings['sections'].update(
+                self.id_store.create_missing(
+                    EntityType.SECTION, TestSuite, sections, self.creator.create_sections, suite_mappings,
+                    self.project.id, testy_filters=testy_filters, pass_known_mappings=True, rebuild_tree=False
+                )
+            )
+            self.mappings['cases'].update(
+                self.id_store.create_missing(
+                    EntityType.CASE, TestCase, cases, self.creator.create_cases, suite_mappings,
+                    self.mappings['sections'], self.project.id, custom_fields_matcher, testy_filters=testy_filters
+                )
+            )
+            return self.id_store.without_reused_parents(EntityType.CASE, cases)
+
+        stages = [fetch_suites, store_suites]
+        if self.migrate_attachments:
+            stages.extend(self._attachment_stages(InstanceType.CASE, 'case_id', 'cases'))
+        await self._run_pipeline(split_list_by_chunks(suites, 1), stages)
+        # Whole suites tree is rebuilt once after the stream instead of after sections of every suite
+        await sync_to_async(TestSuite.objects.rebuild)()
+
+    @async_to_sync
+    async def migrate_runs(self, key: str, runs: List[dict], run_mappings: Dict[int, int], custom_fields_multi_select,
+                           custom_fields_labels):
+        """
+        Stream tests and results of runs, results of a chunk of runs are created while next chunk is downloading.
+
+        Args:
+            key: parent_plan or parent_mile, mappings are saved as tests_{key} and results_{key}
+            runs: testrail runs
+            run_mappings: mapping of testrail runs to testy test plans
+            custom_fields_multi_select: multi select custom fields of testrail results
+            custom_fields_labels: labels of testrail results custom fields
+        """
+        self.mappings[f'tests_{key}'] = {}
+        self.mappings[f'results_{key}'] = {}
+
+        async def fetch_tests(runs_chunk):
+            return await self._gather(lambda run: self.testrail_client.get_tests(run['id']), runs_chunk)
+
+        def store_tests(tests):
+            self.mappings[f'tests_{key}'].update(
+                self.creator.create_tests_for_runs(tests, run_mappings, self.mappings['cases'], self.project.id,
+                                                   self.user_mappings)
+            )
+            return tests
+
+        async def fetch_results(tests):
+            return tests, await self._gather(lambda test: self.testrail_client.get_results(test['id']), tests)
+
+        def store_results(fetched):
+            tests, results = fetched
+            self.mappings[f'results_{key}'].update(
+                self.creator.create_results(results, custom_fields_multi_select, custom_fields_labels,
+                                            self.mappings[f'tests_{key}'], self.user_mappings)
+            )
+            return fetched
+
+        stages = [fetch_tests, store_tests, fetch_results, store_results]
+        if self.migrate_attachments:
+            stages.extend(self._attachment_stages(InstanceType.TEST, 'result_id', f'results_{key}'))
+        await self._run_pipeline(split_list_by_chunks(runs), stages)
+
+    def _attachment_stages(self, instance_type: InstanceType, parent_key: str, mapping_key: str) -> List[Callable]:
+        async def fetch_attachments(instances):
+            attachment_list = None
+            if instance_type == InstanceType.TEST:
+                # Results of newer testrail contain ids of their attachments, then tests are not requested one by one
+                instances, results = instances
+                if all('attachment_ids' in result for result in results):
+                    attachment_list = self.testrail_client.get_attachments_from_results(results)
+            if attachment_list is None:
+                attachment_list = await self._gather(
+                    lambda instance: self.testrail_client.get_attachment_with_parent_id(instance['id'], instance_type),
+                    instances
+                )
+            file_attachments = {}
+            for chunk in split_list_by_chunks(attachment_list):
+                for attachment in await asyncio.gather(
+                        *[self.testrail_client.get_attachment(attachment, parent_key) for attachment in chunk]
+                ):
+                    if attachment:
+                        file_attachments.update(attachment)
+            return file_attachments
+
+        def store_attachments(file_attachments):
+            self.mappings['attachments'].update(
+                self.creator.attachment_bulk_create(file_attachments, self.project, self.user_mappings, parent_key,
+                                                    self.mappings[mapping_key], instance_type)
+            )
+
+        return [fetch_attachments, store_attachments]
+
+    @staticmethod
+    async def _gather(fetch: Callable, instances: List[dict]) -> List[dict]:
+        fetched = []
+        for chunk in split_list_by_chunks(instances):
+            fetched.extend(
+                itertools.chain.from_iterable(elem or [] for elem in await asyncio.gather(*map(fetch, chunk)))
+            )
+        return fetched
+
+    async def _run_pipeline(self, source: Iterable, stages: List[Callable]):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in stages]
+
+        async def feed():
+            for item in source:
+                await queues[0].put(item)
+            await queues[0].put(_END)
+
+        async def work(stage, in_queue, out_queue):
+            func = stage if asyncio.iscoroutinefunction(stage) else sync_to_async(stage)
+            while (item := await in_queue.get()) is not _END:
+                result = await func(item)
+                if out_queue is not None:
+                    await out_queue.put(result)
+            if out_queue is not None:
+                await out_queue.put(_END)
+
+        tasks = [asyncio.ensure_future(feed())]
+        for idx, stage in enumerate(stages):
+            out_queue = queues[idx + 1] if idx + 1 < len(stages) else None
+            tasks.append(asyncio.ensure_future(work(stage, queues[idx], out_queue)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Stages waiting for items of a failed stage never finish on their own
+            for task in tasks:
+                task.cancel()
@@ -30,19 +30,25 @@
 # <http://www.gnu.org/licenses/>.
 import asyncio
 import itertools
+import json
 import logging
+import re
+import time
 from enum import Enum
-from json import JSONDecodeError
 
 import aiohttp
-from aiohttp import ClientConnectionError, ContentTypeError
+from aiohttp import ClientConnectionError
 from asgiref.sync import async_to_sync
-from tqdm.asyncio import tqdm
-
 from .config import TestrailConfig
+from .http_metrics import HttpMetrics, endpoint_template
+from .progress import ProgressReporter
+from .tracing import SPAN_KIND_CLIENT, span
 from .utils import split_list_by_chunks
 
 
+INLINE_ATTACHMENT_PATTERN = r'index\.php\?/attachments/get/(?P<attachment_id>\d*)'
+
+
 class InstanceType(Enum):
     PLAN = 'plan'
     CASE = 'case'
@@ -66,20 +72,31 @@ class TestRailClientError(Exception):
         super().__init__(msg)
 
 
+class RetryableStatusError(ClientConnectionError):
+    """Raise if testrail responded with status that is worth retrying."""
+
+    def __init__(self, status: int):
+        super().__init__(f'Testrail responded with status {status}')
+        self.status = status
+
+
 class TestRailClient:
     """Implement testrail client."""
 
-    def __init__(self, config: TestrailConfig, timeout=5):
+    def __init__(self, config: TestrailConfig, timeout=5, progress: ProgressReporter = None):
         """
         Init method for TestRailClient.
 
         Args:
             config: instance of TestrailConfig
+            progress: receiver of progress of requests made for lists of instances
         """
         if not config.login or not config.password:
             raise TestRailClientError('No login or password were provided.')
         self.config = config
         self.timeout = timeout
+        self.metrics = HttpMetrics()
+        self.progress = progress or ProgressReporter()
 
     @async_to_sync
     async def get_users(self, project_id=''):
@@ -102,39 +119,39 @@ class TestRailClient:
         plans_without_runs = await self.get_plans(project_id, query_params=query_params)
         plans = []
         plan_chunks = split_list_by_chunks(plans_without_runs)
-        for chunk in tqdm(plan_chunks, desc='Plans progress'):
+        self.progress.start(len(plans_without_runs), 'plans')
+        for chunk in plan_chunks:
             tasks = []
             for plan in chunk:
                 tasks.append(self.get_plan(plan['id']))
-            plans.extend(await tqdm.gather(*tasks, desc='Plans chunk progress', leave=False))
+            plans.extend(await asyncio.gather(*tasks))
+            self.progress.advance(len(chunk))
         return plans
 
     @async_to_sync
     async def get_results_for_tests(self, tests):
         results = []
         test_chunks = split_list_by_chunks(tests)
-        for chunk in tqdm(test_chunks, desc='Getting results for tests'):
+        self.progress.start(len(tests), 'tests')
+        for chunk in test_chunks:
             tasks = []
             for test in chunk:
                 tasks.append(self.get_results(test['id']))
-            results.extend(
-                list(
-                    itertools.chain.from_iterable(await tqdm.gather(*tasks, desc='Results chunk progress', leave=False))
-                )
-            )
+            results.extend(list(itertools.chain.from_iterable(await asyncio.gather(*tasks))))
+            self.progress.advance(len(chunk))
         return results
 
     @async_to_sync
     async def get_tests_for_runs(self, runs):
         tests = []
         run_chunks = split_list_by_chunks(runs)
-        for chunk in tqdm(run_chunks, desc='Getting tests for runs'):
+        self.progress.start(len(runs), 'runs')
+        for chunk in run_chunks:
             tasks = []
             for run in chunk:
                 tasks.append(self.get_tests(run['id']))
-            tests.extend(
-                list(itertools.chain.from_iterable(await tqdm.gather(*tasks, desc='Tests chunk progress', leave=False)))
-            )
+            tests.extend(list(itertools.chain.from_iterable(await asyncio.gather(*tasks))))
+            self.progress.advance(len(chunk))
         return tests
 
     @async_to_sync
@@ -159,28 +176,26 @@ class TestRailClient:
     async def get_cases(self, project_id, suites):
         tests = []
         suite_chunks = split_list_by_chunks(suites)
-        for chunk in tqdm(suite_chunks, desc='Getting cases for suites'):
+        self.progress.start(len(suites), 'suites')
+        for chunk in suite_chunks:
             tasks = []
             for suite in chunk:
                 tasks.append(self.get_cases_for_suite(project_id, suite['id']))
-            tests.extend(
-                list(itertools.chain.from_iterable(await tqdm.gather(*tasks, desc='Cases chunk progress', leave=False)))
-            )
+            tests.extend(list(itertools.chain.from_iterable(await asyncio.gather(*tasks))))
+            self.progress.advance(len(chunk))
         return tests
 
     @async_to_sync
     async def get_sections(self, project_id, suites):
         sections = []
         suite_chunks = split_list_by_chunks(suites)
-        for chunk in tqdm(suite_chunks, desc='Getting sections for suites'):
+        self.progress.start(len(suites), 'suites')
+        for chunk in suite_chunks:
             tasks = []
             for suite in chunk:
                 tasks.append(self.get_sections_for_suite(project_id, suite['id']))
-            sections.extend(
-                list(itertools.chain.from_iterable(
-                    await tqdm.gather(*tasks, desc='Section chunk progress', leave=False))
-                )
-            )
+            sections.extend(list(itertools.chain.from_iterable(await asyncio.gather(*tasks))))
+            self.progress.advance(len(chunk))
         return sections
 
     @async_to_sync
@@ -245,8 +260,9 @@ class TestRailClient:
     async def get_attachments_for_instances(self, instances: list, instance_type: InstanceType):
         attachments = []
         chunks = split_list_by_chunks(instances)
+        self.progress.start(len(instances), f'{instance_type.value}s')
 
-        for idx, chunk in enumerate(tqdm(chunks, desc=f'{instance_type.value} attachments progress')):
+        for chunk in chunks:
             tasks = []
             if instance_type == InstanceType.ENTRY:
                 for instance in chunk:
@@ -259,13 +275,42 @@ class TestRailClient:
                         self.get_attachment_with_parent_id(instance['id'], instance_type)
                     )
 
-            attachments.extend(
-                list(
-                    itertools.chain.from_iterable(
-                        await tqdm.gather(*tasks, desc='attachments chunk progress', leave=False)
-                    )
-                )
-            )
+            attachments.extend(list(itertools.chain.from_iterable(await asyncio.gather(*tasks))))
+            self.progress.advance(len(chunk))
+        return attachments
+
+    def get_attachments_for_tests(self, tests: list, results: list):
+        """
+        Get attachments of test results.
+
+        Results of testrail 7.1 and newer contain ids of their attachments, so attachment list is made from them
+        without requests. Attachments of every test are requested only if results come from older server.
+
+        Args:
+            tests: list of testrail tests
+            results: list of testrail results of these tests
+
+        Returns:
+            list of attachments with result_id, file name and size of attachments made from results are not known
+        """
+        if all('attachment_ids' in result for result in results):
+            return self.get_attachments_from_results(results)
+        return self.get_attachments_for_instances(tests, InstanceType.TEST)
+
+    @staticmethod
+    def get_attachments_from_results(results: list):
+        attachments = []
+        for result in results:
+            for attachment_id in result['attachment_ids'] or []:
+                attachments.append({
+                    'id': attachment_id,
+                    'name': None,
+                    'size': None,
+                    'created_on': result['created_on'],
+                    'user_id': result['created_by'],
+                    'result_id': result['id'],
+                    'test_id': result['test_id'],
+                })
         return attachments
 
     @async_to_sync
@@ -273,11 +318,13 @@ class TestRailClient:
         attachments = []
         result = {}
         attachment_chunks = split_list_by_chunks(attachment_list)
-        for chunk in tqdm(attachment_chunks):
+        self.progress.start(len(attachment_list), 'attachments')
+        for chunk in attachment_chunks:
             tasks = []
             for attachment in chunk:
                 tasks.append(self.get_attachment(attachment, parent_key))
-            attachments.extend(await tqdm.gather(*tasks, leave=False))
+            attachments.extend(await asyncio.gather(*tasks))
+            self.progress.advance(len(chunk))
         for attachment in attachments:
             if attachment:
                 logging.debug(f'skipped attachments parent_key:{parent_key}')
@@ -291,28 +338,51 @@ class TestRailClient:
         async with aiohttp.ClientSession(auth=aiohttp.BasicAuth(self.config.login, self.config.password),
                                          timeout=self.timeout) as session:
             while retry_count:
+                endpoint = f'/get_attachment/{attachment["id"]}'
                 try:
-                    async with session.get(url=self.config.api_url + f'/get_attachment/{attachment["id"]}',
-                                           headers=headers, timeout=self.timeout) as resp:
-                        if resp.status == 400:
-                            return
-                        if resp.status != 200:
-                            raise ClientConnectionError
-                        return {
-                            attachment['id']: {
-                                parent_key: attachment[parent_key],
-                                'content_type': resp.content_type,
-                                'size': attachment['size'],
-                                'charset': resp.charset,
-                                'name': attachment['name'],
-                                'field_name': 'file',
-                                'file_bytes': await resp.read(),
-                                'user_id': attachment['user_id'],
-                            }
-                        }
-                except (ClientConnectionError, asyncio.TimeoutError):
+                    resp, body = await self._get(session, endpoint, headers)
+                    if resp.status == 400:
+                        return
+                    if resp.status != 200:
+                        raise RetryableStatusError(resp.status)
+                    content_disposition = resp.content_disposition
+                    return self.make_attachment_data(
+                        attachment, parent_key, resp.content_type, resp.charset, body,
+                        content_disposition.filename if content_disposition else None
+                    )
+                except (ClientConnectionError, asyncio.TimeoutError) as err:
+                    self.metrics.retry(endpoint, err)
                     retry_count -= 1
 
+    @staticmethod
+    def make_attachment_data(attachment, parent_key, content_type, charset, file_bytes, file_name=None):
+        """
+        Make attachment data with file in format used by testy creator.
+
+        Args:
+            attachment: testrail attachment
+            parent_key: key of attachment parent id, skipped if not provided
+            content_type: content type of file
+            charset: charset of file
+            file_bytes: file content
+            file_name: name of file from response, used if attachment has no name
+
+        Returns:
+            dict of attachment id to attachment data
+        """
+        attachment_data = {
+            'content_type': content_type,
+            'size': attachment.get('size') or len(file_bytes),
+            'charset': charset,
+            'name': attachment.get('name') or file_name or f'attachment {attachment["id"]}',
+            'field_name': 'file',
+            'file_bytes': file_bytes,
+            'user_id': attachment.get('user_id'),
+        }
+        if parent_key:
+            attachment_data[parent_key] = attachment[parent_key]
+        return {attachment['id']: attachment_data}
+
     async def get_single_attachment(self, attachment_id, retry_count=30):
         headers = {
             'Content-Type': 'application/json; charset=utf-8'
@@ -320,16 +390,44 @@ class TestRailClient:
         async with aiohttp.ClientSession(auth=aiohttp.BasicAuth(self.config.login, self.config.password),
                                          timeout=self.timeout) as session:
             while retry_count:
+                endpoint = f'/get_attachment/{attachment_id}'
                 try:
-                    async with session.get(url=self.config.api_url + f'/get_attachment/{attachment_id}',
-                                           headers=headers, timeout=self.timeout) as resp:
-                        if resp.status != 200:
-                            logging.error(resp)
-                            raise ClientConnectionError
-                        return await resp.read()
-                except (ClientConnectionError, asyncio.TimeoutError):
+                    resp, body = await self._get(session, endpoint, headers)
+                    if resp.status != 200:
+                        logging.error(resp)
+                        raise RetryableStatusError(resp.status)
+                    return body
+                except (ClientConnectionError, asyncio.TimeoutError) as err:
+                    self.metrics.retry(endpoint, err)
                     retry_count -= 1
 
+    @staticmethod
+    def find_inline_attachment_ids(instances, pattern: str = INLINE_ATTACHMENT_PATTERN):
+        """
+        Find ids of attachments referenced in text fields of testrail instances.
+
+        Args:
+            instances: list of testrail instances, nested dicts and lists are checked too
+            pattern: regex of attachment url, first group must match attachment id
+
+        Returns:
+            set of attachment ids
+        """
+        compiled_pattern = re.compile(pattern)
+        attachment_ids = set()
+        values = list(instances)
+        while values:
+            value = values.pop()
+            if isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, str):
+                attachment_ids.update(
+                    int(match.group(1)) for match in compiled_pattern.finditer(value) if match.group(1)
+                )
+        return attachment_ids
+
     async def get_attachments_for_plan(self, plan_id: int):
         list_of_attachments = await self._process_request(f'/get_attachments_for_plan/{plan_id}')
         if list_of_attachments:
@@ -370,16 +468,35 @@ class TestRailClient:
                                          timeout=self.timeout) as session:
             while retry_count:
                 try:
-                    async with session.get(url=url, headers=headers, timeout=self.timeout) as resp:
-                        if resp.status == 400:
-                            return
-                        if resp.status != 200:
-                            try:
-                                logging.error(await resp.json())
-                            except (JSONDecodeError, ContentTypeError):
-                                logging.error(await resp.text())
-                            raise ClientConnectionError
-                        return await resp.read() if file else await resp.json()
+                    resp, body = await self._get(session, endpoint, headers, url)
+                    if resp.status == 400:
+                        return
+                    if resp.status != 200:
+                        logging.error(body.decode(resp.charset or 'utf-8', errors='replace'))
+                        raise RetryableStatusError(resp.status)
+                    return body if file else json.loads(body)
                 except (ClientConnectionError, asyncio.TimeoutError) as err:
                     logging.error(err)
+                    self.metrics.retry(endpoint, err)
                     retry_count -= 1
+
+    async def _get(self, session: aiohttp.ClientSession, endpoint: str, headers, url: str = None):
+        """
+        Make GET request and read its body while connection is still held.
+
+        Response is released when this returns, so its body must not be read again, use returned bytes instead.
+
+        Returns:
+            tuple of response and its body
+        """
+        url = url or self.config.api_url + endpoint
+        with span(f'GET {endpoint_template(endpoint)}', SPAN_KIND_CLIENT,
+                  **{'http.method': 'GET', 'http.url': url}) as request_span:
+            started = time.perf_counter()
+            async with session.get(url=url, headers=headers, timeout=self.timeout) as resp:
+                body = await resp.read()
+            self.metrics.observe(endpoint, resp.status, time.perf_counter() - started, len(body))
+            if request_span:
+                request_span.set_attribute('http.status_code', resp.status)
+                request_span.set_attribute('http.response_content_length', len(body))
+        return resp, body
@@ -28,6 +28,7 @@
 # if any, to sign a "copyright disclaimer" for the program, if necessary.
 # For more information on this, and how to apply and follow the GNU AGPL, see
 # <http://www.gnu.org/licenses/>.
+import asyncio
 import io
 import logging
 import os
@@ -36,8 +37,9 @@ import time
 from copy import deepcopy
 from datetime import datetime
 from enum import Enum
+from functools import partial
 from operator import itemgetter
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
 
 import pytz
 from asgiref.sync import async_to_sync, sync_to_async
@@ -45,18 +47,21 @@ from core.models import Attachment, Project
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db.models import Q
 from django.utils import timezone
 from testrail_migrator.migrator_lib import TestrailConfig
+from testrail_migrator.migrator_lib.attachment_urls import AttachmentUrlRewriter
+from testrail_migrator.migrator_lib.instance_cache import ModelInstanceCache
 from testrail_migrator.migrator_lib.migrator_service import MigratorService
-from testrail_migrator.migrator_lib.testrail import InstanceType, TestRailClient
-from testrail_migrator.migrator_lib.utils import split_list_by_chunks, suppress_auto_now
-from testrail_migrator.serializers import TestSerializer
+from testrail_migrator.migrator_lib.plan_tree import TestPlanTreeBuilder
+from testrail_migrator.migrator_lib.progress import ProgressReporter
+from testrail_migrator.migrator_lib.testrail import INLINE_ATTACHMENT_PATTERN, InstanceType, TestRailClient
+from testrail_migrator.migrator_lib.tracing import span
+from testrail_migrator.migrator_lib.utils import ByteBudget, split_list_by_chunks, suppress_auto_now
 from tests_description.api.v1.serializers import TestSuiteSerializer
 from tests_description.models import TestCase, TestCaseStep, TestSuite
 from tests_representation.api.v1.serializers import TestPlanInputSerializer
-from tests_representation.models import Parameter, Test, TestPlan, TestResult
-from tests_representation.services.tests import TestService
-from tqdm.asyncio import tqdm
+from tests_representation.models import Test, TestPlan, TestResult
 
 UserModel = get_user_model()
 
@@ -76,67 +81,96 @@ class TestyCreator:
         3: 5,  # Untested
         4: 6  # Not matching retest in tr / broken in testy
     }
+    attachment_url_marker = 'index.php?/attachments/get/'
     markdown_endl_sep = '  \n'
+    attachment_content_models = {
+        InstanceType.CASE: TestCase,
+        InstanceType.PLAN: TestPlan,
+        InstanceType.RUN: TestPlan,
+        InstanceType.TEST: TestResult,
+    }
 
     def __init__(self, service_login: str = 'admin',
                  testy_attachment_url: str = None,
-                 replace_pattern: str = r'index\.php\?/attachments/get/(?P<attachment_id>\d*)',
-                 default_root_section_name: str = 'Test Cases'):
+                 replace_pattern: str = INLINE_ATTACHMENT_PATTERN,
+                 default_root_section_name: str = 'Test Cases',
+                 instance_cache_size: int = 10000,
+                 progress: ProgressReporter = None):
         self.service_user = UserModel.objects.get(username=service_login)
+        self.instance_cache = ModelInstanceCache(instance_cache_size)
+        self.instance_cache.add(self.service_user, UserModel)
         self.replace_pattern = replace_pattern
         if not testy_attachment_url:
             logging.warning('Testy attachment url was not provided')
-        self.testy_attachment_url = testy_attachment_url + '/'
+        self.testy_attachment_url = (testy_attachment_url or '') + '/'
+        self.url_rewriter = AttachmentUrlRewriter(replace_pattern, self.testy_attachment_url)
+        self.prefetched_attachments = {}
+        self.prefetched_body_loader = None
         self.default_root_section_name = default_root_section_name
+        self.progress = progress or ProgressReporter()
 
     async def replace_testrail_attachment_url(self, text_to_check, attachments_mapping,
                                               testrail_client: TestRailClient, parent_object):
-        if not text_to_check:
-            return False, text_to_check
-        found_list = re.findall(self.replace_pattern, text_to_check)
-        if not found_list:
-            return False, text_to_check
-        resulting_text = text_to_check
-        for found_id in found_list:
-            src_attachment_id = int(found_id)
-            attachment_id = attachments_mapping.get(src_attachment_id)
-            if not attachment_id:
-                file_bytes = await testrail_client.get_single_attachment(src_attachment_id)
-                temp_file = io.BytesIO(file_bytes)
-                name = f'unknown name{time.time()}.png'
-                file = InMemoryUploadedFile(
-                    name=name,
-                    field_name='file',
-                    content_type='image/png',
-                    size=temp_file.__sizeof__(),
-                    charset='utf-8',
-                    file=temp_file
-                )
-                data = {
-                    'project': await sync_to_async(lambda: parent_object.project)(),
-                    'name': name,
-                    'filename': name,
-                    'file_extension': 'image/png',
-                    'size': '123',
-                    'file': file,
-                    'user': self.service_user,
-                    'content_object': parent_object
-                }
-
-                attachment = await sync_to_async(Attachment.objects.create)(**data)
-                attachment_id = attachment.id
-            resulting_text = re.sub(self.replace_pattern, f'{self.testy_attachment_url}{attachment_id}',
-                                    resulting_text, count=1)
-
-        return True, resulting_text
+        return await self.url_rewriter.rewrite(
+            text_to_check,
+            attachments_mapping,
+            partial(self.create_inline_attachment, testrail_client, parent_object)
+        )
 
-    async def update_attachment_for_single_instance(self, model_class, instance_id, field_list, attachments_mapping,
-                                                    testrail_client, update_method):
-        logging.info(f'Updating attachment for {model_class}, with id {instance_id}')
-        data = {}
-        instance = await sync_to_async(model_class.objects.get)(pk=instance_id)
+    def add_prefetched_attachments(self, attachments, body_loader: Callable[[dict], Optional[bytes]]):
+        """
+        Add inline attachments downloaded with backup, they are used instead of fetching files from testrail.
+
+        Args:
+            attachments: dict of testrail attachment id to testrail attachment with file saved next to backup
+            body_loader: function that returns file saved with backup for testrail attachment or None, files that
+                were not saved are fetched from testrail
+        """
+        self.prefetched_body_loader = body_loader
+        for attachment_id, attachment in attachments.items():
+            self.prefetched_attachments[int(attachment_id)] = attachment
+
+    async def create_inline_attachment(self, testrail_client: TestRailClient, parent_object, src_attachment_id):
+        name = f'unknown name{time.time()}.png'
+        content_type = 'image/png'
+        charset = 'utf-8'
+        file_bytes = None
+        if prefetched := self.prefetched_attachments.get(src_attachment_id):
+            file_bytes = await sync_to_async(self.prefetched_body_loader, thread_sensitive=False)(prefetched)
+        if file_bytes is not None:
+            name = prefetched.get('name') or name
+            content_type = prefetched.get('content_type') or content_type
+            charset = prefetched.get('charset') or charset
+        else:
+            file_bytes = await testrail_client.get_single_attachment(src_attachment_id)
+        temp_file = io.BytesIO(file_bytes)
+        file = InMemoryUploadedFile(
+            name=name,
+            field_name='file',
+            content_type=content_type,
+            size=len(file_bytes),
+            charset=charset,
+            file=temp_file
+        )
+        data = {
+            'project': await sync_to_async(lambda: parent_object.project)(),
+            'name': os.path.splitext(name)[0],
+            'filename': name,
+            'file_extension': content_type,
+            'size': len(file_bytes),
+            'file': file,
+            'user': self.service_user,
+            'content_object': parent_object
+        }
+
+        attachment = await sync_to_async(Attachment.objects.create)(**data)
+        return attachment.id
+
+    async def update_attachment_urls_for_instance(self, instance, field_list, attachments_mapping,
+                                                  testrail_client) -> bool:
+        is_updated = False
         for field in field_list:
-            is_replaced, new_instance = await self.replace_testrail_attachment_url(
+            is_replaced, new_text = await self.replace_testrail_attachment_url(
                 getattr(instance, field),
                 attachments_mapping,
                 testrail_client,
@@ -144,24 +178,49 @@ class TestyCreator:
             )
             if not is_replaced:
                 continue
-            data[field] = new_instance
-        if not data:
-            return
-        await sync_to_async(update_method)(instance, data)
+            setattr(instance, field, new_text)
+            is_updated = True
+        return is_updated
 
     @async_to_sync
-    async def update_testy_attachment_urls_async(self, mapping, model_class, update_method, field_list, config_dict,
-                                                 attachment_mapping):
-        chunks = split_list_by_chunks(list(mapping.values()))
+    async def update_testy_attachment_urls_async(self, mapping, model_class, field_list, config_dict,
+                                                 attachment_mapping, batch_size: int = 500):
+        """
+        Replace testrail attachment urls in text fields of migrated instances.
+
+        Only instances that contain testrail attachment url in any of the fields are loaded, they are rewritten in
+        memory and saved with one query per batch.
+
+        Args:
+            mapping: mapping of testrail ids to ids of instances to check
+            model_class: model of instances
+            field_list: text fields that may contain attachment urls
+            config_dict: testrail config
+            attachment_mapping: mapping of testrail attachment ids to testy attachment ids
+            batch_size: number of instances loaded and saved at once
+        """
+        candidates_filter = Q()
+        for field in field_list:
+            candidates_filter |= Q(**{f'{field}__contains': self.attachment_url_marker})
         testrail_client = TestRailClient(TestrailConfig(**config_dict))
-        for chunk in tqdm(chunks, desc='Attachments progress'):
-            tasks = []
-            for instance_id in chunk:
-                tasks.append(
-                    self.update_attachment_for_single_instance(model_class, instance_id, field_list, attachment_mapping,
-                                                               testrail_client, update_method)
-                )
-            await tqdm.gather(*tasks, desc='attachments chunk progress', leave=False)
+        self.progress.start(len(mapping), 'instances')
+        for chunk in split_list_by_chunks(list(mapping.values()), batch_size):
+            instances = await sync_to_async(list)(
+                model_class.objects.filter(candidates_filter, pk__in=chunk).only('pk', *field_list)
+            )
+            self.progress.advance(len(chunk))
+            if not instances:
+                continue
+            is_updated_list = await asyncio.gather(
+                *[
+                    self.update_attachment_urls_for_instance(instance, field_list, attachment_mapping, testrail_client)
+                    for instance in instances
+                ]
+            )
+            updated_instances = [instance for instance, is_updated in zip(instances, is_updated_list) if is_updated]
+            logging.info(f'Updating attachment urls for {len(updated_instances)} instances of {model_class}')
+            with span('db.bulk_update', **{'db.model': model_class.__name__, 'db.items': len(updated_instances)}):
+                await sync_to_async(model_class.objects.bulk_update)(updated_instances, field_list)
 
     @staticmethod
     def create_suites(suites, project_id):
@@ -202,13 +261,14 @@ class TestyCreator:
         cases_data_list = []
         src_case_ids = []
         created_cases = []
+        self.progress.start(len(cases), 'cases')
         for case in cases:
             src_case_ids.append(case['id'])
             suite_id = section_mappings.get(case['section_id'], suite_mappings.get(case['suite_id']))
             case_data = {
                 'name': case['title'],
-                'project': Project.objects.get(pk=project_id),
-                'suite': TestSuite.objects.get(pk=suite_id),
+                'project': self.instance_cache.get(Project, project_id),
+                'suite': self.instance_cache.get(TestSuite, suite_id),
                 'created_at': case['created_on'],
                 'updated_at': case['updated_on'],
                 'is_steps': False
@@ -224,6 +284,7 @@ class TestyCreator:
                 else:
                     created_case = MigratorService().case_create(case_data)
                 created_cases.append(created_case)
+            self.progress.advance()
         return dict(zip(src_case_ids, [created_case.id for created_case in created_cases]))
 
     def parse_case_custom_fields(self, tr_case_dict: dict, custom_fields_matcher: dict):
@@ -242,11 +303,14 @@ class TestyCreator:
             case_data['scenario'] = 'Scenario was not provided'
         return case_data
 
-    def create_sections(self, sections, suite_mappings, project_id, drop_default_section: bool = True):
+    def create_sections(self, sections, suite_mappings, project_id, drop_default_section: bool = True,
+                        known_mappings: dict = None, rebuild_tree: bool = True):
         sections = sorted(sections, key=itemgetter('depth'))
-        project = Project.objects.get(pk=project_id)
-        sections_mappings = {}
-        for section in tqdm(sections, desc='Creating sections'):
+        project = self.instance_cache.get(Project, project_id)
+        sections_mappings = dict(known_mappings or {})
+        self.progress.start(len(sections), 'sections')
+        for section in sections:
+            self.progress.advance()
             if drop_default_section and section['name'] == self.default_root_section_name:
                 sections_mappings[section['id']] = suite_mappings[section['suite_id']]
                 continue
@@ -257,11 +321,14 @@ class TestyCreator:
             if description := section.get('description'):
                 section_data['description'] = description
             if section['parent_id']:
-                section_data['parent'] = TestSuite.objects.get(pk=sections_mappings.get(section['parent_id']))
+                section_data['parent'] = self.instance_cache.get(TestSuite, sections_mappings.get(section['parent_id']))
             else:
-                section_data['parent'] = TestSuite.objects.get(pk=suite_mappings.get(section['suite_id']))
-            sections_mappings[section['id']] = MigratorService.suite_create(section_data).id
-        TestSuite.objects.rebuild()
+                section_data['parent'] = self.instance_cache.get(TestSuite, suite_mappings.get(section['suite_id']))
+            created_section = MigratorService.suite_create(section_data)
+            self.instance_cache.add(created_section)
+            sections_mappings[section['id']] = created_section.id
+        if rebuild_tree:
+            TestSuite.objects.rebuild()
         return sections_mappings
 
     @staticmethod
@@ -279,19 +346,67 @@ class TestyCreator:
                 }
                 parameter_data_list.append(parameter_data)
 
-        created_parameters = []
-        for parameter_data in parameter_data_list:
-            parameter, _ = Parameter.objects.get_or_create(**parameter_data)
-            created_parameters.append(parameter)
+        created_parameters = MigratorService.parameters_bulk_get_or_create(parameter_data_list)
 
         for tr_config_id, testy_parameter in zip(src_config_ids, created_parameters):
             parameters_mappings.update({tr_config_id: testy_parameter.id})
 
         return parameters_mappings
 
+    def create_plan_tree(self, project_id, config_mappings, milestones=None, plans=None, runs_parent_plan=None,
+                         runs_parent_mile=None, upload_root_runs: bool = False, force_parent: bool = False,
+                         force_parent_id: int = None):
+        """
+        Create milestones, plans and runs as one forest of test plans.
+
+        Whole milestone -> plan -> run hierarchy is built in memory and inserted with precomputed tree fields, so
+        existing test plans trees are not rebuilt.
+
+        Args:
+            project_id: testy project id
+            config_mappings: testrail config id to testy parameter id mapping
+            milestones: testrail milestones with child milestones
+            plans: testrail plans
+            runs_parent_plan: testrail runs from plans entries
+            runs_parent_mile: testrail runs without plans
+            upload_root_runs: upload runs without parent as root test plans
+            force_parent: ignore milestones of plans and runs without plans and use force_parent_id as their parent
+            force_parent_id: id of existing testy test plan to be used as parent, root if not provided
+
+        Returns:
+            dict of mappings for milestones, plans, runs_parent_plan and runs_parent_mile
+        """
+        project = self.instance_cache.get(Project, project_id)
+        tree = TestPlanTreeBuilder()
+        src_milestone_ids = self._add_milestones(tree, milestones or [], project_id)
+        src_plan_ids = self._add_plans(tree, plans or [], project, force_parent, force_parent_id)
+        src_runs_parent_plan_ids = self._add_runs(
+            tree, runs_parent_plan or [], ParentType.PLAN, config_mappings, project, upload_root_runs
+        )
+        src_runs_parent_mile_ids = self._add_runs(
+            tree,
+            runs_parent_mile or [],
+            ParentType.FORCE_PARENT if force_parent else ParentType.MILESTONE,
+            config_mappings,
+            project,
+            upload_root_runs,
+            force_parent_id
+        )
+        created_plans = tree.save()
+
+        mappings = {}
+        for mapping_key, node_type, src_ids in [
+            ('milestones', 'milestone', src_milestone_ids),
+            ('plans', 'plan', src_plan_ids),
+            ('runs_parent_plan', 'run', src_runs_parent_plan_ids),
+            ('runs_parent_mile', 'run', src_runs_parent_mile_ids),
+        ]:
+            mappings[mapping_key] = {src_id: created_plans[(node_type, src_id)].id for src_id in src_ids}
+        return mappings
+
     @staticmethod
-    def create_milestones(milestones, project_id):
-        milestones_mapping = {}
+    def _add_milestones(tree: TestPlanTreeBuilder, milestones, project_id):
+        src_ids = []
         parent_milestones = []
         for milestone in milestones:
             milestone_data = {
@@ -309,9 +424,9 @@ class TestyCreator:
 
         serializer = TestPlanInputSerializer(data=parent_milestones, many=True)
         serializer.is_valid(raise_exception=True)
-        test_plans = MigratorService().testplan_bulk_create(serializer.validated_data)
-        for tr_milestone, testy_milestone in zip(milestones, test_plans):
-            milestones_mapping.update({tr_milestone['id']: testy_milestone.id})
+        for milestone, milestone_data in zip(milestones, serializer.validated_data):
+            tree.add(('milestone', milestone['id']), milestone_data)
+            src_ids.append(milestone['id'])
 
         for milestone in milestones:
             if not milestone['milestones']:
@@ -324,7 +439,6 @@ class TestyCreator:
                     'is_archive': child_milestone['is_completed'],
                     'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(milestone['started_on'])),
                     'due_date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(child_milestone['due_on'])),
-                    'parent': milestones_mapping[milestone['id']]
                 }
                 if completed_on := child_milestone['completed_on']:
                     milestone_data['finished_at'] = datetime.fromtimestamp(completed_on, tz=pytz.UTC)
@@ -332,26 +446,25 @@ class TestyCreator:
 
             serializer = TestPlanInputSerializer(data=child_milestones_data_list, many=True)
             serializer.is_valid(raise_exception=True)
-            test_plans = MigratorService().testplan_bulk_create(serializer.validated_data)
-
-            for tr_milestone, testy_milestone in zip(milestone['milestones'], test_plans):
-                milestones_mapping.update({tr_milestone['id']: testy_milestone.id})
-
-        return milestones_mapping
+            for child_milestone, milestone_data in zip(milestone['milestones'], serializer.validated_data):
+                tree.add(
+                    ('milestone', child_milestone['id']),
+                    milestone_data,
+                    parent_key=('milestone', milestone['id'])
+                )
+                src_ids.append(child_milestone['id'])
+        return src_ids
 
     @staticmethod
-    def create_plans(plans, milestones_mappings, project_id, skip_root_plans: bool = True, force_parent: bool = False,
-                     force_parent_id: int = None):
-        plan_data_list = []
-        plan_mappings = {}
-        src_plan_ids = []
+    def _add_plans(tree: TestPlanTreeBuilder, plans, project, force_parent: bool = False, force_parent_id: int = None):
+        src_ids = []
         for plan in plans:
             mapping_id = plan['milestone_id']
-            if not mapping_id and skip_root_plans:
+            if not mapping_id and not force_parent:
                 continue
             due_date = (datetime.now() + relativedelta(years=5, days=5)).strftime('%Y-%m-%d %H:%M:%S')
             plan_data = {
-                'project': Project.objects.get(pk=project_id),
+                'project': project,
                 'name': plan['name'],
                 'is_archive': plan['is_completed'],
                 'created_at': datetime.fromtimestamp(plan['created_on'], tz=pytz.UTC),
@@ -365,57 +478,35 @@ class TestyCreator:
                 plan_data['finished_at'] = datetime.fromtimestamp(completed_on, tz=pytz.UTC)
 
             if force_parent:
-                plan_data['parent'] = TestPlan.objects.get(pk=force_parent_id) if force_parent_id else None
-
-            if mapping_id and not force_parent:
-                parent_id = milestones_mappings.get(mapping_id)
-                if not parent_id:
-                    continue
-                plan_data['parent'] = TestPlan.objects.get(pk=parent_id)
-            src_plan_ids.append(plan['id'])
-            plan_data_list.append(plan_data)
-
-        with suppress_auto_now(TestCase, ['created_at', 'updated_at']):
-            test_plans = MigratorService().testplan_bulk_create(plan_data_list)
-        for src_plan_id, testy_milestone in zip(src_plan_ids, test_plans):
-            plan_mappings.update({src_plan_id: testy_milestone.id})
-
-        return plan_mappings
+                tree.add(('plan', plan['id']), plan_data, parent_id=force_parent_id)
+            elif ('milestone', mapping_id) in tree:
+                tree.add(('plan', plan['id']), plan_data, parent_key=('milestone', mapping_id))
+            else:
+                continue
+            src_ids.append(plan['id'])
+        return src_ids
 
     @staticmethod
-    def create_runs(runs, mapping, config_mappings, tests, case_mappings, project_id,
-                    parent_type: ParentType, upload_root_runs: bool, user_mappings, force_parent_id: int = None):
-        run_data_list = []
-        src_tests = []
-        src_run_ids = []
-        if parent_type == ParentType.PLAN:
-            parent_id_key = 'plan_id'
-        elif parent_type == ParentType.MILESTONE:
-            parent_id_key = 'milestone_id'
-
-        for idx, run in enumerate(runs, start=1):
-            logging.info(f'{idx} of {len(runs)}')
-            parent = force_parent_id if parent_type == ParentType.FORCE_PARENT else mapping.get(run[parent_id_key])
-            if not parent and not upload_root_runs:
+    def _add_runs(tree: TestPlanTreeBuilder, runs, parent_type: ParentType, config_mappings, project,
+                  upload_root_runs: bool, force_parent_id: int = None):
+        src_ids = []
+        for run in runs:
+            parent_key = None
+            if parent_type == ParentType.PLAN:
+                parent_key = ('plan', run['plan_id'])
+            elif parent_type == ParentType.MILESTONE:
+                parent_key = ('milestone', run['milestone_id'])
+            parent_key = parent_key if parent_key in tree else None
+            parent_id = force_parent_id if parent_type == ParentType.FORCE_PARENT else None
+            if not parent_key and not parent_id and not upload_root_runs:
                 continue
-            src_run_ids.append(run['id'])
-            tests_for_run = []
-            for test in tests:
-                if test['run_id'] == run['id'] and case_mappings.get(test['case_id']):
-                    tests_for_run.append(test)
-            src_tests.extend(tests_for_run)
-            case_ids = [case_mappings[test['case_id']] for test in tests_for_run]
-            cases = TestCase.objects.filter(id__in=case_ids)
-            parameters = [config_mappings[config_id] for config_id in run['config_ids']]
             due_date = (datetime.now() + relativedelta(years=5, days=5)).strftime('%Y-%m-%d %H:%M:%S')
             run_data = {
-                'project': Project.objects.get(pk=project_id),
+                'project': project,
                 'name': run['name'],
                 'started_at': datetime.fromtimestamp(run['created_on'], tz=pytz.UTC),
                 'due_date': due_date,
-                'test_cases': cases,
-                'parameters': parameters,
-                'created_at': run['created_on']
+                'created_at': datetime.fromtimestamp(run['created_on'], tz=pytz.UTC),
             }
             if description := run.get('description'):
                 run_data['description'] = description
@@ -423,51 +514,47 @@ class TestyCreator:
                 run_data['finished_at'] = datetime.fromtimestamp(finished_at, tz=pytz.UTC)
             if updated_at := run.get('updated_on'):
                 run_data['updated_at'] = datetime.fromtimestamp(updated_at, tz=pytz.UTC)
-            if parent:
-                run_data['parent'] = TestPlan.objects.get(pk=parent)
-            run_data_list.append(run_data)
-        created_tests, created_plans = MigratorService().testplan_bulk_create_with_tests(run_data_list)
-
-        # Add assignation for tests
-        for src_test, created_test in zip(src_tests, created_tests):
-            if src_test['assignedto_id']:
-                user_id = user_mappings.get(src_test['assignedto_id'])
-                TestService().test_update(created_test, {'assignee': UserModel.objects.get(pk=user_id)})
-
-        return dict(zip(
-            [src_test['id'] for src_test in src_tests],
-            [created_test.id for created_test in created_tests])
-        ), dict(zip(
-            src_run_ids,
-            [created_plan.id for created_plan in created_plans])
+            tree.add(
+                ('run', run['id']),
+                run_data,
+                parent_key=parent_key,
+                parent_id=parent_id,
+                parameters=[config_mappings[config_id] for config_id in run['config_ids']]
+            )
+            src_ids.append(run['id'])
+        return src_ids
+
+    def create_tests_for_runs(self, tests, run_mappings, case_mappings, project_id, user_mappings):
+        project = self.instance_cache.get(Project, project_id)
+        src_tests = [
+            test for test in tests
+            if run_mappings.get(test['run_id']) and case_mappings.get(test['case_id'])
+        ]
+        cases = TestCase.objects.in_bulk([case_mappings[test['case_id']] for test in src_tests])
+        runs = TestPlan.objects.in_bulk({run_mappings[test['run_id']] for test in src_tests})
+        users = UserModel.objects.in_bulk(
+            {user_mappings[test['assignedto_id']] for test in src_tests if user_mappings.get(test['assignedto_id'])}
         )
-
-    @staticmethod
-    def create_tests(tests, case_mappings, plans_mappings, project_id):
         test_data_list = []
-        tests_mappings = {}
-        src_ids = []
-        for test in tests:
-            if not case_mappings.get(test['case_id']) or not plans_mappings.get(test['run_id']):
-                continue
-            src_ids.append(test['id'])
+        for test in src_tests:
             test_data = {
-                'project': project_id,
-                'case': case_mappings[test['case_id']],
-                'plan': plans_mappings[test['run_id']]
+                'project': project,
+                'case': cases[case_mappings[test['case_id']]],
+                'plan': runs[run_mappings[test['run_id']]],
             }
+            if user_id := user_mappings.get(test['assignedto_id']):
+                test_data['assignee'] = users[user_id]
             test_data_list.append(test_data)
-        serializer = TestSerializer(data=test_data_list, many=True)
-        serializer.is_valid(raise_exception=True)
-        created_tests = MigratorService.tests_bulk_create_by_data_list(serializer.validated_data)
-        for src_id, testy_test in zip(src_ids, created_tests):
-            tests_mappings.update({src_id: testy_test.id})
+        created_tests = MigratorService.tests_bulk_create_by_data_list(test_data_list)
 
-        return tests_mappings
+        return dict(zip(
+            [src_test['id'] for src_test in src_tests],
+            [created_test.id for created_test in created_tests])
+        )
 
     def get_step_results(self, test: Test, custom_steps_results):
         parsed_steps = []
-        steps = TestCaseStep.objects.filter(test_case=test.case)
+        steps = TestCaseStep.objects.filter(test_case_id=test.case_id)
         for step, testy_step in zip(custom_steps_results, steps):
             parsed_steps.append(
                 {
@@ -479,10 +566,12 @@ class TestyCreator:
 
     def create_results(self, results, custom_fields_multi_select, custom_fields_labels, tests_mappings, user_mappings):
         created_results = []
+        created_on = []
         src_ids = []
         results = sorted(results, key=itemgetter('created_on'))
-        for idx, result in enumerate(results):
-            logging.info(f'Processing result {idx} of {len(results)}')
+        self.progress.start(len(results), 'results')
+        for result in results:
+            self.progress.advance()
             if not tests_mappings.get(result['test_id']):
                 continue
             # Drop all results that serve as assignation message or comment messages
@@ -505,7 +594,7 @@ class TestyCreator:
                 json_fields[custom_fields_labels[result_field_name]] = result_field_value
             result_data = {
                 'status': self.statuses_mapping.get(result['status_id'], 5),
-                'test': Test.objects.get(pk=tests_mappings[result['test_id']]),
+                'test': self.instance_cache.get(Test, tests_mappings[result['test_id']]),
                 'created_at': timezone.make_aware(datetime.fromtimestamp(result['created_on'])),
                 'updated_at': timezone.make_aware(datetime.fromtimestamp(result['created_on'])),
                 'attributes': json_fields
@@ -525,9 +614,15 @@ class TestyCreator:
                     result_data['comment'] = f'Defects: {defects}'
 
             user_id = user_mappings.get(result['created_by'])
-            user = UserModel.objects.get(pk=user_id) if user_id else self.service_user
-            with suppress_auto_now(TestResult, ['created_at', 'updated_at']):
-                created_results.append(MigratorService.result_create(result_data, user))
+            user = self.instance_cache.get(UserModel, user_id) if user_id else self.service_user
+            created_results.append(MigratorService.result_create(result_data, user, self.instance_cache))
+            created_on.append(result_data['created_at'])
+        # Partitions of results are created by parallel threads, so auto_now of shared model fields is not switched
+        # off around creation, timestamps of testrail are restored afterwards
+        for created_result, created_at in zip(created_results, created_on):
+            created_result.created_at = created_at
+            created_result.updated_at = created_at
+        TestResult.objects.bulk_update(created_results, ['created_at', 'updated_at'], batch_size=1000)
         res_ids = [created_result.id for created_result in created_results]
         return dict(zip(src_ids, res_ids))
 
@@ -537,6 +632,9 @@ class TestyCreator:
             'file',
             'url'
         ]
+        content_objects = self.attachment_content_models[instance_type].objects.in_bulk(
+            {mapping[data[parent_key]] for data in data_dict.values() if mapping.get(data[parent_key])}
+        )
         attachment_instances = []
         for data in data_dict.values():
             file = InMemoryUploadedFile(
@@ -556,30 +654,116 @@ class TestyCreator:
                 'file_extension': file.content_type,
                 'size': file.size,
                 'file': file,
-                'user': UserModel.objects.get(pk=user_id) if user_id else self.service_user
+                'user': self.instance_cache.get(UserModel, user_id) if user_id else self.service_user
             }
             attachment = Attachment.model_create(fields=non_side_effect_fields, data=temp, commit=False)
-            content_object = None
-            pk = mapping.get(data[parent_key])
-            if instance_type == InstanceType.CASE and pk:
-                content_object = TestCase.objects.get(pk=pk)
-            elif (instance_type == InstanceType.RUN or instance_type == InstanceType.PLAN) and pk:
-                content_object = TestPlan.objects.get(pk=pk)
-            elif instance_type == InstanceType.TEST and pk:
-                content_object = TestResult.objects.get(pk=pk)
-            if content_object:
+            if content_object := content_objects.get(mapping.get(data[parent_key])):
                 attachment.content_object = content_object
-            attachment.save()
             attachment_instances.append(attachment)
+        created_attachments = MigratorService.attachments_bulk_create(attachment_instances)
 
         return dict(zip(
             [data for data in data_dict],
-            [created_attachment.id for created_attachment in attachment_instances])
+            [created_attachment.id for created_attachment in created_attachments])
         )
 
+    @async_to_sync
+    async def attachments_pipeline_create(self, attachments, testrail_client: TestRailClient, project, user_mappings,
+                                          parent_key, mapping, instance_type, max_in_flight_bytes: int = 64 * 2 ** 20,
+                                          batch_size: int = 100, concurrency: int = 40,
+                                          body_loader: Callable[[dict], Optional[bytes]] = None,
+                                          unknown_size: int = 2 ** 20):
+        """
+        Fetch attachment files from testrail and create testy attachments at the same time.
+
+        Files are saved in batches as soon as they are fetched, bytes that are fetched or being fetched but not saved
+        yet never exceed max_in_flight_bytes, except for files larger than reserved for attachments without size.
+
+        Args:
+            attachments: list of testrail attachments
+            testrail_client: instance of TestRailClient
+            project: testy project
+            user_mappings: mapping of testrail users to testy users
+            parent_key: key of testrail attachment with id of its parent
+            mapping: mapping of testrail parents to testy content objects
+            instance_type: type of attachment parent
+            max_in_flight_bytes: max size of files held in memory
+            batch_size: max number of attachments saved in one batch
+            concurrency: max number of files fetched at the same time
+            body_loader: function that returns file saved with backup for testrail attachment or None, files that
+                were not saved are fetched from testrail
+            unknown_size: bytes reserved for attachment without size, e.g. made from result, reservation is
+                corrected to actual size of file when it is fetched
+
+        Returns:
+            dict of testrail attachment id to testy attachment id
+        """
+        budget = ByteBudget(max_in_flight_bytes)
+        semaphore = asyncio.Semaphore(concurrency)
+        fetched_queue = asyncio.Queue()
+        store = sync_to_async(self.attachment_bulk_create)
+        load_body = sync_to_async(body_loader, thread_sensitive=False) if body_loader else None
+        attachments_mapping = {}
+        self.progress.start(len(attachments), 'attachments')
+
+        async def fetch(attachment, reserved):
+            async with semaphore:
+                file_bytes = await load_body(attachment) if body_loader else None
+                if file_bytes is not None:
+                    fetched = testrail_client.make_attachment_data(
+                        attachment, parent_key, attachment.get('content_type'), attachment.get('charset'), file_bytes
+                    )
+                else:
+                    fetched = await testrail_client.get_attachment(attachment, parent_key)
+            size = sum(len(data['file_bytes']) for data in fetched.values()) if fetched else 0
+            await budget.adjust(reserved, size)
+            await fetched_queue.put((size, fetched))
+
+        async def produce():
+            fetch_tasks = []
+            for attachment in attachments:
+                reserved = attachment.get('size') or unknown_size
+                await budget.acquire(reserved)
+                fetch_tasks.append(asyncio.ensure_future(fetch(attachment, reserved)))
+            await asyncio.gather(*fetch_tasks)
+            await fetched_queue.put(None)
+
+        async def consume():
+            finished = False
+            while not finished:
+                # Everything fetched so far is saved at once, so batches grow only while saving is the bottleneck
+                batch, batch_bytes, batch_items = {}, 0, 0
+                item = await fetched_queue.get()
+                while True:
+                    if item is None:
+                        finished = True
+                        break
+                    size, fetched = item
+                    batch_bytes += size
+                    batch_items += 1
+                    if fetched:
+                        batch.update(fetched)
+                    if len(batch) >= batch_size or fetched_queue.empty():
+                        break
+                    item = fetched_queue.get_nowait()
+                if batch:
+                    attachments_mapping.update(
+                        await store(batch, project, user_mappings, parent_key, mapping, instance_type)
+                    )
+                await budget.release(batch_bytes)
+                self.progress.advance(batch_items)
+
+        tasks = [asyncio.ensure_future(produce()), asyncio.ensure_future(consume())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return attachments_mapping
+
     @staticmethod
     def create_users(users):
-        dst_ids = []
+        user_data_list = []
         src_ids = []
         for user in users:
             src_ids.append(user['id'])
@@ -597,6 +781,6 @@ class TestyCreator:
                 user_data['first_name'] = first_name
             if last_name:
                 user_data['last_name'] = last_name
-            created_user = MigratorService.user_create(user_data)
-            dst_ids.append(created_user.id)
-        return dict(zip(src_ids, dst_ids))
+            user_data_list.append(user_data)
+        created_users = MigratorService.users_bulk_get_or_create(user_data_list)
+        return dict(zip(src_ids, [created_user.id for created_user in created_users]))
@@ -0,0 +1,215 @@
+# TestY TMS - Test Management System
+# Copyright (C) 2023 KNS Group LLC (YADRO)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Also add information on how to contact you by electronic and paper mail.
+#
+# If your software can interact with users remotely through a computer
+# network, you should also make sure that it provides a way for users to
+# get its source.  For example, if your program is a web application, its
+# interface could display a "Source" link that leads users to an archive
+# of the code.  There are many ways you could offer source, and different
+# solutions will be better for different programs; see section 13 for the
+# specific requirements.
+#
+# You should also get your employer (if you work as a programmer) or school,
+# if any, to sign a "copyright disclaimer" for the program, if necessary.
+# For more information on this, and how to apply and follow the GNU AGPL, see
+# <http://www.gnu.org/licenses/>.
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+import redis
+from django.conf import settings
+from testrail_migrator.migrator_lib.utils import add_task_option
+
+TRACE_TTL = 60 * 60 * 24 * 7
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('trace_span', default=None)
+_current_tracer: ContextVar[Optional['Tracer']] = ContextVar('tracer', default=None)
+
+
+def trace_key(task_id) -> str:
+    return f'trace:{task_id}'
+
+
+def otlp_value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    def __init__(self, trace_id: str, name: str, parent: Optional['Span'], kind: int, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.status = STATUS_OK
+        self.status_message = ''
+        self.start = time.time_ns()
+        self.end = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def as_otlp(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end or time.time_ns()),
+            'attributes': [
+                {'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items() if value is not None
+            ],
+            'status': {'code': self.status, 'message': self.status_message},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class Tracer:
+    """
+    Collector of spans of one task exported as OpenTelemetry trace in OTLP JSON format.
+
+    Tracer and parent of new span are taken from context of caller, context is copied into coroutines gathered by
+    testrail client and into threads of phase graph, so requests and inserts become children of phase that made them.
+    Spans started in threads that do not copy context are not recorded. Spans above max_spans are dropped and only
+    counted.
+    """
+
+    def __init__(self, resource: Dict[str, Any] = None, max_spans: int = 200000):
+        self.trace_id = secrets.token_hex(16)
+        self.resource = {'service.name': 'testrail_migrator', **(resource or {})}
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                span = None
+            else:
+                span = Span(self.trace_id, name, _current_span.get(), kind, attributes)
+                self.spans.append(span)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.status = STATUS_ERROR
+            span.status_message = repr(err)
+            raise
+        finally:
+            span.end = time.time_ns()
+            _current_span.reset(token)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        resource = {**self.resource, 'testrail_migrator.dropped_spans': self.dropped}
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in resource.items()],
+                },
+                'scopeSpans': [{
+                    'scope': {'name': 'testrail_migrator'},
+                    'spans': [span.as_otlp() for span in self.spans],
+                }],
+            }],
+        }
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """
+    Record span in trace of running task, does nothing when task is not traced.
+
+    Args:
+        name: name of span
+        kind: OTLP span kind
+        attributes: attributes of span, None values are skipped
+
+    Yields:
+        span or None when task is not traced, attributes can be added to span inside block
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(name, kind, **attributes) as current:
+        yield current
+
+
+def traced_bulk(func):
+    """Record span of bulk database operation with number of items passed in its first argument."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        items = args[0] if args else None
+        with span(f'db.{func.__name__}', **{'db.items': len(items) if hasattr(items, '__len__') else None}):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def tracing(task):
+    """
+    Trace block as root span of task and save trace to redis.
+
+    Args:
+        task: bound task, trace is saved under its id
+
+    Yields:
+        dict filled with trace summary when block is left
+    """
+    summary = {}
+    tracer = Tracer({'celery.task_id': task.request.id, 'celery.task_name': task.name})
+    token = _current_tracer.set(tracer)
+    try:
+        with tracer.span(task.name):
+            yield summary
+    finally:
+        _current_tracer.reset(token)
+        redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT).set(
+            trace_key(task.request.id), json.dumps(tracer.to_otlp()), ex=TRACE_TTL
+        )
+        summary.update({'trace_id': tracer.trace_id, 'spans': len(tracer.spans), 'dropped_spans': tracer.dropped})
+
+
+# Adds trace option to bound task, summary of trace is added to task result under trace key
+with_tracing = add_task_option('trace', tracing, 'trace')
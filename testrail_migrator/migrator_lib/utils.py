@@ -28,10 +28,15 @@
 # if any, to sign a "copyright disclaimer" for the program, if necessary.
 # For more information on this, and how to apply and follow the GNU AGPL, see
 # <http://www.gnu.org/licenses/>.
+import asyncio
+import inspect
 import json
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Any
+from functools import wraps
+from typing import Any, Callable, ContextManager, Dict
+
+CHUNK_SIZE = 40
 
 
 def back_up(dict_to_backup, path, name):
@@ -46,7 +51,7 @@ def timer(function_name: str):
     print(f'{function_name} took: ', datetime.now() - start_time)
 
 
-def split_list_by_chunks(src_list: list, chunk_size: int = 40):
+def split_list_by_chunks(src_list: list, chunk_size: int = CHUNK_SIZE):
     return [src_list[x:x + chunk_size] for x in range(0, len(src_list), chunk_size)]
 
 
@@ -82,3 +87,64 @@ def suppress_auto_now(model, field_names):
         for field, state in fields_state.items():
             field.auto_now = state['auto_now']
             field.auto_now_add = state['auto_now_add']
+
+
+class ByteBudget:
+    """Limit number of bytes held by concurrent coroutines, single item larger than limit is let through alone."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self.in_flight or self.in_flight + size <= self.limit)
+            self.in_flight += size
+
+    async def release(self, size: int):
+        async with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+    async def adjust(self, reserved: int, size: int):
+        """Replace bytes reserved for item with its actual size, limit may be exceeded until item is released."""
+        async with self._condition:
+            self.in_flight += size - reserved
+            self._condition.notify_all()
+
+
+def add_task_option(name: str, context_factory: Callable[[Any], ContextManager[Dict[str, Any]]], result_key: str):
+    """
+    Make decorator adding keyword-only boolean option to bound task, task runs inside context when option is true.
+
+    Dict yielded by context is added to task result under result_key. Signature of task is kept with new option, so
+    celery still checks arguments of task calls.
+
+    Args:
+        name: name of option
+        context_factory: function that takes task and returns context manager yielding summary dict
+        result_key: key of summary in task result
+
+    Returns:
+        task decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(task, *args, **kwargs):
+            if not kwargs.pop(name, False):
+                return func(task, *args, **kwargs)
+            with context_factory(task) as summary:
+                result = func(task, *args, **kwargs)
+            return {**(result or {}), result_key: summary}
+
+        signature = inspect.signature(func)
+        parameters = list(signature.parameters.values())
+        option = inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=False, annotation=bool)
+        if parameters and parameters[-1].kind == inspect.Parameter.VAR_KEYWORD:
+            parameters.insert(-1, option)
+        else:
+            parameters.append(option)
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+    return decorator
@@ -58,3 +58,106 @@ class TestrailBackup(models.Model):
 
     def __str__(self) -> str:
         return self.name
+
+
+class UploadCheckpoint(models.Model):
+    task_name = models.CharField(max_length=255)
+    backup_name = models.CharField(max_length=255)
+    testy_project_id = models.IntegerField(null=True, blank=True)
+    testy_plan_id = models.IntegerField(null=True, blank=True)
+    is_finished = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.task_name} {self.backup_name}'
+
+
+class UploadCheckpointBatch(models.Model):
+    checkpoint = models.ForeignKey(UploadCheckpoint, on_delete=models.CASCADE, related_name='batches')
+    phase = models.CharField(max_length=255)
+    offset = models.IntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    is_phase_finished = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['checkpoint', 'phase'], name='upload_checkpoint_phase_idx'),
+        ]
+
+
+class TestrailIdMapping(models.Model):
+    class EntityType(models.TextChoices):
+        USER = 'user'
+        CONFIG = 'config'
+        SUITE = 'suite'
+        SECTION = 'section'
+        CASE = 'case'
+        MILESTONE = 'milestone'
+        PLAN = 'plan'
+        RUN = 'run'
+        TEST = 'test'
+        RESULT = 'result'
+        ATTACHMENT = 'attachment'
+
+    source = models.CharField(max_length=255)
+    entity_type = models.CharField(max_length=31, choices=EntityType.choices)
+    testrail_id = models.BigIntegerField()
+    testy_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source', 'entity_type', 'testrail_id'],
+                name='unique_testrail_id_mapping',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['entity_type', 'testy_id'], name='testrail_id_mapping_testy_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.source} {self.entity_type} {self.testrail_id} -> {self.testy_id}'
+
+
+class MigrationRun(models.Model):
+    task_id = models.CharField(max_length=255, db_index=True)
+    task_name = models.CharField(max_length=255)
+    backup = models.ForeignKey(
+        TestrailBackup,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='migration_runs'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.task_name} {self.task_id}'
+
+
+class MigrationRunPhase(models.Model):
+    run = models.ForeignKey(MigrationRun, on_delete=models.CASCADE, related_name='phases')
+    name = models.CharField(max_length=255)
+    started_at = models.DateTimeField()
+    wall_time = models.FloatField()
+    cpu_time = models.FloatField()
+    items = models.IntegerField(null=True, blank=True)
+    throughput = models.FloatField(null=True, blank=True)
+    query_count = models.IntegerField(null=True, blank=True)
+    db_time = models.FloatField(null=True, blank=True)
+    duplicate_queries = models.IntegerField(null=True, blank=True)
+    top_queries = models.JSONField(null=True, blank=True)
+    rss_start_mb = models.FloatField(null=True, blank=True)
+    rss_end_mb = models.FloatField(null=True, blank=True)
+    peak_rss_mb = models.FloatField(null=True, blank=True)
+    traced_peak_mb = models.FloatField(null=True, blank=True)
+    retained_mb = models.FloatField(null=True, blank=True)
+    top_allocations = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['started_at', 'id']
+
+    def __str__(self) -> str:
+        return f'{self.run} {self.name}'
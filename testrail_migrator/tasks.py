@@ -32,245 +32,386 @@ import json
 import logging
 from copy import deepcopy
 from datetime import datetime
+from functools import lru_cache, partial
+from operator import itemgetter
 from typing import Dict
 
 import redis
 from asgiref.sync import async_to_sync
-from celery import shared_task
+from celery import chord, group, shared_task
 from core.models import Project
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.db import transaction
 from testrail_migrator.migrator_lib import TestRailClient, TestrailConfig, TestyCreator
+from testrail_migrator.migrator_lib.checkpoints import UploadCheckpointer
+from testrail_migrator.migrator_lib.cpu_profile import with_cpu_profiling
+from testrail_migrator.migrator_lib.estimate import DownloadEstimator
+from testrail_migrator.migrator_lib.http_metrics import HttpMetrics
+from testrail_migrator.migrator_lib.id_mappings import EntityType, IdMappingStore
 from testrail_migrator.migrator_lib.migrator_service import MigratorService
+from testrail_migrator.migrator_lib.phase_graph import PhaseGraph
+from testrail_migrator.migrator_lib.run_recorder import MigrationRunRecorder, record_phase
+from testrail_migrator.migrator_lib.streaming import StreamingMigrator
 from testrail_migrator.migrator_lib.testrail import InstanceType
-from testrail_migrator.migrator_lib.testy import ParentType
-from testrail_migrator.models import TestrailBackup
-from tests_description.models import TestCase, TestCaseStep
+from testrail_migrator.migrator_lib.tracing import with_tracing
+from testrail_migrator.migrator_lib.utils import split_list_by_chunks
+from testrail_migrator.models import MigrationRun, TestrailBackup
+from tests_description.models import TestCase, TestCaseStep, TestSuite
 from tests_representation.models import TestResult
-from tests_representation.services.results import TestResultService
 
-from utils import ProgressRecorderContext
+
+UserModel = get_user_model()
+
+DOWNLOAD_PART_TTL = 7 * 24 * 60 * 60
+ATTACHMENT_BODY_TTL = 7 * 24 * 60 * 60
+INLINE_ATTACHMENT_KEYS = ['cases', 'results_parent_plan', 'results_parent_mile']
 
 
 def get_fake_mapping_for_steps(case_mappings):
-    ids = TestCaseStep.objects.filter(test_case__in=case_mappings.values()).values_list('id', flat=True)
+    ids = TestCaseStep.objects.filter(
+        test_case__in=case_mappings.values()
+    ).order_by('id').values_list('id', flat=True)
     return dict(zip(ids, ids))
 
 
+def finish_upload(checkpointer: UploadCheckpointer, id_store: IdMappingStore, mappings):
+    checkpointer.run_phase('id_mappings', id_store.save_mappings, mappings)
+    checkpointer.finish()
+
+
+def split_results_by_runs(results, tests, partitions_count: int):
+    test_run_ids = {test['id']: test['run_id'] for test in tests}
+    partitions = [[] for _ in range(partitions_count)]
+    for result in results:
+        run_id = test_run_ids.get(result['test_id'], 0)
+        partitions[run_id % partitions_count].append(result)
+    return partitions
+
+
+def upload_attachments(attachments, creator: TestyCreator, testrail_client: TestRailClient, project, user_mappings,
+                       parent_key, mapping, instance_type: InstanceType):
+    return creator.attachments_pipeline_create(
+        attachments, testrail_client, project, user_mappings, parent_key, mapping, instance_type,
+        body_loader=load_attachment_body
+    )
+
+
+def update_attachment_urls(mapping_items, creator: TestyCreator, model_class, field_list, config_dict,
+                           attachments_mapping):
+    creator.update_testy_attachment_urls_async(
+        dict(mapping_items),
+        model_class,
+        field_list,
+        config_dict,
+        attachments_mapping
+    )
+
+
 @shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
 def upload_task(self, backup_name, config_dict, upload_root_runs: bool, service_user_login='admin',
-                testy_attachment_url: str = None, testy_project_id=None):
-    progress_recorder = ProgressRecorderContext(self, total=22, description='Upload started')
-    with transaction.atomic():
+                testy_attachment_url: str = None, testy_project_id=None, resumable: bool = False,
+                parallel_workers: int = 1, count_queries: bool = False, query_budgets: Dict[str, int] = None,
+                profile_memory: bool = False):
+    if parallel_workers > 1 and not resumable:
+        # Phases running in parallel use separate database connections, so they have to be committed one by one
+        raise ValueError('Upload with several parallel workers has to be resumable')
+    progress_recorder = MigrationRunRecorder(self, total=22, description='Upload started', backup_name=backup_name,
+                                             count_queries=count_queries, query_budgets=query_budgets,
+                                             profile_memory=profile_memory)
+    # Items progress is kept for one phase at a time, so it is not reported while phases run in parallel
+    items_progress = progress_recorder.items if parallel_workers <= 1 else None
+    creator = TestyCreator(service_user_login, testy_attachment_url, progress=items_progress)
+    progress_recorder.instance_cache = creator.instance_cache
+    id_store = IdMappingStore(config_dict['api_url'])
+    checkpointer = UploadCheckpointer.for_task(resumable, self.name, backup_name, testy_project_id,
+                                               progress=items_progress)
+    with checkpointer.task_transaction(), creator.instance_cache.log_stats_on_exit(self.name):
         logging.info('redis about to start')
         redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
         logging.info('redis started')
-        backup = json.loads(redis_client.get(backup_name))
+        with progress_recorder.measure('Loading backup'):
+            backup = json.loads(redis_client.get(backup_name))
+        creator.add_prefetched_attachments(backup.get('inline_attachments', {}), load_attachment_body)
 
         custom_fields_multi_select = parse_multi_select_from_tr(backup['custom_result_fields'])
         custom_fields_labels = parse_labels_from_tr_fields(backup['custom_result_fields'])
 
-        creator = TestyCreator(service_user_login, testy_attachment_url)
-
         mappings = {}
         if testy_project_id:
-            project = Project.objects.get(pk=testy_project_id)
+            project = creator.instance_cache.get(Project, testy_project_id)
         else:
             with progress_recorder.progress_context('Creating projects'):
-                project = MigratorService.create_project(backup['project'])
-
-        with progress_recorder.progress_context('Creating users'):
-            mappings['users'] = creator.create_users(backup['users'])
-
-        keys_without_mappings = ['suites', 'configs', 'milestones']
-        for key in keys_without_mappings:
-            with progress_recorder.progress_context(f'Creating {key}'):
-                create_method = getattr(creator, f'create_{key}')
-                mappings[key] = create_method(backup[key], project.id)
+                project_id = checkpointer.run_phase(
+                    'project',
+                    lambda: MigratorService.create_project(backup['project']).id
+                )
+                project = creator.instance_cache.get(Project, project_id)
 
-        keys_with_single_mapping = [('sections', 'suites'), ('plans', 'milestones')]
-        for key, mapping_key in keys_with_single_mapping:
-            with progress_recorder.progress_context(f'Creating {key}'):
-                create_method = getattr(creator, f'create_{key}')
-                mappings[key] = create_method(backup[key], mappings[mapping_key], project.id)
+        graph = PhaseGraph(parallel_workers)
 
-        with progress_recorder.progress_context('Creating cases'):
-            mappings['cases'] = creator.create_cases(backup['cases'], mappings['suites'], mappings['sections'],
-                                                     project.id, config_dict['custom_fields_matcher'])
-
-        with progress_recorder.progress_context('Creating runs with plan as parent'):
-            mappings['tests_parent_plan'], mappings['runs_parent_plan'] = creator.create_runs(
-                runs=backup['runs_parent_plan'],
-                mapping=mappings['plans'],
-                config_mappings=mappings['configs'],
-                tests=backup['tests_parent_plan'],
-                case_mappings=mappings['cases'],
-                project_id=project.id,
-                upload_root_runs=upload_root_runs,
-                parent_type=ParentType.PLAN,
-                user_mappings=mappings['users']
-            )
+        # Phases of graph may run in parallel and would count items of each other by difference of all mappings,
+        # so every phase counts items it has created itself
+        def create_users():
+            with progress_recorder.progress_context('Creating users') as phase:
+                mappings['users'] = checkpointer.run_phase(
+                    'users', id_store.create_missing, EntityType.USER, UserModel, backup['users'], creator.create_users
+                )
+                phase.items = len(mappings['users'])
 
-        with progress_recorder.progress_context('Creating results with plan as parent'):
-            mappings['results_parent_plan'] = creator.create_results(
-                backup['results_parent_plan'],
-                custom_fields_multi_select,
-                custom_fields_labels,
-                mappings['tests_parent_plan'],
-                mappings['users']
-            )
+        def create_configs():
+            with progress_recorder.progress_context('Creating configs') as phase:
+                mappings['configs'] = checkpointer.run_phase(
+                    'configs', creator.create_configs, backup['configs'], project.id
+                )
+                phase.items = len(mappings['configs'])
 
-        with progress_recorder.progress_context('Creating runs with mile as parent'):
-            mappings['tests_parent_mile'], mappings['runs_parent_mile'] = creator.create_runs(
-                runs=backup['runs_parent_mile'],
-                mapping=mappings['milestones'],
-                config_mappings=mappings['configs'],
-                tests=backup['tests_parent_mile'],
-                case_mappings=mappings['cases'],
-                project_id=project.id,
-                upload_root_runs=upload_root_runs,
-                parent_type=ParentType.MILESTONE,
-                user_mappings=mappings['users']
+        def create_suites():
+            with progress_recorder.progress_context('Creating suites') as phase:
+                mappings['suites'] = checkpointer.run_phase(
+                    'suites', id_store.create_missing, EntityType.SUITE, TestSuite, backup['suites'],
+                    creator.create_suites, project.id, testy_filters={'project_id': project.id}
+                )
+                phase.items = len(mappings['suites'])
+
+        def create_sections():
+            with progress_recorder.progress_context('Creating sections') as phase:
+                mappings['sections'] = checkpointer.run_phase(
+                    'sections', id_store.create_missing, EntityType.SECTION, TestSuite, backup['sections'],
+                    creator.create_sections, mappings['suites'], project.id, testy_filters={'project_id': project.id},
+                    pass_known_mappings=True
+                )
+                phase.items = len(mappings['sections'])
+
+        def create_cases():
+            with progress_recorder.progress_context('Creating cases') as phase:
+                mappings['cases'] = checkpointer.run_batched_phase(
+                    'cases', backup['cases'], partial(id_store.create_missing, EntityType.CASE, TestCase),
+                    creator.create_cases, mappings['suites'], mappings['sections'], project.id,
+                    config_dict['custom_fields_matcher'], testy_filters={'project_id': project.id}
+                )
+                phase.items = len(mappings['cases'])
+
+        def create_plan_tree():
+            with progress_recorder.progress_context('Creating milestones, plans and runs') as phase:
+                plan_tree_mappings = checkpointer.run_phase(
+                    'plan_tree',
+                    creator.create_plan_tree,
+                    project_id=project.id,
+                    config_mappings=mappings['configs'],
+                    milestones=backup['milestones'],
+                    plans=backup['plans'],
+                    runs_parent_plan=backup['runs_parent_plan'],
+                    runs_parent_mile=backup['runs_parent_mile'],
+                    upload_root_runs=upload_root_runs,
+                )
+                mappings.update(plan_tree_mappings)
+                phase.items = count_mapped_items(plan_tree_mappings)
+
+        def create_tests(key):
+            with progress_recorder.progress_context(f'Creating tests with {key}') as phase:
+                mappings[f'tests_{key}'] = checkpointer.run_phase(
+                    f'tests_{key}', creator.create_tests_for_runs, backup[f'tests_{key}'], mappings[f'runs_{key}'],
+                    mappings['cases'], project.id, mappings['users']
+                )
+                phase.items = len(mappings[f'tests_{key}'])
+
+        def create_results(key, partition_idx, results):
+            with progress_recorder.progress_context(
+                    f'Creating results with {key}, partition {partition_idx}'
+            ) as phase:
+                results_mapping = checkpointer.run_batched_phase(
+                    f'results_{key}_{partition_idx}',
+                    results,
+                    creator.create_results,
+                    custom_fields_multi_select,
+                    custom_fields_labels,
+                    mappings[f'tests_{key}'],
+                    mappings['users']
+                )
+                phase.items = len(results_mapping)
+                return results_mapping
+
+        graph.add('users', create_users)
+        graph.add('configs', create_configs)
+        graph.add('suites', create_suites)
+        graph.add('sections', create_sections, depends_on=['suites'])
+        graph.add('cases', create_cases, depends_on=['sections'])
+        graph.add('plan_tree', create_plan_tree, depends_on=['configs'])
+        # Partition count is kept in checkpoint, so resumed upload splits results the same way with any worker count
+        partitions_count = checkpointer.run_phase('results_partitions', lambda: max(parallel_workers, 1))
+        for key in ['parent_plan', 'parent_mile']:
+            graph.add(f'tests_{key}', partial(create_tests, key), depends_on=['users', 'cases', 'plan_tree'])
+            # Results of different runs are independent, so they are split by runs between parallel workers
+            partitions = split_results_by_runs(
+                sorted(backup[f'results_{key}'], key=itemgetter('created_on')),
+                backup[f'tests_{key}'],
+                partitions_count
             )
+            for partition_idx, results in enumerate(partitions):
+                graph.add(
+                    f'results_{key}_{partition_idx}',
+                    partial(create_results, key, partition_idx, results),
+                    depends_on=[f'tests_{key}']
+                )
+        graph.run()
+        for key in ['parent_plan', 'parent_mile']:
+            mappings[f'results_{key}'] = {}
+            for phase_name, phase_result in graph.results.items():
+                if phase_name.startswith(f'results_{key}_'):
+                    mappings[f'results_{key}'].update(phase_result)
+        progress_recorder.item_counter = partial(count_mapped_items, mappings)
+        creator.progress = checkpointer.progress = progress_recorder.items
 
-        with progress_recorder.progress_context('Creating runs with mile as parent'):
-            mappings['results_parent_mile'] = creator.create_results(
-                backup['results_parent_mile'],
-                custom_fields_multi_select,
-                custom_fields_labels,
-                mappings['tests_parent_mile'],
-                mappings['users'],
-            )
         if not backup.get('attachments'):
-            return
+            finish_upload(checkpointer, id_store, mappings)
+            return progress_recorder.task_result()
         mappings['attachments'] = {}
         keys = [
-            ('cases', 'case_id', InstanceType.CASE),
-            ('plans', 'plan_id', InstanceType.PLAN),
-            ('runs_parent_plan', 'run_id', InstanceType.RUN),
-            ('runs_parent_mile', 'run_id', InstanceType.RUN),
+            ('cases', 'cases', 'case_id', InstanceType.CASE),
+            ('plans', 'plans', 'plan_id', InstanceType.PLAN),
+            ('runs_parent_plan', 'runs_parent_plan', 'run_id', InstanceType.RUN),
+            ('runs_parent_mile', 'runs_parent_mile', 'run_id', InstanceType.RUN),
+            ('tests_parent_plan', 'results_parent_plan', 'result_id', InstanceType.TEST),
+            ('tests_parent_mile', 'results_parent_mile', 'result_id', InstanceType.TEST),
         ]
 
-        testrail_client = TestRailClient(TestrailConfig(**config_dict))
+        testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
 
-        for key, parent_key, instance_type in keys:
+        for key, mapping_key, parent_key, instance_type in keys:
             with progress_recorder.progress_context(f'Creating attachments for {key}'):
-                file_attachments = testrail_client.get_attachments_from_list(backup['attachments'][key], parent_key)
-                mappings['attachments'].update(
-                    creator.attachment_bulk_create(file_attachments, project, mappings['users'], parent_key,
-                                                   mappings[key], instance_type)
-                )
-
-        keys = [
-            ('parent_plan', 'result_id', InstanceType.TEST),
-            ('parent_mile', 'result_id', InstanceType.TEST)
-        ]
-
-        for key, parent_key, instance_type in keys:
-            with progress_recorder.progress_context(f'Creating attachments for {key}'):
-                file_attachments = testrail_client.get_attachments_from_list(
-                    backup['attachments'][f'tests_{key}'],
-                    parent_key
-                )
                 mappings['attachments'].update(
-                    creator.attachment_bulk_create(file_attachments, project, mappings['users'], parent_key,
-                                                   mappings[f'results_{key}'], instance_type)
+                    checkpointer.run_batched_phase(
+                        f'attachments_{key}',
+                        id_store.without_reused_parents(
+                            id_store.mapping_key_entity_types[mapping_key], backup['attachments'][key], parent_key
+                        ),
+                        upload_attachments, creator, testrail_client, project, mappings['users'], parent_key,
+                        mappings[mapping_key], instance_type
+                    )
                 )
 
         mappings['steps'] = get_fake_mapping_for_steps(mappings['cases'])
         mappings_keys = [
-            ('cases', TestCase, MigratorService.case_update, ['scenario', 'setup', 'description']),
-            ('steps', TestCaseStep, MigratorService.step_update, ['scenario', 'expected']),
-            ('results_parent_mile', TestResult, TestResultService().result_update, ['comment']),
-            ('results_parent_plan', TestResult, TestResultService().result_update, ['comment']),
+            ('cases', TestCase, ['scenario', 'setup', 'description']),
+            ('steps', TestCaseStep, ['scenario', 'expected']),
+            ('results_parent_mile', TestResult, ['comment']),
+            ('results_parent_plan', TestResult, ['comment']),
         ]
 
-        for mapping_key, model_class, update_method, field_list in mappings_keys:
+        for mapping_key, model_class, field_list in mappings_keys:
             with progress_recorder.progress_context(f'Looking for attachments in fields of {mapping_key}'):
-                creator.update_testy_attachment_urls_async(
-                    mappings[mapping_key],
-                    model_class,
-                    update_method,
-                    field_list,
-                    config_dict,
-                    mappings['attachments']
+                checkpointer.run_batched_phase(
+                    f'attachment_urls_{mapping_key}', sorted(mappings[mapping_key].items()), update_attachment_urls,
+                    creator, model_class, field_list, config_dict, mappings['attachments']
                 )
+        finish_upload(checkpointer, id_store, mappings)
+        return progress_recorder.task_result()
 
 
 @shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
 def upload_suites_task(self, backup_name, config_dict, testy_project_id, service_user_login='admin',
-                       testy_attachment_url: str = None):
-    progress_recorder = ProgressRecorderContext(self, total=7, description='Upload started')
-    with transaction.atomic():
+                       testy_attachment_url: str = None, resumable: bool = False, count_queries: bool = False,
+                       query_budgets: Dict[str, int] = None, profile_memory: bool = False):
+    progress_recorder = MigrationRunRecorder(self, total=7, description='Upload started', backup_name=backup_name,
+                                             count_queries=count_queries, query_budgets=query_budgets,
+                                             profile_memory=profile_memory)
+    creator = TestyCreator(service_user_login, testy_attachment_url, progress=progress_recorder.items)
+    progress_recorder.instance_cache = creator.instance_cache
+    id_store = IdMappingStore(config_dict['api_url'])
+    checkpointer = UploadCheckpointer.for_task(resumable, self.name, backup_name, testy_project_id,
+                                               progress=progress_recorder.items)
+    with checkpointer.task_transaction(), creator.instance_cache.log_stats_on_exit(self.name):
         logging.info('redis about to start')
         redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
         logging.info('redis started')
-        backup = json.loads(redis_client.get(backup_name))
-
-        creator = TestyCreator(service_user_login, testy_attachment_url)
+        with progress_recorder.measure('Loading backup'):
+            backup = json.loads(redis_client.get(backup_name))
+        creator.add_prefetched_attachments(backup.get('inline_attachments', {}), load_attachment_body)
 
         mappings = {}
+        progress_recorder.item_counter = partial(count_mapped_items, mappings)
 
         with progress_recorder.progress_context('Creating users'):
-            mappings['users'] = creator.create_users(backup['users'])
+            mappings['users'] = checkpointer.run_phase(
+                'users', id_store.create_missing, EntityType.USER, UserModel, backup['users'], creator.create_users
+            )
 
         with progress_recorder.progress_context('Creating suites'):
-            mappings['suites'] = creator.create_suites(backup['suites'], testy_project_id)
+            mappings['suites'] = checkpointer.run_phase(
+                'suites', id_store.create_missing, EntityType.SUITE, TestSuite, backup['suites'], creator.create_suites,
+                testy_project_id, testy_filters={'project_id': testy_project_id}
+            )
 
         with progress_recorder.progress_context('Creating sections'):
-            mappings['sections'] = creator.create_sections(backup['sections'], mappings['suites'], testy_project_id)
+            mappings['sections'] = checkpointer.run_phase(
+                'sections', id_store.create_missing, EntityType.SECTION, TestSuite, backup['sections'],
+                creator.create_sections, mappings['suites'], testy_project_id,
+                testy_filters={'project_id': testy_project_id}, pass_known_mappings=True
+            )
 
         with progress_recorder.progress_context('Creating cases'):
-            mappings['cases'] = creator.create_cases(
-                backup['cases'],
-                mappings['suites'],
-                mappings['sections'],
-                testy_project_id,
-                config_dict['custom_fields_matcher']
+            mappings['cases'] = checkpointer.run_batched_phase(
+                'cases', backup['cases'], partial(id_store.create_missing, EntityType.CASE, TestCase),
+                creator.create_cases, mappings['suites'], mappings['sections'], testy_project_id,
+                config_dict['custom_fields_matcher'], testy_filters={'project_id': testy_project_id}
             )
         if not backup.get('attachments'):
-            return
-        mappings['attachments'] = {}
+            finish_upload(checkpointer, id_store, mappings)
+            return progress_recorder.task_result()
 
-        testrail_client = TestRailClient(TestrailConfig(**config_dict))
+        testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
 
         with progress_recorder.progress_context('Creating attachments for cases'):
-            file_attachments = testrail_client.get_attachments_from_list(backup['attachments']['cases'], 'case_id')
-            mappings['attachments'].update(
-                creator.attachment_bulk_create(file_attachments, Project.objects.get(pk=testy_project_id),
-                                               mappings['users'], 'case_id',
-                                               mappings['cases'], InstanceType.CASE)
+            mappings['attachments'] = checkpointer.run_batched_phase(
+                'attachments_cases',
+                id_store.without_reused_parents(EntityType.CASE, backup['attachments']['cases'], 'case_id'),
+                upload_attachments, creator, testrail_client,
+                creator.instance_cache.get(Project, testy_project_id), mappings['users'], 'case_id', mappings['cases'],
+                InstanceType.CASE
             )
 
-        with progress_recorder.progress_context('Looking for attachments in fields of cases'):
-            creator.update_testy_attachment_urls_async(
-                mappings['cases'],
-                TestCase,
-                MigratorService.case_update,
-                ['scenario', 'setup', 'description'],
-                config_dict,
-                mappings['attachments']
-            )
+        mappings['steps'] = get_fake_mapping_for_steps(mappings['cases'])
+        mappings_keys = [
+            ('cases', TestCase, ['scenario', 'setup', 'description']),
+            ('steps', TestCaseStep, ['scenario', 'expected']),
+        ]
 
-        with progress_recorder.progress_context('Looking for attachments in fields of cases'):
-            mappings['steps'] = get_fake_mapping_for_steps(mappings['cases'])
-            creator.update_testy_attachment_urls_async(
-                mappings['steps'],
-                TestCaseStep,
-                MigratorService.step_update,
-                ['scenario', 'expected'],
-                config_dict,
-                mappings['attachments']
-            )
+        for mapping_key, model_class, field_list in mappings_keys:
+            with progress_recorder.progress_context(f'Looking for attachments in fields of {mapping_key}'):
+                checkpointer.run_batched_phase(
+                    f'attachment_urls_{mapping_key}', sorted(mappings[mapping_key].items()), update_attachment_urls,
+                    creator, model_class, field_list, config_dict, mappings['attachments']
+                )
+        finish_upload(checkpointer, id_store, mappings)
+        return progress_recorder.task_result()
 
 
 @shared_task(bind=True)
-def download_task(self, project_id: int, config_dict: Dict, download_attachments, ignore_completed, backup_filename):
-    progress_recorder = ProgressRecorderContext(self, total=21, description='Download started')
+@with_tracing
+@with_cpu_profiling
+def download_task(
+        self,
+        project_id: int,
+        config_dict: Dict,
+        download_attachments,
+        ignore_completed,
+        backup_filename,
+        fan_out: bool = False,
+        runs_batch_size: int = 100,
+        profile_memory: bool = False
+):
+    progress_recorder = MigrationRunRecorder(self, total=23, description='Download started',
+                                             profile_memory=profile_memory)
 
     resulting_data = {}
+    progress_recorder.item_counter = partial(count_items, resulting_data)
 
-    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
     with progress_recorder.progress_context('Getting users'):
         resulting_data['users'] = testrail_client.get_users()
     with progress_recorder.progress_context('Getting custom fields for results '):
@@ -279,6 +420,31 @@ def download_task(self, project_id: int, config_dict: Dict, download_attachments
         resulting_data['project'] = testrail_client.get_project(project_id)
     with progress_recorder.progress_context('Getting suites'):
         resulting_data['suites'] = testrail_client.get_suites(project_id)
+    if fan_out:
+        query_params = {'is_completed': 0} if ignore_completed else None
+        with progress_recorder.progress_context('Getting configs'):
+            resulting_data['configs'] = testrail_client.get_configs(project_id)
+        with progress_recorder.progress_context('Getting milestones'):
+            resulting_data['milestones'] = testrail_client.get_milestones(project_id, ignore_completed, query_params)
+        with progress_recorder.progress_context('Getting plans'):
+            resulting_data['plans'] = testrail_client.get_plans_with_runs(project_id, query_params)
+        with progress_recorder.progress_context('Getting runs for plans'):
+            resulting_data['runs_parent_plan'] = testrail_client.get_runs_from_plans(resulting_data['plans'])
+        with progress_recorder.progress_context('Getting runs for milestones'):
+            resulting_data['runs_parent_mile'] = testrail_client.get_runs(project_id, query_params=query_params)
+        if download_attachments:
+            with progress_recorder.progress_context('Getting attachments for plans'):
+                resulting_data['attachments'] = {
+                    'plans': testrail_client.get_attachments_for_instances(resulting_data['plans'], InstanceType.PLAN)
+                }
+                save_attachment_bodies(testrail_client, resulting_data['attachments'])
+        with progress_recorder.progress_context('Dispatching download parts'):
+            resulting_data['http_metrics'] = testrail_client.metrics.as_dict()
+            workflow = make_download_workflow(
+                self.request.id, project_id, config_dict, resulting_data, download_attachments, backup_filename,
+                runs_batch_size, progress_recorder.run.id, profile_memory
+            )
+        raise self.replace(workflow)
     with progress_recorder.progress_context('Getting cases'):
         resulting_data['cases'] = testrail_client.get_cases(project_id, resulting_data['suites'])
     with progress_recorder.progress_context('Getting sections'):
@@ -308,8 +474,9 @@ def download_task(self, project_id: int, config_dict: Dict, download_attachments
             resulting_data['tests_parent_mile']
         )
     if not download_attachments:
-        save_results_to_redis(resulting_data, backup_filename)
-        return
+        with progress_recorder.measure('Saving backup'):
+            save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+        return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
     keys_instance_type = [
         ('cases', InstanceType.CASE),
         ('plans', InstanceType.PLAN),
@@ -322,15 +489,265 @@ def download_task(self, project_id: int, config_dict: Dict, download_attachments
 
     for key, instance_type in keys_instance_type:
         with progress_recorder.progress_context(f'Getting attachments for {key}'):
-            resulting_data['attachments'][key] = testrail_client.get_attachments_for_instances(
-                resulting_data[key],
-                instance_type
+            resulting_data['attachments'][key] = get_attachments_for_key(
+                testrail_client, resulting_data, key, instance_type
             )
+    with progress_recorder.progress_context('Getting attachment files'):
+        save_attachment_bodies(testrail_client, resulting_data['attachments'])
+    with progress_recorder.progress_context('Getting inline attachments'):
+        resulting_data['inline_attachments'] = get_inline_attachments(testrail_client, resulting_data)
     print(f'SUMMARY OF STEPS {progress_recorder.current}')
-    save_results_to_redis(resulting_data, backup_filename)
+    with progress_recorder.measure('Saving backup'):
+        save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+    return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
+
+
+@shared_task(bind=True)
+def estimate_download_task(self, project_id: int, config_dict: Dict, download_attachments, ignore_completed):
+    progress_recorder = MigrationRunRecorder(self, total=1, description='Estimate started')
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
+    with progress_recorder.progress_context('Estimating download'):
+        estimate = DownloadEstimator(testrail_client).estimate(project_id, download_attachments, ignore_completed)
+    return {'estimate': estimate, **save_http_metrics(self.request.id, testrail_client.metrics)}
 
 
 @shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
+def migrate_task(self, project_id: int, config_dict: Dict, upload_root_runs: bool, ignore_completed: bool,
+                 migrate_attachments: bool, service_user_login='admin', testy_attachment_url: str = None,
+                 testy_project_id=None, queue_size: int = 4, count_queries: bool = False,
+                 query_budgets: Dict[str, int] = None, profile_memory: bool = False):
+    progress_recorder = MigrationRunRecorder(self, total=16, description='Migration started',
+                                             count_queries=count_queries, query_budgets=query_budgets,
+                                             profile_memory=profile_memory)
+    creator = TestyCreator(service_user_login, testy_attachment_url, progress=progress_recorder.items)
+    progress_recorder.instance_cache = creator.instance_cache
+    id_store = IdMappingStore(config_dict['api_url'])
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
+    query_params = {'is_completed': 0} if ignore_completed else None
+    with transaction.atomic(), creator.instance_cache.log_stats_on_exit(self.name):
+        mappings = {}
+        progress_recorder.item_counter = partial(count_mapped_items, mappings)
+        with progress_recorder.progress_context('Migrating users'):
+            mappings['users'] = id_store.create_missing(
+                EntityType.USER, UserModel, testrail_client.get_users(), creator.create_users
+            )
+        with progress_recorder.progress_context('Getting custom fields for results'):
+            custom_result_fields = testrail_client.get_custom_result_fields()
+            custom_fields_multi_select = parse_multi_select_from_tr(custom_result_fields)
+            custom_fields_labels = parse_labels_from_tr_fields(custom_result_fields)
+        with progress_recorder.progress_context('Migrating project'):
+            if testy_project_id:
+                project = creator.instance_cache.get(Project, testy_project_id)
+            else:
+                project = MigratorService.create_project(testrail_client.get_project(project_id))
+                creator.instance_cache.add(project)
+        with progress_recorder.progress_context('Migrating configs'):
+            mappings['configs'] = creator.create_configs(testrail_client.get_configs(project_id), project.id)
+        with progress_recorder.progress_context('Migrating suites'):
+            suites = testrail_client.get_suites(project_id)
+            mappings['suites'] = id_store.create_missing(
+                EntityType.SUITE, TestSuite, suites, creator.create_suites, project.id,
+                testy_filters={'project_id': project.id}
+            )
+
+        streamer = StreamingMigrator(creator, id_store, testrail_client, project, mappings['users'],
+                                     migrate_attachments, queue_size)
+        with progress_recorder.progress_context('Streaming sections and cases'):
+            streamer.migrate_suites(project_id, suites, mappings['suites'], config_dict['custom_fields_matcher'])
+
+        with progress_recorder.progress_context('Getting milestones, plans and runs'):
+            milestones = testrail_client.get_milestones(project_id, ignore_completed, query_params)
+            plans = testrail_client.get_plans_with_runs(project_id, query_params)
+            runs = {
+                'runs_parent_plan': testrail_client.get_runs_from_plans(plans),
+                'runs_parent_mile': testrail_client.get_runs(project_id, query_params=query_params)
+            }
+        with progress_recorder.progress_context('Migrating milestones, plans and runs'):
+            mappings.update(
+                creator.create_plan_tree(
+                    project_id=project.id,
+                    config_mappings=mappings['configs'],
+                    milestones=milestones,
+                    plans=plans,
+                    runs_parent_plan=runs['runs_parent_plan'],
+                    runs_parent_mile=runs['runs_parent_mile'],
+                    upload_root_runs=upload_root_runs,
+                )
+            )
+        for key in ['parent_plan', 'parent_mile']:
+            with progress_recorder.progress_context(f'Streaming tests and results with {key}'):
+                streamer.migrate_runs(key, runs[f'runs_{key}'], mappings[f'runs_{key}'], custom_fields_multi_select,
+                                      custom_fields_labels)
+        mappings.update(streamer.mappings)
+
+        if not migrate_attachments:
+            id_store.save_mappings(mappings)
+            return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
+
+        for key, instances, parent_key, instance_type in [
+            ('plans', plans, 'plan_id', InstanceType.PLAN),
+            ('runs_parent_plan', runs['runs_parent_plan'], 'run_id', InstanceType.RUN),
+            ('runs_parent_mile', runs['runs_parent_mile'], 'run_id', InstanceType.RUN),
+        ]:
+            with progress_recorder.progress_context(f'Migrating attachments for {key}'):
+                mappings['attachments'].update(
+                    upload_attachments(
+                        testrail_client.get_attachments_for_instances(instances, instance_type), creator,
+                        testrail_client, project, mappings['users'], parent_key, mappings[key], instance_type
+                    )
+                )
+
+        mappings['steps'] = get_fake_mapping_for_steps(mappings['cases'])
+        mappings_keys = [
+            ('cases', TestCase, ['scenario', 'setup', 'description']),
+            ('steps', TestCaseStep, ['scenario', 'expected']),
+            ('results_parent_mile', TestResult, ['comment']),
+            ('results_parent_plan', TestResult, ['comment']),
+        ]
+        for mapping_key, model_class, field_list in mappings_keys:
+            with progress_recorder.progress_context(f'Looking for attachments in fields of {mapping_key}'):
+                update_attachment_urls(mappings[mapping_key].items(), creator, model_class, field_list, config_dict,
+                                       mappings['attachments'])
+        id_store.save_mappings(mappings)
+        return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
+
+
+def make_download_workflow(
+        task_id,
+        project_id: int,
+        config_dict: Dict,
+        resulting_data,
+        download_attachments,
+        backup_filename,
+        runs_batch_size: int,
+        migration_run_id: int,
+        profile_memory: bool = False
+):
+    """
+    Build chord that downloads suites and batches of runs on separate workers.
+
+    Args:
+        task_id: id of task that dispatches workflow, used as prefix for partial results keys.
+        project_id: testrail project id.
+        config_dict: testrail config.
+        resulting_data: already downloaded project level data, stored as base of backup.
+        download_attachments: download attachments for cases, runs and tests or not.
+        backup_filename: name of resulting backup.
+        runs_batch_size: number of runs handled by single subtask.
+        migration_run_id: id of migration run of dispatching task, subtasks save their phases to it.
+        profile_memory: trace allocations of subtasks.
+
+    Returns:
+        chord signature, its callback saves combined backup.
+    """
+    base_key = f'download_part:{task_id}:base'
+    save_part_to_redis(base_key, resulting_data)
+    part_tasks = [
+        download_suite_part_task.s(f'download_part:{task_id}:suite:{suite["id"]}', project_id, config_dict, suite,
+                                   download_attachments, migration_run_id, profile_memory)
+        for suite in resulting_data['suites']
+    ]
+    for runs_key in ['runs_parent_plan', 'runs_parent_mile']:
+        for idx, runs in enumerate(split_list_by_chunks(resulting_data[runs_key], runs_batch_size)):
+            part_tasks.append(
+                download_runs_part_task.s(f'download_part:{task_id}:{runs_key}:{idx}', config_dict, runs, runs_key,
+                                          download_attachments, migration_run_id, profile_memory)
+            )
+    return chord(
+        group(part_tasks),
+        combine_download_parts_task.s(base_key, backup_filename, migration_run_id, profile_memory)
+    )
+
+
+@shared_task
+def download_suite_part_task(part_key, project_id: int, config_dict: Dict, suite, download_attachments,
+                             migration_run_id: int, profile_memory: bool = False):
+    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    migration_run = MigrationRun.objects.get(pk=migration_run_id)
+    with record_phase(migration_run, f'Downloading suite {suite["id"]}', profile_memory=profile_memory) as phase:
+        part = {
+            'cases': testrail_client.get_cases(project_id, [suite]),
+            'sections': testrail_client.get_sections(project_id, [suite])
+        }
+        if download_attachments:
+            part['attachments'] = {
+                'cases': testrail_client.get_attachments_for_instances(part['cases'], InstanceType.CASE)
+            }
+            save_attachment_bodies(testrail_client, part['attachments'])
+            part['inline_attachments'] = get_inline_attachments(testrail_client, part)
+        phase.items = count_items(part)
+    part['http_metrics'] = testrail_client.metrics.as_dict()
+    save_part_to_redis(part_key, part)
+    return part_key
+
+
+@shared_task
+def download_runs_part_task(part_key, config_dict: Dict, runs, runs_key, download_attachments, migration_run_id: int,
+                            profile_memory: bool = False):
+    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    parent_key = runs_key.replace('runs_', '', 1)
+    migration_run = MigrationRun.objects.get(pk=migration_run_id)
+    with record_phase(migration_run, f'Downloading {len(runs)} {runs_key}', profile_memory=profile_memory) as phase:
+        tests = testrail_client.get_tests_for_runs(runs)
+        part = {
+            f'tests_{parent_key}': tests,
+            f'results_{parent_key}': testrail_client.get_results_for_tests(tests)
+        }
+        if download_attachments:
+            part['attachments'] = {
+                runs_key: testrail_client.get_attachments_for_instances(runs, InstanceType.RUN),
+                f'tests_{parent_key}': testrail_client.get_attachments_for_tests(tests, part[f'results_{parent_key}'])
+            }
+            save_attachment_bodies(testrail_client, part['attachments'])
+            part['inline_attachments'] = get_inline_attachments(testrail_client, part)
+        phase.items = count_items(part)
+    part['http_metrics'] = testrail_client.metrics.as_dict()
+    save_part_to_redis(part_key, part)
+    return part_key
+
+
+@shared_task(bind=True)
+def combine_download_parts_task(self, part_keys, base_key, backup_filename, migration_run_id: int,
+                                profile_memory: bool = False):
+    redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
+    resulting_data = json.loads(redis_client.get(base_key))
+    http_metrics = HttpMetrics()
+    http_metrics.merge(resulting_data.pop('http_metrics', {}))
+    for key in ['cases', 'sections', 'tests_parent_plan', 'tests_parent_mile', 'results_parent_plan',
+                'results_parent_mile']:
+        resulting_data.setdefault(key, [])
+    if 'attachments' in resulting_data:
+        for key in ['cases', 'runs_parent_mile', 'runs_parent_plan', 'tests_parent_mile', 'tests_parent_plan']:
+            resulting_data['attachments'].setdefault(key, [])
+    migration_run = MigrationRun.objects.get(pk=migration_run_id)
+    with record_phase(migration_run, 'Combining download parts', partial(count_items, resulting_data),
+                      profile_memory=profile_memory):
+        for part_key in part_keys:
+            part = json.loads(redis_client.get(part_key))
+            http_metrics.merge(part.pop('http_metrics', {}))
+            for key, value in part.pop('attachments', {}).items():
+                resulting_data['attachments'][key].extend(value)
+            if 'inline_attachments' in part:
+                resulting_data.setdefault('inline_attachments', {}).update(part.pop('inline_attachments'))
+            for key, value in part.items():
+                resulting_data[key].extend(value)
+        save_results_to_redis(resulting_data, backup_filename, migration_run)
+    redis_client.delete(base_key, *part_keys)
+    result = save_http_metrics(self.request.id, http_metrics)
+    if profile_memory:
+        result['memory_profile'] = list(
+            migration_run.phases.filter(peak_rss_mb__isnull=False).values(
+                'name', 'rss_start_mb', 'rss_end_mb', 'peak_rss_mb', 'traced_peak_mb', 'retained_mb', 'top_allocations'
+            )
+        )
+    return result
+
+
+@shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
 def download_milestone_task(
         self,
         project_id: int,
@@ -338,14 +755,17 @@ def download_milestone_task(
         config_dict: Dict,
         download_attachments,
         ignore_completed,
-        backup_filename
+        backup_filename,
+        profile_memory: bool = False
 ):
     query_params = {'milestone_id': ','.join(map(str, milestone_ids))}
     resulting_data = {}
     if ignore_completed:
         query_params['is_completed'] = 0
-    progress_recorder = ProgressRecorderContext(self, total=14, description='Download started')
-    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    progress_recorder = MigrationRunRecorder(self, total=16, description='Download started',
+                                             profile_memory=profile_memory)
+    progress_recorder.item_counter = partial(count_items, resulting_data)
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
     with progress_recorder.progress_context('Getting users'):
         resulting_data['users'] = testrail_client.get_users()
     with progress_recorder.progress_context('Getting custom fields for results '):
@@ -412,8 +832,9 @@ def download_milestone_task(
         )
 
     if not download_attachments:
-        save_results_to_redis(resulting_data, backup_filename)
-        return
+        with progress_recorder.measure('Saving backup'):
+            save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+        return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
 
     with progress_recorder.progress_context('Getting attachments'):
         keys_instance_type = [
@@ -427,20 +848,30 @@ def download_milestone_task(
         resulting_data['attachments'] = {}
 
         for key, instance_type in keys_instance_type:
-            resulting_data['attachments'][key] = testrail_client.get_attachments_for_instances(
-                resulting_data[key],
-                instance_type
+            resulting_data['attachments'][key] = get_attachments_for_key(
+                testrail_client, resulting_data, key, instance_type
             )
-    save_results_to_redis(resulting_data, backup_filename)
+    with progress_recorder.progress_context('Getting attachment files'):
+        save_attachment_bodies(testrail_client, resulting_data['attachments'])
+    with progress_recorder.progress_context('Getting inline attachments'):
+        resulting_data['inline_attachments'] = get_inline_attachments(testrail_client, resulting_data)
+    with progress_recorder.measure('Saving backup'):
+        save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+    return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
 
 
 @shared_task(bind=True)
-def download_suites_task(self, project_id: int, config_dict: Dict, download_attachments, backup_filename, suite_ids):
-    progress_recorder = ProgressRecorderContext(self, total=5, description='Download started')
+@with_tracing
+@with_cpu_profiling
+def download_suites_task(self, project_id: int, config_dict: Dict, download_attachments, backup_filename, suite_ids,
+                         profile_memory: bool = False):
+    progress_recorder = MigrationRunRecorder(self, total=7, description='Download started',
+                                             profile_memory=profile_memory)
 
     resulting_data = {}
+    progress_recorder.item_counter = partial(count_items, resulting_data)
 
-    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
 
     with progress_recorder.progress_context('Getting users'):
         resulting_data['users'] = testrail_client.get_users()
@@ -452,24 +883,35 @@ def download_suites_task(self, project_id: int, config_dict: Dict, download_atta
     with progress_recorder.progress_context('Getting sections'):
         resulting_data['sections'] = testrail_client.get_sections(project_id, resulting_data['suites'])
     if not download_attachments:
-        save_results_to_redis(resulting_data, backup_filename)
-        return
+        with progress_recorder.measure('Saving backup'):
+            save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+        return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
     resulting_data['attachments'] = {}
     with progress_recorder.progress_context('Getting attachments for cases'):
         resulting_data['attachments']['cases'] = testrail_client.get_attachments_for_instances(
             resulting_data['cases'],
             InstanceType.CASE
         )
+    with progress_recorder.progress_context('Getting attachment files'):
+        save_attachment_bodies(testrail_client, resulting_data['attachments'])
+    with progress_recorder.progress_context('Getting inline attachments'):
+        resulting_data['inline_attachments'] = get_inline_attachments(testrail_client, resulting_data)
     print(f'SUMMARY OF STEPS {progress_recorder.current}')
-    save_results_to_redis(resulting_data, backup_filename)
+    with progress_recorder.measure('Saving backup'):
+        save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+    return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
 
 
 @shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
 def download_plans_runs_task(self, project_id: int, config_dict: Dict, download_attachments, backup_filename, plans_ids,
-                             runs_ids):
+                             runs_ids, profile_memory: bool = False):
     resulting_data = {}
-    progress_recorder = ProgressRecorderContext(self, total=11, description='Download started')
-    testrail_client = TestRailClient(TestrailConfig(**config_dict))
+    progress_recorder = MigrationRunRecorder(self, total=13, description='Download started',
+                                             profile_memory=profile_memory)
+    progress_recorder.item_counter = partial(count_items, resulting_data)
+    testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
     with progress_recorder.progress_context('Getting users'):
         resulting_data['users'] = testrail_client.get_users()
     with progress_recorder.progress_context('Getting custom fields for results '):
@@ -523,8 +965,9 @@ def download_plans_runs_task(self, project_id: int, config_dict: Dict, download_
         )
 
     if not download_attachments:
-        save_results_to_redis(resulting_data, backup_filename)
-        return
+        with progress_recorder.measure('Saving backup'):
+            save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+        return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
 
     with progress_recorder.progress_context('Getting attachments'):
         keys_instance_type = [
@@ -538,168 +981,274 @@ def download_plans_runs_task(self, project_id: int, config_dict: Dict, download_
         resulting_data['attachments'] = {}
 
         for key, instance_type in keys_instance_type:
-            resulting_data['attachments'][key] = testrail_client.get_attachments_for_instances(
-                resulting_data[key],
-                instance_type
+            resulting_data['attachments'][key] = get_attachments_for_key(
+                testrail_client, resulting_data, key, instance_type
             )
-    save_results_to_redis(resulting_data, backup_filename)
+    with progress_recorder.progress_context('Getting attachment files'):
+        save_attachment_bodies(testrail_client, resulting_data['attachments'])
+    with progress_recorder.progress_context('Getting inline attachments'):
+        resulting_data['inline_attachments'] = get_inline_attachments(testrail_client, resulting_data)
+    with progress_recorder.measure('Saving backup'):
+        save_results_to_redis(resulting_data, backup_filename, progress_recorder.run)
+    return progress_recorder.task_result(save_http_metrics(self.request.id, testrail_client.metrics))
 
 
 @shared_task(bind=True)
+@with_tracing
+@with_cpu_profiling
 def upload_plans_runs_task(self, backup_name, config_dict, service_user_login='admin',
-                           testy_attachment_url: str = None, testy_project_id=None, testy_plan_id=None):
-    progress_recorder = ProgressRecorderContext(self, total=13, description='Upload started')
-    with transaction.atomic():
+                           testy_attachment_url: str = None, testy_project_id=None, testy_plan_id=None,
+                           resumable: bool = False, count_queries: bool = False, query_budgets: Dict[str, int] = None,
+                           profile_memory: bool = False):
+    progress_recorder = MigrationRunRecorder(self, total=13, description='Upload started', backup_name=backup_name,
+                                             count_queries=count_queries, query_budgets=query_budgets,
+                                             profile_memory=profile_memory)
+    creator = TestyCreator(service_user_login, testy_attachment_url, progress=progress_recorder.items)
+    progress_recorder.instance_cache = creator.instance_cache
+    id_store = IdMappingStore(config_dict['api_url'])
+    checkpointer = UploadCheckpointer.for_task(resumable, self.name, backup_name, testy_project_id, testy_plan_id,
+                                               progress=progress_recorder.items)
+    with checkpointer.task_transaction(), creator.instance_cache.log_stats_on_exit(self.name):
         logging.info('redis about to start')
         redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
         logging.info('redis started')
-        backup = json.loads(redis_client.get(backup_name))
+        with progress_recorder.measure('Loading backup'):
+            backup = json.loads(redis_client.get(backup_name))
+        creator.add_prefetched_attachments(backup.get('inline_attachments', {}), load_attachment_body)
 
         custom_fields_multi_select = parse_multi_select_from_tr(backup['custom_result_fields'])
         custom_fields_labels = parse_labels_from_tr_fields(backup['custom_result_fields'])
 
-        creator = TestyCreator(service_user_login, testy_attachment_url)
-
         mappings = {}
-        project = Project.objects.get(pk=testy_project_id)
+        progress_recorder.item_counter = partial(count_mapped_items, mappings)
+        project = creator.instance_cache.get(Project, testy_project_id)
 
         with progress_recorder.progress_context('Creating users'):
-            mappings['users'] = creator.create_users(backup['users'])
+            mappings['users'] = checkpointer.run_phase(
+                'users', id_store.create_missing, EntityType.USER, UserModel, backup['users'], creator.create_users
+            )
 
-        keys_without_mappings = ['suites', 'configs']
-        for key in keys_without_mappings:
-            with progress_recorder.progress_context(f'Creating {key}'):
-                create_method = getattr(creator, f'create_{key}')
-                mappings[key] = create_method(backup[key], project.id)
+        with progress_recorder.progress_context('Creating suites'):
+            mappings['suites'] = checkpointer.run_phase(
+                'suites', id_store.create_missing, EntityType.SUITE, TestSuite, backup['suites'], creator.create_suites,
+                project.id, testy_filters={'project_id': project.id}
+            )
+
+        with progress_recorder.progress_context('Creating configs'):
+            mappings['configs'] = checkpointer.run_phase(
+                'configs', creator.create_configs, backup['configs'], project.id
+            )
 
         with progress_recorder.progress_context('Creating sections'):
-            mappings['sections'] = creator.create_sections(backup['sections'], mappings['suites'], testy_project_id)
-
-        with progress_recorder.progress_context('Creating plans'):
-            mappings['plans'] = creator.create_plans(
-                plans=backup['plans'],
-                milestones_mappings=None,
-                project_id=testy_project_id,
-                skip_root_plans=False,
-                force_parent=True,
-                force_parent_id=testy_plan_id
+            mappings['sections'] = checkpointer.run_phase(
+                'sections', id_store.create_missing, EntityType.SECTION, TestSuite, backup['sections'],
+                creator.create_sections, mappings['suites'], project.id, testy_filters={'project_id': project.id},
+                pass_known_mappings=True
             )
 
         with progress_recorder.progress_context('Creating cases'):
-            mappings['cases'] = creator.create_cases(backup['cases'], mappings['suites'], mappings['sections'],
-                                                     project.id, config_dict['custom_fields_matcher'])
-
-        with progress_recorder.progress_context('Creating runs with plan as parent'):
-            mappings['tests_parent_plan'], mappings['runs_parent_plan'] = creator.create_runs(
-                runs=backup['runs_parent_plan'],
-                mapping=mappings['plans'],
-                config_mappings=mappings['configs'],
-                tests=backup['tests_parent_plan'],
-                case_mappings=mappings['cases'],
-                project_id=project.id,
-                upload_root_runs=True,
-                parent_type=ParentType.PLAN,
-                user_mappings=mappings['users']
+            mappings['cases'] = checkpointer.run_batched_phase(
+                'cases', backup['cases'], partial(id_store.create_missing, EntityType.CASE, TestCase),
+                creator.create_cases, mappings['suites'], mappings['sections'], project.id,
+                config_dict['custom_fields_matcher'], testy_filters={'project_id': project.id}
             )
 
-        with progress_recorder.progress_context('Creating results with plan as parent'):
-            mappings['results_parent_plan'] = creator.create_results(
-                backup['results_parent_plan'],
-                custom_fields_multi_select,
-                custom_fields_labels,
-                mappings['tests_parent_plan'],
-                mappings['users']
+        with progress_recorder.progress_context('Creating plans and runs'):
+            mappings.update(
+                checkpointer.run_phase(
+                    'plan_tree',
+                    creator.create_plan_tree,
+                    project_id=project.id,
+                    config_mappings=mappings['configs'],
+                    plans=backup['plans'],
+                    runs_parent_plan=backup['runs_parent_plan'],
+                    runs_parent_mile=backup['runs_parent_mile'],
+                    upload_root_runs=True,
+                    force_parent=True,
+                    force_parent_id=testy_plan_id,
+                )
             )
 
-        with progress_recorder.progress_context('Creating runs with mile as parent'):
-            mappings['tests_parent_mile'], mappings['runs_parent_mile'] = creator.create_runs(
-                runs=backup['runs_parent_mile'],
-                mapping=None,
-                config_mappings=mappings['configs'],
-                tests=backup['tests_parent_mile'],
-                case_mappings=mappings['cases'],
-                project_id=project.id,
-                upload_root_runs=True,
-                parent_type=ParentType.FORCE_PARENT,
-                user_mappings=mappings['users'],
-                force_parent_id=testy_plan_id
-            )
+        for key in ['parent_plan', 'parent_mile']:
+            with progress_recorder.progress_context(f'Creating tests with {key}'):
+                mappings[f'tests_{key}'] = checkpointer.run_phase(
+                    f'tests_{key}', creator.create_tests_for_runs, backup[f'tests_{key}'], mappings[f'runs_{key}'],
+                    mappings['cases'], project.id, mappings['users']
+                )
 
-        with progress_recorder.progress_context('Creating runs with mile as parent'):
-            mappings['results_parent_mile'] = creator.create_results(
-                backup['results_parent_mile'],
-                custom_fields_multi_select,
-                custom_fields_labels,
-                mappings['tests_parent_mile'],
-                mappings['users'],
-            )
+        for key in ['parent_plan', 'parent_mile']:
+            with progress_recorder.progress_context(f'Creating results with {key}'):
+                mappings[f'results_{key}'] = checkpointer.run_batched_phase(
+                    f'results_{key}',
+                    sorted(backup[f'results_{key}'], key=itemgetter('created_on')),
+                    creator.create_results,
+                    custom_fields_multi_select,
+                    custom_fields_labels,
+                    mappings[f'tests_{key}'],
+                    mappings['users']
+                )
         if not backup.get('attachments'):
-            return
+            finish_upload(checkpointer, id_store, mappings)
+            return progress_recorder.task_result()
         mappings['attachments'] = {}
         keys = [
-            ('cases', 'case_id', InstanceType.CASE),
-            ('plans', 'plan_id', InstanceType.PLAN),
-            ('runs_parent_plan', 'run_id', InstanceType.RUN),
-            ('runs_parent_mile', 'run_id', InstanceType.RUN),
+            ('cases', 'cases', 'case_id', InstanceType.CASE),
+            ('plans', 'plans', 'plan_id', InstanceType.PLAN),
+            ('runs_parent_plan', 'runs_parent_plan', 'run_id', InstanceType.RUN),
+            ('runs_parent_mile', 'runs_parent_mile', 'run_id', InstanceType.RUN),
+            ('tests_parent_plan', 'results_parent_plan', 'result_id', InstanceType.TEST),
+            ('tests_parent_mile', 'results_parent_mile', 'result_id', InstanceType.TEST),
         ]
 
-        testrail_client = TestRailClient(TestrailConfig(**config_dict))
+        testrail_client = TestRailClient(TestrailConfig(**config_dict), progress=progress_recorder.items)
 
-        for key, parent_key, instance_type in keys:
+        for key, mapping_key, parent_key, instance_type in keys:
             with progress_recorder.progress_context(f'Creating attachments for {key}'):
-                file_attachments = testrail_client.get_attachments_from_list(backup['attachments'][key], parent_key)
                 mappings['attachments'].update(
-                    creator.attachment_bulk_create(file_attachments, project, mappings['users'], parent_key,
-                                                   mappings[key], instance_type)
+                    checkpointer.run_batched_phase(
+                        f'attachments_{key}',
+                        id_store.without_reused_parents(
+                            id_store.mapping_key_entity_types[mapping_key], backup['attachments'][key], parent_key
+                        ),
+                        upload_attachments, creator, testrail_client, project, mappings['users'], parent_key,
+                        mappings[mapping_key], instance_type
+                    )
                 )
 
-        keys = [
-            ('parent_plan', 'result_id', InstanceType.TEST),
-            ('parent_mile', 'result_id', InstanceType.TEST)
-        ]
-
-        for key, parent_key, instance_type in keys:
-            with progress_recorder.progress_context(f'Creating attachments for {key}'):
-                file_attachments = testrail_client.get_attachments_from_list(
-                    backup['attachments'][f'tests_{key}'],
-                    parent_key
-                )
-                mappings['attachments'].update(
-                    creator.attachment_bulk_create(file_attachments, project, mappings['users'], parent_key,
-                                                   mappings[f'results_{key}'], instance_type)
-                )
         mappings['steps'] = get_fake_mapping_for_steps(mappings['cases'])
         mappings_keys = [
-            ('cases', TestCase, MigratorService.case_update, ['scenario', 'setup', 'description']),
-            ('steps', TestCaseStep, MigratorService.step_update, ['scenario', 'expected']),
-            ('results_parent_mile', TestResult, TestResultService().result_update, ['comment']),
-            ('results_parent_plan', TestResult, TestResultService().result_update, ['comment']),
+            ('cases', TestCase, ['scenario', 'setup', 'description']),
+            ('steps', TestCaseStep, ['scenario', 'expected']),
+            ('results_parent_mile', TestResult, ['comment']),
+            ('results_parent_plan', TestResult, ['comment']),
         ]
 
-        for mapping_key, model_class, update_method, field_list in mappings_keys:
+        for mapping_key, model_class, field_list in mappings_keys:
             with progress_recorder.progress_context(f'Looking for attachments in fields of {mapping_key}'):
-                creator.update_testy_attachment_urls_async(
-                    mappings[mapping_key],
-                    model_class,
-                    update_method,
-                    field_list,
-                    config_dict,
-                    mappings['attachments']
+                checkpointer.run_batched_phase(
+                    f'attachment_urls_{mapping_key}', sorted(mappings[mapping_key].items()), update_attachment_urls,
+                    creator, model_class, field_list, config_dict, mappings['attachments']
                 )
+        finish_upload(checkpointer, id_store, mappings)
+        return progress_recorder.task_result()
 
 
-def save_results_to_redis(results, backup_filename):
+def save_results_to_redis(results, backup_filename, migration_run: MigrationRun = None):
     results_json = json.dumps(results)
     redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
 
     logging.debug(f'REDIS CLIENT PING {redis_client.ping()}')
 
     backup_name = f'{backup_filename}{datetime.now()}'
-    TestrailBackup.objects.create(name=backup_name, filepath=backup_name)
+    backup = TestrailBackup.objects.create(name=backup_name, filepath=backup_name)
+    if migration_run:
+        migration_run.backup = backup
+        migration_run.save(update_fields=['backup', 'updated_at'])
     redis_client.set(backup_name, results_json)
 
     if not redis_client.get(backup_name):
         logging.debug('REDIS CLIENT GOT NOTHING')
+    return backup
+
+
+def get_attachments_for_key(testrail_client: TestRailClient, resulting_data, key, instance_type: InstanceType):
+    if instance_type == InstanceType.TEST:
+        return testrail_client.get_attachments_for_tests(
+            resulting_data[key],
+            resulting_data[key.replace('tests_', 'results_', 1)]
+        )
+    return testrail_client.get_attachments_for_instances(resulting_data[key], instance_type)
+
+
+def attachment_body_key(api_url, attachment_id):
+    return f'testrail_attachment:{api_url}:{attachment_id}'
+
+
+def save_attachment_bodies(testrail_client: TestRailClient, attachments_by_key, chunk_size: int = 200):
+    """
+    Download files of attachments and save them to redis next to backup.
+
+    Files are saved under keys of testrail instance and attachment id, so backups of the same instance share them.
+    Saved attachments get body_key, content_type and charset, upload reads file by body_key. Files expire after
+    ATTACHMENT_BODY_TTL, upload fetches expired ones from testrail again.
+
+    Args:
+        testrail_client: instance of TestRailClient
+        attachments_by_key: dict of backup key to list of testrail attachments
+        chunk_size: number of files held in memory at once
+    """
+    redis_client = get_redis_client()
+    for attachments in attachments_by_key.values():
+        for chunk in split_list_by_chunks(attachments, chunk_size):
+            file_attachments = testrail_client.get_attachments_from_list(chunk, None)
+            pipeline = redis_client.pipeline()
+            for attachment in chunk:
+                if not (file_attachment := file_attachments.get(attachment['id'])):
+                    continue
+                attachment['body_key'] = attachment_body_key(testrail_client.config.api_url, attachment['id'])
+                attachment['content_type'] = file_attachment['content_type']
+                attachment['charset'] = file_attachment['charset']
+                attachment['name'] = file_attachment['name']
+                attachment['size'] = file_attachment['size']
+                pipeline.set(attachment['body_key'], file_attachment['file_bytes'], ex=ATTACHMENT_BODY_TTL)
+            pipeline.execute()
+
+
+def load_attachment_body(attachment):
+    if not attachment.get('body_key'):
+        return None
+    return get_redis_client().get(attachment['body_key'])
+
+
+@lru_cache(maxsize=None)
+def get_redis_client():
+    return redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
+
+
+def get_inline_attachments(testrail_client: TestRailClient, resulting_data):
+    attachment_ids = set()
+    for key in INLINE_ATTACHMENT_KEYS:
+        attachment_ids.update(testrail_client.find_inline_attachment_ids(resulting_data.get(key, [])))
+    inline_attachments = [{'id': attachment_id} for attachment_id in sorted(attachment_ids)]
+    save_attachment_bodies(testrail_client, {'inline': inline_attachments})
+    return {attachment['id']: attachment for attachment in inline_attachments if attachment.get('body_key')}
+
+
+def save_http_metrics(task_id, http_metrics: HttpMetrics):
+    """
+    Save http metrics of task in prometheus text format to redis.
+
+    Args:
+        task_id: id of task
+        http_metrics: metrics of testrail requests made by task
+
+    Returns:
+        task result with metrics
+    """
+    get_redis_client().set(http_metrics_key(task_id), http_metrics.to_prometheus())
+    return {'http_metrics': http_metrics.as_dict()}
+
+
+def http_metrics_key(task_id):
+    return f'http_metrics:{task_id}'
+
+
+def count_items(data):
+    """Count elements of lists in downloaded data, nested dicts are counted too."""
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        return sum(count_items(value) for value in data.values())
+    return 0
+
+
+def count_mapped_items(mappings):
+    return sum(len(mapping) for mapping in mappings.values() if isinstance(mapping, dict))
+
+
+def save_part_to_redis(part_key, part):
+    redis_client = redis.StrictRedis(settings.REDIS_HOST, settings.REDIS_PORT)
+    redis_client.set(part_key, json.dumps(part), ex=DOWNLOAD_PART_TTL)
 
 
 def parse_multi_select_from_tr(testrail_custom_fields):
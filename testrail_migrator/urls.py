@@ -44,6 +44,7 @@ urlpatterns = [
     path('upload/milestones/', login_required(views.upload_milestones_view), name='upload-milestones'),
     path('upload/suites/', login_required(views.upload_suites_view), name='upload-suites'),
     path('upload/plans/', login_required(views.upload_plans_runs_view), name='upload-plans'),
+    path('migrate/project/', login_required(views.migrate_project_view), name='migrate-project'),
 
     path('configs/', login_required(views.TestrailSettingsListView.as_view()), name='settings-list'),
     path('configs/add/', login_required(views.TestrailSettingsCreateView.as_view()), name='settings-add'),
@@ -57,5 +58,13 @@ urlpatterns = [
     path('backups/', login_required(views.TestrailBackupListView.as_view()), name='backup-list'),
     path('backups/delete/<int:pk>/', login_required(views.TestrailBackupDeleteView.as_view()), name='backup-delete'),
 
-    path('task_status/<str:task_id>/', views.task_status, name='task_status')
+    path('task_status/<str:task_id>/', views.task_status, name='task_status'),
+    path('task_status/<str:task_id>/metrics/', login_required(views.task_http_metrics), name='task-http-metrics'),
+    path('task_status/<str:task_id>/phases/', login_required(views.task_phases), name='task-phases'),
+    path(
+        'task_status/<str:task_id>/profile/<str:kind>/',
+        login_required(views.task_cpu_profile),
+        name='task-cpu-profile'
+    ),
+    path('task_status/<str:task_id>/trace/', login_required(views.task_trace), name='task-trace'),
 ]
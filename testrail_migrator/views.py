@@ -29,6 +29,7 @@
 # For more information on this, and how to apply and follow the GNU AGPL, see
 # <http://www.gnu.org/licenses/>.
 from django.contrib.auth import get_user_model
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse, reverse_lazy
 from django.views.generic import CreateView, DeleteView, ListView, UpdateView
@@ -39,17 +40,24 @@ from .forms import (
     MigratorPlanRunDownloadForm,
     MigratorPlanRunUploadForm,
     MigratorProjectDownloadForm,
+    MigratorProjectMigrateForm,
     MigratorProjectUploadForm,
     MigratorSuiteDownloadForm,
     MigratorSuiteUploadForm,
     TestrailSettingsForm,
 )
-from .models import TestrailBackup, TestrailSettings
+from .migrator_lib.cpu_profile import CPU_PROFILE_KINDS, cpu_profile_key
+from .migrator_lib.tracing import trace_key
+from .models import MigrationRunPhase, TestrailBackup, TestrailSettings
 from .tasks import (
     download_milestone_task,
     download_plans_runs_task,
     download_suites_task,
     download_task,
+    estimate_download_task,
+    get_redis_client,
+    http_metrics_key,
+    migrate_task,
     upload_plans_runs_task,
     upload_suites_task,
     upload_task,
@@ -62,6 +70,42 @@ def task_status(request, task_id):
     return render(request, 'task_status.html', {'task_id': task_id})
 
 
+def task_http_metrics(request, task_id):
+    http_metrics = get_redis_client().get(http_metrics_key(task_id))
+    if http_metrics is None:
+        raise Http404('No http metrics were saved for task')
+    return HttpResponse(http_metrics, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def task_cpu_profile(request, task_id, kind):
+    if kind not in CPU_PROFILE_KINDS:
+        raise Http404('Unknown profile kind')
+    profile = get_redis_client().get(cpu_profile_key(task_id, kind))
+    if profile is None:
+        raise Http404('No cpu profile was saved for task')
+    response = HttpResponse(profile, content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="{task_id}.{CPU_PROFILE_KINDS[kind]}"'
+    return response
+
+
+def task_trace(request, task_id):
+    trace = get_redis_client().get(trace_key(task_id))
+    if trace is None:
+        raise Http404('No trace was saved for task')
+    response = HttpResponse(trace, content_type='application/json')
+    response['Content-Disposition'] = f'attachment; filename="{task_id}.trace.json"'
+    return response
+
+
+def task_phases(request, task_id):
+    phases = MigrationRunPhase.objects.filter(run__task_id=task_id).values(
+        'name', 'started_at', 'wall_time', 'cpu_time', 'items', 'throughput', 'query_count', 'db_time',
+        'duplicate_queries', 'top_queries', 'rss_start_mb', 'rss_end_mb', 'peak_rss_mb', 'traced_peak_mb',
+        'retained_mb', 'top_allocations'
+    )
+    return JsonResponse({'phases': list(phases)})
+
+
 class TestrailSettingsListView(ListView):
     model = TestrailSettings
     context_object_name = 'configs'
@@ -128,7 +172,10 @@ def download_suites_view(request):
             }
 
             task = download_suites_task.delay(project_id, config_dict, download_attachments, backup_filename,
-                                              testrail_suite_ids)
+                                              testrail_suite_ids,
+                                              profile_memory=form.cleaned_data.get('profile_memory'),
+                                              profile_cpu=form.cleaned_data.get('profile_cpu'),
+                                              trace=form.cleaned_data.get('trace'))
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(
         request, 'migrator_form.html', {
@@ -145,6 +192,7 @@ def upload_suites_view(request):
         form = MigratorSuiteUploadForm(request.POST)
         if form.is_valid():
             backup_instance = form.cleaned_data.get('testrail_backup')
+            resumable = form.cleaned_data.get('resumable')
             testrail_login = form.cleaned_data.get('testrail_login')
             testrail_password = form.cleaned_data.get('testrail_password')
             testrail_settings = form.cleaned_data.get('testrail_config')
@@ -162,6 +210,12 @@ def upload_suites_view(request):
                 backup_name=backup_instance.name,
                 config_dict=config_dict,
                 testy_attachment_url=testrail_settings.testy_attachments_url,
+                resumable=resumable,
+                count_queries=form.cleaned_data.get('count_queries'),
+                query_budgets=form.cleaned_data.get('query_budgets'),
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
             )
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(
@@ -199,7 +253,10 @@ def download_milestones_view(request):
                                                  config_dict,
                                                  download_attachments,
                                                  ignore_completed,
-                                                 backup_filename)
+                                                 backup_filename,
+                                                 profile_memory=form.cleaned_data.get('profile_memory'),
+                                                 profile_cpu=form.cleaned_data.get('profile_cpu'),
+                                                 trace=form.cleaned_data.get('trace'))
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(request, 'migrator_form.html', {
         'form': form,
@@ -214,7 +271,9 @@ def upload_milestones_view(request):
         form = MigratorMilestoneUploadForm(request.POST)
         if form.is_valid():
             backup_instance = form.cleaned_data.get('testrail_backup')
+            resumable = form.cleaned_data.get('resumable')
             upload_root_runs = form.cleaned_data.get('upload_root_runs')
+            parallel_workers = form.cleaned_data.get('parallel_workers') or 1
             testrail_login = form.cleaned_data.get('testrail_login')
             testrail_password = form.cleaned_data.get('testrail_password')
             testrail_settings = form.cleaned_data['testrail_config']
@@ -232,7 +291,14 @@ def upload_milestones_view(request):
                 config_dict=config_dict,
                 testy_project_id=testy_project_id,
                 testy_attachment_url=testrail_settings.testy_attachments_url,
-                upload_root_runs=upload_root_runs
+                upload_root_runs=upload_root_runs,
+                resumable=resumable,
+                count_queries=form.cleaned_data.get('count_queries'),
+                query_budgets=form.cleaned_data.get('query_budgets'),
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
+                parallel_workers=parallel_workers,
             )
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(
@@ -253,6 +319,7 @@ def download_project_view(request):
             download_attachments = form.cleaned_data['download_attachments']
             ignore_completed = form.cleaned_data['ignore_completed']
             backup_filename = form.cleaned_data['backup_filename']
+            fan_out = form.cleaned_data.get('fan_out')
             testrail_login = form.cleaned_data['testrail_login']
             testrail_password = form.cleaned_data['testrail_password']
             testrail_settings = form.cleaned_data['testrail_config']
@@ -264,8 +331,14 @@ def download_project_view(request):
                 'custom_fields_matcher': testrail_settings.custom_fields_matcher
             }
 
+            if form.cleaned_data.get('estimate_only'):
+                task = estimate_download_task.delay(project_id, config_dict, download_attachments, ignore_completed)
+                return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
             task = download_task.delay(project_id, config_dict, download_attachments, ignore_completed,
-                                       backup_filename)
+                                       backup_filename, fan_out=fan_out,
+                                       profile_memory=form.cleaned_data.get('profile_memory'),
+                                       profile_cpu=form.cleaned_data.get('profile_cpu'),
+                                       trace=form.cleaned_data.get('trace'))
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
 
     return render(
@@ -283,7 +356,9 @@ def upload_project_view(request):
         form = MigratorProjectUploadForm(request.POST)
         if form.is_valid():
             backup_instance = form.cleaned_data.get('testrail_backup')
+            resumable = form.cleaned_data.get('resumable')
             upload_root_runs = form.cleaned_data.get('upload_root_runs')
+            parallel_workers = form.cleaned_data.get('parallel_workers') or 1
             testrail_login = form.cleaned_data.get('testrail_login')
             testrail_password = form.cleaned_data.get('testrail_password')
             testrail_settings = form.cleaned_data['testrail_config']
@@ -299,7 +374,14 @@ def upload_project_view(request):
                 backup_name=backup_instance.name,
                 config_dict=config_dict,
                 testy_attachment_url=testrail_settings.testy_attachments_url,
-                upload_root_runs=upload_root_runs
+                upload_root_runs=upload_root_runs,
+                resumable=resumable,
+                count_queries=form.cleaned_data.get('count_queries'),
+                query_budgets=form.cleaned_data.get('query_budgets'),
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
+                parallel_workers=parallel_workers,
             )
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(
@@ -311,6 +393,51 @@ def upload_project_view(request):
     )
 
 
+def migrate_project_view(request):
+    form = MigratorProjectMigrateForm()
+    if request.method == 'POST':
+        form = MigratorProjectMigrateForm(request.POST)
+        if form.is_valid():
+            project_id = form.cleaned_data['project_id']
+            testy_project_id = form.cleaned_data.get('testy_project_id')
+            migrate_attachments = form.cleaned_data['migrate_attachments']
+            ignore_completed = form.cleaned_data['ignore_completed']
+            upload_root_runs = form.cleaned_data['upload_root_runs']
+            testrail_login = form.cleaned_data['testrail_login']
+            testrail_password = form.cleaned_data['testrail_password']
+            testrail_settings = form.cleaned_data['testrail_config']
+
+            config_dict = {
+                'login': testrail_login,
+                'password': testrail_password,
+                'api_url': testrail_settings.testrail_api_url,
+                'custom_fields_matcher': testrail_settings.custom_fields_matcher
+            }
+
+            task = migrate_task.delay(
+                project_id=project_id,
+                config_dict=config_dict,
+                upload_root_runs=upload_root_runs,
+                ignore_completed=ignore_completed,
+                migrate_attachments=migrate_attachments,
+                testy_attachment_url=testrail_settings.testy_attachments_url,
+                testy_project_id=testy_project_id,
+                count_queries=form.cleaned_data.get('count_queries'),
+                query_budgets=form.cleaned_data.get('query_budgets'),
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
+            )
+            return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
+    return render(
+        request, 'migrator_form.html', {
+            'form': form,
+            'button_label': 'Migrate project',
+            'page_title': 'Migrate project'
+        }
+    )
+
+
 def download_plans_runs_view(request):
     form = MigratorPlanRunDownloadForm()
     if request.method == 'POST':
@@ -338,7 +465,10 @@ def download_plans_runs_view(request):
                 download_attachments,
                 backup_filename,
                 plan_ids,
-                run_ids
+                run_ids,
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
             )
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))
     return render(request, 'migrator_form.html', {
@@ -354,6 +484,7 @@ def upload_plans_runs_view(request):
         form = MigratorPlanRunUploadForm(request.POST)
         if form.is_valid():
             backup_instance = form.cleaned_data.get('testrail_backup')
+            resumable = form.cleaned_data.get('resumable')
             testrail_login = form.cleaned_data.get('testrail_login')
             testrail_password = form.cleaned_data.get('testrail_password')
             testrail_settings = form.cleaned_data['testrail_config']
@@ -373,6 +504,12 @@ def upload_plans_runs_view(request):
                 testy_project_id=testy_project_id,
                 testy_plan_id=testy_plan_id,
                 testy_attachment_url=testrail_settings.testy_attachments_url,
+                resumable=resumable,
+                count_queries=form.cleaned_data.get('count_queries'),
+                query_budgets=form.cleaned_data.get('query_budgets'),
+                profile_memory=form.cleaned_data.get('profile_memory'),
+                profile_cpu=form.cleaned_data.get('profile_cpu'),
+                trace=form.cleaned_data.get('trace'),
             )
 
             return redirect(reverse('plugins:testrail_migrator:task_status', kwargs={'task_id': task.task_id}))